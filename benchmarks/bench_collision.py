@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Cost-to-solution of the collision operators.
+
+A lid-driven cavity at a fixed Reynolds number is run on grids of increasing size
+with every collision operator. For a fixed lid velocity *U* the viscosity follows from
+:math:`Re = U N / \\nu`, so coarse grids need a *tau* close to 1/2, where bgk gets unstable.
+Every run covers the same number of lid passes (*N / U* steps each),
+so runs on coarser grids need fewer lattice points and fewer time steps.
+
+For every operator the coarsest grid that stays stable is reported
+together with its wall time, and the time against the coarsest stable bgk run.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.bench_collision -R 1000 -n 32 48 64 96 128
+"""
+import argparse
+import time
+import numpy as np
+from benchmarks.common import setup_simulation
+
+
+def parse_arguments():
+    """
+    Parse commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-R', '--reynolds', type=float, default=1000,
+        help="Specify the Reynolds number of the cavity."
+    )
+    parser.add_argument(
+        '-n', '--grids', nargs='*', type=int, default=[32, 48, 64, 96, 128],
+        help="Specify the numbers of lattice points per side."
+    )
+    parser.add_argument(
+        '-c', '--collisions', nargs='*', type=str, default=["bgk", "trt", "mrt"],
+        help="Specify the collision operators."
+    )
+    parser.add_argument(
+        '-u', '--velocity', type=float, default=0.1,
+        help="Specify the velocity of the lid."
+    )
+    parser.add_argument(
+        '-l', '--passes', type=float, default=5,
+        help="Specify how often the lid passes the cavity during a run."
+    )
+    return parser.parse_args()
+
+
+def cavity_simulation(n, tau, collision, velocity):
+    """
+    Set up a lid-driven cavity.
+
+    :param n: lattice points per side
+    :param tau: relaxation parameter
+    :param collision: collision operator
+    :param velocity: velocity of the lid
+    :return: Simulation instance
+    """
+
+    return setup_simulation({
+        "simulation parameters": {
+            "simulation name": "cavity",
+            "simulation id": "000",
+            "time steps": 1,
+            "step offset": 0,
+            "lattice points x": n,
+            "lattice points y": n,
+            "tau": tau,
+            "collision": collision,
+        },
+        "obstacle parameters": [],
+        "boundary conditions": {
+            "N": {"type": "zou-he", "v_x": velocity, "v_y": 0},
+            "E": {"type": "bounce_back"},
+            "S": {"type": "bounce_back"},
+            "W": {"type": "bounce_back"}
+        },
+    })
+
+
+def run_case(n, collision, args, check_frequency=100):
+    """
+    Run the cavity until the end or until it gets unstable.
+
+    :param n: lattice points per side
+    :param collision: collision operator
+    :param args: commandline arguments
+    :param check_frequency: number of steps between two stability checks
+    :return: tau, number of steps, whether the run stayed stable, seconds
+    """
+
+    tau = 0.5 + 3 * args.velocity * n / args.reynolds
+    steps = int(args.passes * n / args.velocity)
+    sim = cavity_simulation(n, tau, collision, args.velocity)
+
+    t0 = time.perf_counter()
+    for step in range(1, steps + 1):
+        sim.do_simulation_step()
+        # a stable run stays well below the speed of sound
+        if step % check_frequency == 0 or step == steps:
+            speed = np.abs(sim.vel).max()
+            if not np.isfinite(speed) or speed > 5 * args.velocity:
+                return tau, step, False, time.perf_counter() - t0
+    return tau, steps, True, time.perf_counter() - t0
+
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+    print("%-6s %8s %10s %10s %8s %10s %10s" % (
+        "op", "grid", "tau", "steps", "stable", "time [s]", "MLUPS"))
+    coarsest = {}
+    for collision in args.collisions:
+        for n in sorted(args.grids):
+            tau, steps, stable, seconds = run_case(n, collision, args)
+            print("%-6s %8s %10.5f %10i %8s %10.2f %10.2f" % (
+                collision, "%ix%i" % (n, n), tau, steps, "yes" if stable else "no",
+                seconds, n * n * steps * 1e-6 / seconds
+            ))
+            if stable:
+                coarsest[collision] = (n, seconds)
+                break
+
+    print("\nCost to solution at Re = %g:" % args.reynolds)
+    for collision in args.collisions:
+        if collision not in coarsest:
+            print("%-6s no stable grid" % collision)
+            continue
+        n, seconds = coarsest[collision]
+        relative = ""
+        if "bgk" in coarsest:
+            relative = "%.2fx the time of bgk" % (seconds / coarsest["bgk"][1])
+        print("%-6s coarsest stable grid %ix%i in %.2f s %s" % (collision, n, n, seconds, relative))
+
+
+if __name__ == '__main__':
+    main()
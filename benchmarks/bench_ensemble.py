@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput report of ensembles.
+
+Measure the aggregate million lattice site updates per second (MLUPS)
+of all members of an ensemble against the number of members
+for the example inputfiles.
+One member corresponds to a single simulation.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.bench_ensemble -m 1 4 16
+"""
+import argparse
+import glob
+import os
+import time
+from benchmarks.common import load_simulation
+
+
+def parse_arguments():
+    """
+    Parse commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-i', '--input', nargs='*', type=str,
+        default=sorted(glob.glob(os.path.join("examples", "*.json"))),
+        help="Specify the inputfiles to take the setups from."
+    )
+    parser.add_argument(
+        '-m', '--members', nargs='*', type=int, default=[1, 4, 16],
+        help="Specify the numbers of ensemble members to measure."
+    )
+    parser.add_argument(
+        '-s', '--steps', type=int, default=20,
+        help="Specify the number of timed iteration steps."
+    )
+    return parser.parse_args()
+
+
+def measure(filename, members, steps):
+    """
+    Time iteration steps of an ensemble.
+
+    :param filename: path to the *.json* inputfile
+    :param members: number of ensemble members, 1 for a single simulation
+    :param steps: number of timed iteration steps
+    :return: million lattice site updates per second of all members together
+    """
+
+    sim = load_simulation(filename, {"ensemble members": members} if members > 1 else None)
+    sim.do_simulation_step()
+
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        sim.do_simulation_step()
+    t1 = time.perf_counter()
+
+    return sim.rho.size * steps * 1e-6 / (t1 - t0)
+
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+
+    print("%-30s %12s" % ("inputfile", "grid") +
+          "".join("%10s" % ("%i mem." % members) for members in args.members) +
+          "  [MLUPS]")
+    for filename in args.input:
+        mlups = [measure(filename, members, args.steps) for members in args.members]
+        sim = load_simulation(filename)
+        print("%-30s %12s" % (os.path.basename(filename), "%ix%i" % sim.shape) +
+              "".join("%10.2f" % value for value in mlups))
+
+
+if __name__ == '__main__':
+    main()
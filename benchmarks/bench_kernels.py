@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Kernel benchmark suite with regression tracking.
+
+Time every phase of a simulation step and whole steps of the backends
+for combinations of grid sizes, obstacles and boundary conditions:
+
+* obstacles: "none", "cylinder" (like the example), "packed" (a bed of cylinders)
+* boundaries: "channel" (zou-he inflow, outflow, walls), "cavity" (moving lid, walls), "periodic"
+
+The results can be written to a JSON file and compared with a stored baseline;
+kernels that got slower than the tolerance are reported and the suite exits with status 1,
+so slowdowns are caught before they reach production.
+Timings depend on the machine, so a baseline should be made on the machine it is compared on.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.bench_kernels -o baseline.json
+    $ python -m benchmarks.bench_kernels -c baseline.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import timeit
+import numpy as np
+from src import backends
+from src.profiling import PHASES
+from benchmarks.common import setup_simulation
+
+#: boundary conditions of the boundary mixes
+BOUNDARIES = {
+    "channel": {
+        "N": {"type": "bounce_back"},
+        "E": {"type": "outflow"},
+        "S": {"type": "bounce_back"},
+        "W": {"type": "zou-he", "v_x": 0.04, "v_y": 0}
+    },
+    "cavity": {
+        "N": {"type": "zou-he", "v_x": 0.05, "v_y": 0},
+        "E": {"type": "bounce_back"},
+        "S": {"type": "bounce_back"},
+        "W": {"type": "bounce_back"}
+    },
+    "periodic": {direction: {"type": "periodic"} for direction in "NESW"},
+}
+
+
+def parse_arguments():
+    """
+    Parse commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-g', '--grids', nargs='*', type=str, default=["100x100", "400x300", "1000x1000"],
+        help="Specify the grid sizes as NXxNY."
+    )
+    parser.add_argument(
+        '-O', '--obstacles', nargs='*', type=str, default=["none", "cylinder", "packed"],
+        choices=["none", "cylinder", "packed"],
+        help="Specify the obstacle setups."
+    )
+    parser.add_argument(
+        '-B', '--boundaries', nargs='*', type=str, default=sorted(BOUNDARIES),
+        choices=sorted(BOUNDARIES),
+        help="Specify the boundary condition mixes."
+    )
+    parser.add_argument(
+        '-b', '--backends', nargs='*', type=str, default=["numpy"],
+        help="Specify the backends whose whole steps are timed."
+    )
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=10,
+        help="Specify how often every kernel is timed."
+    )
+    parser.add_argument(
+        '-o', '--output', type=str,
+        help="Specify a JSON file to write the results to."
+    )
+    parser.add_argument(
+        '-c', '--compare', type=str,
+        help="Specify a JSON file with baseline results to compare with."
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.15,
+        help="Specify the relative slowdown against the baseline that counts as regression."
+    )
+    return parser.parse_args()
+
+
+def obstacle_parameters(obstacles, n_x, n_y):
+    """
+    Obstacle parameters of an obstacle setup.
+
+    :param obstacles: "none", "cylinder" or "packed"
+    :param n_x: lattice points x
+    :param n_y: lattice points y
+    :return: list of obstacle parameters like in an inputfile
+    """
+
+    if obstacles == "cylinder":
+        return [{"type": "cylindrical obstacle",
+                 "x-position": n_x // 4, "y-position": n_y // 2, "radius": n_y // 9}]
+    if obstacles == "packed":
+        # staggered cylinders that block about half of the domain
+        radius = 4
+        return [{"type": "cylindrical obstacle", "x-position": x, "y-position": y, "radius": radius}
+                for x in range(radius, n_x, 2 * radius + 2)
+                for y in range(radius + (x // (2 * radius + 2)) % 2 * (radius + 1), n_y,
+                               2 * radius + 2)]
+    return []
+
+
+def case_simulation(grid, obstacles, boundaries):
+    """
+    Set up the Simulation of a benchmark case.
+
+    :param grid: grid size as NXxNY
+    :param obstacles: "none", "cylinder" or "packed"
+    :param boundaries: name of a boundary condition mix
+    :return: Simulation instance
+    """
+
+    n_x, n_y = (int(points) for points in grid.split("x"))
+    return setup_simulation({
+        "simulation parameters": {
+            "simulation name": "benchmark",
+            "simulation id": "000",
+            "time steps": 1,
+            "step offset": 0,
+            "lattice points x": n_x,
+            "lattice points y": n_y,
+            "tau": 0.8,
+        },
+        "obstacle parameters": obstacle_parameters(obstacles, n_x, n_y),
+        "boundary conditions": BOUNDARIES[boundaries],
+    })
+
+
+def time_kernel(kernel, repeat, sample_time=0.005):
+    """
+    Time calls of a kernel.
+
+    Fast kernels are called several times per sample,
+    so every sample takes at least *sample_time* and the timer resolution does not matter.
+
+    :param kernel: function without arguments
+    :param repeat: number of samples
+    :param sample_time: minimal seconds per sample
+    :return: median and minimum of the seconds per call
+    """
+
+    timer = timeit.Timer(kernel)
+    number = max(1, int(sample_time / max(timer.timeit(number=1), 1e-9)))
+    times = [time / number for time in timer.repeat(number=number, repeat=repeat)]
+    return float(np.median(times)), min(times)
+
+
+def measure_case(grid, obstacles, boundaries, backend_names, repeat):
+    """
+    Time the phases and the whole steps of a benchmark case.
+
+    :param grid: grid size as NXxNY
+    :param obstacles: "none", "cylinder" or "packed"
+    :param boundaries: name of a boundary condition mix
+    :param backend_names: backends whose whole steps are timed
+    :param repeat: number of timed calls per kernel
+    :return: list of results, one per kernel
+    """
+
+    sim = case_simulation(grid, obstacles, boundaries)
+    case = {
+        "case": "%s/%s/%s" % (grid, obstacles, boundaries),
+        "grid": list(sim.shape),
+        "obstacles": obstacles,
+        "obstacle fraction": float(np.mean(sim.obstacle)),
+        "boundaries": boundaries,
+    }
+
+    results = []
+    sim.do_simulation_step()
+    for phase in PHASES:
+        median, minimum = time_kernel(getattr(sim, phase), repeat)
+        results.append(dict(case, kernel=phase, median=median, min=minimum))
+
+    for name in backend_names:
+        sim = case_simulation(grid, obstacles, boundaries)
+        backend = backends.get_backend(name)
+        backend.prepare(sim)
+        backend.step(sim)  # compiles JIT backends
+        median, minimum = time_kernel(lambda: backend.step(sim), repeat)
+        backend.finish(sim)
+        results.append(dict(case, kernel="step:" + backend.name, median=median, min=minimum))
+
+    for result in results:
+        result["mlups"] = sim.n_x * sim.n_y * 1e-6 / result["median"]
+    return results
+
+
+def environment():
+    """
+    Describe the machine and the software the results were measured with.
+
+    :return: dictionary
+    """
+
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def compare(results, baseline, tolerance, floor=1e-5):
+    """
+    Compare results with baseline results of the same cases and kernels.
+
+    The fastest calls are compared, they are least disturbed by other processes.
+
+    :param results: list of results
+    :param baseline: list of baseline results
+    :param tolerance: relative slowdown that counts as regression
+    :param floor: slowdowns of less seconds per call are ignored
+    :return: dictionary of the ratios current/baseline time by (case, kernel),
+        list of the (case, kernel) that regressed
+    """
+
+    reference = {(result["case"], result["kernel"]): result["min"] for result in baseline}
+    ratios = {}
+    regressions = []
+    for result in results:
+        key = (result["case"], result["kernel"])
+        if key in reference:
+            ratios[key] = result["min"] / reference[key]
+            if ratios[key] > 1 + tolerance and result["min"] - reference[key] > floor:
+                regressions.append(key)
+    return ratios, regressions
+
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    print("%-28s %-22s %12s %12s %10s %10s"
+          % ("case", "kernel", "median [ms]", "min [ms]", "MLUPS", "baseline"))
+    results = []
+    regressions = []
+    for grid in args.grids:
+        for obstacles in args.obstacles:
+            for boundaries in args.boundaries:
+                case_results = measure_case(grid, obstacles, boundaries, args.backends, args.repeat)
+                ratios, case_regressions = compare(case_results, baseline or [], args.tolerance)
+                for result in case_results:
+                    ratio = ratios.get((result["case"], result["kernel"]))
+                    print("%-28s %-22s %12.4f %12.4f %10.2f %10s" % (
+                        result["case"], result["kernel"], result["median"] * 1e3,
+                        result["min"] * 1e3, result["mlups"],
+                        "" if ratio is None else "%.2fx" % ratio +
+                        (" !" if (result["case"], result["kernel"]) in case_regressions else "")
+                    ))
+                results += case_results
+                regressions += case_regressions
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"environment": environment(), "results": results}, output_file, indent=1)
+
+    if baseline is not None:
+        print("\n%i kernels slower than the baseline by more than %i%%"
+              % (len(regressions), round(args.tolerance * 100)))
+        for case, kernel in regressions:
+            print("    %-28s %s" % (case, kernel))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy report of the single precision (float32) mode.
+
+Run the same setup in float32 and in float64 side by side
+and report the drift of the total mass of the float32 run
+against the float64 reference,
+together with the largest deviation of the velocity
+and the time per step of both runs.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.bench_precision -i examples/kaLB_example.json -s 4000
+"""
+import argparse
+import time
+import numpy as np
+from src import utilities
+from benchmarks.common import load_simulation
+
+
+def parse_arguments():
+    """
+    Parse commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-i', '--input', required=True, type=str,
+        help="Specify the inputfile to take the setup from."
+    )
+    parser.add_argument(
+        '-s', '--steps', type=int, default=1000,
+        help="Specify the number of iteration steps."
+    )
+    parser.add_argument(
+        '-f', '--frequency', type=int, default=100,
+        help="Specify the number of steps between two reports."
+    )
+    return parser.parse_args()
+
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+    sims = {
+        precision: load_simulation(args.input, {"precision": precision})
+        for precision in ("float64", "float32")
+    }
+    durations = dict.fromkeys(sims, 0.0)
+    initial_mass = utilities.total_mass(sims["float64"])
+
+    print("%8s %16s %16s %14s %14s" % (
+        "step", "mass float64", "mass float32", "mass drift", "max |du|"))
+    for step in range(1, args.steps + 1):
+        for precision, sim in sims.items():
+            t0 = time.perf_counter()
+            sim.do_simulation_step()
+            durations[precision] += time.perf_counter() - t0
+
+        if step % args.frequency == 0 or step == args.steps:
+            mass = {precision: utilities.total_mass(sim) for precision, sim in sims.items()}
+            fluid = ~sims["float64"].obstacle
+            vel_difference = np.abs(
+                sims["float32"].vel[:, fluid] - sims["float64"].vel[:, fluid]
+            ).max()
+            print("%8i %16.6f %16.6f %14.3e %14.3e" % (
+                step, mass["float64"], mass["float32"],
+                (mass["float32"] - mass["float64"]) / initial_mass, vel_difference
+            ))
+
+    for precision, duration in durations.items():
+        print("%s: %.2f ms per step" % (precision, duration / args.steps * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of the local grid refinement.
+
+A channel flow around a cylinder is run with a refinement block around the cylinder
+and its near wake (see src/refinement.py), and compared with
+
+* the coarse lattice alone
+* the same block with the coarse lattice computed everywhere, also inside the block,
+  which is what blocks of less than half the height of the lattice do
+* a uniformly fine lattice with half the spacing everywhere, which performs two steps
+  with :math:`\\tau_f = 2 \\tau_c - 1/2` per coarse step
+
+Every timing covers the same physical time, so the times are reported per coarse step.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.bench_refinement -x 400 -y 160 -s 100 -r 5
+"""
+import argparse
+import time
+from benchmarks.common import setup_simulation
+from src import backends
+from src import refinement
+
+
+def parse_arguments():
+    """
+    Parse commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-x', '--lattice_x', type=int, default=400,
+        help="Specify the number of coarse lattice points in x."
+    )
+    parser.add_argument(
+        '-y', '--lattice_y', type=int, default=160,
+        help="Specify the number of coarse lattice points in y."
+    )
+    parser.add_argument(
+        '-s', '--steps', type=int, default=100,
+        help="Specify the number of coarse steps per timing."
+    )
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help="Specify how often every case is timed, the fastest time is reported."
+    )
+    parser.add_argument(
+        '-b', '--block', nargs=4, type=int, default=None,
+        help="Specify the first and last gridpoints x and y of the block "
+             "(default: around the cylinder and its near wake, 3/4 of the height)."
+    )
+    parser.add_argument(
+        '-t', '--threads', type=int, default=1,
+        help="Specify the number of threads of the numpy backend."
+    )
+    parser.add_argument(
+        '--tau', type=float, default=0.6,
+        help="Specify the relaxation parameter of the coarse lattice."
+    )
+    return parser.parse_args()
+
+
+def channel_simulation(n_x, n_y, tau, scale=1):
+    """
+    Set up a channel with a cylinder at a quarter of its length.
+
+    :param n_x: coarse lattice points in x
+    :param n_y: coarse lattice points in y
+    :param tau: relaxation parameter
+    :param scale: lattice points per coarse lattice spacing, 2 for the uniformly fine lattice
+    :return: Simulation instance and its obstacle parameters
+    """
+
+    obstacle_parameters = [{
+        "type": "cylindrical obstacle", "x-position": scale * n_x // 4,
+        "y-position": scale * n_y // 2, "radius": scale * n_y // 10
+    }]
+    sim = setup_simulation({
+        "simulation parameters": {
+            "simulation name": "channel",
+            "simulation id": "000",
+            "time steps": 1,
+            "step offset": 0,
+            "lattice points x": scale * (n_x - 1) + 1,
+            "lattice points y": scale * (n_y - 1) + 1,
+            "tau": tau,
+        },
+        "obstacle parameters": obstacle_parameters,
+        "boundary conditions": {
+            "N": {"type": "bounce_back"},
+            "E": {"type": "outflow"},
+            "S": {"type": "bounce_back"},
+            "W": {"type": "zou-he", "v_x": 0.04, "v_y": 0}
+        },
+    })
+    return sim, obstacle_parameters
+
+
+def time_steps(sim, backend, steps):
+    """
+    Time steps of a simulation.
+
+    :param sim: Simulation instance
+    :param backend: prepared backend performing the steps
+    :param steps: number of steps
+    :return: seconds
+    """
+
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        backend.step(sim)
+    return time.perf_counter() - t0
+
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+    n_x, n_y = args.lattice_x, args.lattice_y
+    # around the cylinder and its near wake
+    block_range = args.block or [n_x // 8, n_x // 2, n_y // 8, 7 * n_y // 8]
+    block = {"x-range": block_range[:2], "y-range": block_range[2:]}
+    refined = (block_range[1] - block_range[0]) * (block_range[3] - block_range[2]) / (n_x * n_y)
+
+    # simulation, backend and steps per coarse step of every case
+    cases = {}
+    sim, _ = channel_simulation(n_x, n_y, args.tau)
+    cases["coarse"] = (sim, backends.get_backend("numpy", args.threads), 1)
+    for case in ("refined", "refined, coarse everywhere"):
+        sim, obstacle_parameters = channel_simulation(n_x, n_y, args.tau)
+        refinement.refinement_definition(sim, [block], obstacle_parameters)
+        if case != "refined":
+            sim.refinement_blocks[0].hole = None
+        backend = refinement.RefinedBackend(backends.get_backend("numpy", args.threads))
+        cases[case] = (sim, backend, 1)
+    sim, _ = channel_simulation(n_x, n_y, 2 * args.tau - 0.5, scale=2)
+    cases["uniformly fine"] = (sim, backends.get_backend("numpy", args.threads), 2)
+
+    # the cases take turns, so a slower phase of the machine affects all of them
+    seconds = dict.fromkeys(cases, float("inf"))
+    for sim, backend, _ in cases.values():
+        backend.prepare(sim)
+    for _ in range(args.repeat):
+        for case, (sim, backend, steps_per_step) in cases.items():
+            seconds[case] = min(
+                seconds[case],
+                time_steps(sim, backend, args.steps * steps_per_step) / args.steps
+            )
+    for sim, backend, _ in cases.values():
+        backend.finish(sim)
+
+    print("coarse lattice %ix%i, block %s x %s (%.0f%% of the lattice), %i threads\n" % (
+        n_x, n_y, block["x-range"], block["y-range"], 100 * refined, args.threads))
+    print("%-28s %16s %16s" % ("case", "ms/coarse step", "uniformly fine"))
+    for case, case_seconds in seconds.items():
+        print("%-28s %16.2f %15.2fx" % (
+            case, 1e3 * case_seconds, case_seconds / seconds["uniformly fine"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the streaming step.
+
+Compare the slice based stream_step of the Simulation
+with the former implementation that used one np.roll per direction.
+The simulations are set up from the example inputfiles,
+so grid sizes and boundary conditions match the real use cases.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.bench_streaming
+"""
+import argparse
+import glob
+import os
+import timeit
+import numpy as np
+from benchmarks.common import load_simulation
+
+
+def parse_arguments():
+    """
+    Parse commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-i', '--input', nargs='*', type=str,
+        default=sorted(glob.glob(os.path.join("examples", "*.json"))),
+        help="Specify the inputfiles to take the setups from."
+    )
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=20,
+        help="Specify how often every streaming step is timed."
+    )
+    return parser.parse_args()
+
+
+def roll_stream_step(sim):
+    """
+    Former streaming step, kept as reference: one np.roll per direction.
+
+    :param sim: Simulation instance
+    """
+
+    for i in range(9):
+        sim.f_in[i] = np.roll(sim.f_out[i], shift=sim.e[i], axis=(0, 1))
+
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+
+    print("%-30s %12s %12s %12s %8s" % ("inputfile", "grid", "np.roll", "slices", "speedup"))
+    for filename in args.input:
+        sim = load_simulation(filename)
+        sim.f_out[:] = sim.f_in
+
+        t_roll = min(timeit.repeat(lambda: roll_stream_step(sim), number=1, repeat=args.repeat))
+        t_slice = min(timeit.repeat(sim.stream_step, number=1, repeat=args.repeat))
+
+        print("%-30s %12s %10.2fms %10.2fms %7.1fx" % (
+            os.path.basename(filename), "%ix%i" % sim.shape,
+            t_roll * 1e3, t_slice * 1e3, t_roll / t_slice
+        ))
+
+
+if __name__ == '__main__':
+    main()
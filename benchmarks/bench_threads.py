@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling report of the threaded NumPy backend.
+
+Measure million lattice site updates per second (MLUPS)
+against the number of threads for the example inputfiles.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.bench_threads -t 1 2 4 8
+"""
+import argparse
+import glob
+import os
+import time
+from src import backends
+from benchmarks.common import load_simulation
+
+
+def parse_arguments():
+    """
+    Parse commandline arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-i', '--input', nargs='*', type=str,
+        default=sorted(glob.glob(os.path.join("examples", "*.json"))),
+        help="Specify the inputfiles to take the setups from."
+    )
+    parser.add_argument(
+        '-t', '--threads', nargs='*', type=int, default=[1, 2, 4],
+        help="Specify the numbers of threads to measure."
+    )
+    parser.add_argument(
+        '-s', '--steps', type=int, default=50,
+        help="Specify the number of timed iteration steps."
+    )
+    return parser.parse_args()
+
+
+def measure(filename, threads, steps):
+    """
+    Time iteration steps with the given number of threads.
+
+    :param filename: path to the *.json* inputfile
+    :param threads: number of threads
+    :param steps: number of timed iteration steps
+    :return: million lattice site updates per second
+    """
+
+    sim = load_simulation(filename)
+    backend = backends.get_backend("numpy", threads)
+    backend.prepare(sim)
+    backend.step(sim)
+
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        backend.step(sim)
+    t1 = time.perf_counter()
+    backend.finish(sim)
+
+    return sim.n_x * sim.n_y * steps * 1e-6 / (t1 - t0)
+
+
+def main():
+    """
+    Main function
+    """
+
+    args = parse_arguments()
+
+    print("%-30s %12s" % ("inputfile", "grid") +
+          "".join("%10s" % ("%i thr." % threads) for threads in args.threads) +
+          "  [MLUPS]")
+    for filename in args.input:
+        mlups = [measure(filename, threads, args.steps) for threads in args.threads]
+        sim = load_simulation(filename)
+        print("%-30s %12s" % (os.path.basename(filename), "%ix%i" % sim.shape) +
+              "".join("%10.2f" % value for value in mlups))
+
+
+if __name__ == '__main__':
+    main()
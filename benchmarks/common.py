@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions shared by the benchmarks.
+"""
+import argparse
+import json
+import os
+from src.d2q9_simulation import Simulation
+from src import utilities
+
+
+def load_simulation(filename, parameters=None):
+    """
+    Set up a Simulation from an inputfile without creating any output.
+
+    :param filename: path to the *.json* inputfile
+    :param parameters: dictionary of simulation parameters that replace those of the inputfile
+    :return: initialized Simulation instance
+    """
+
+    with open(filename) as json_file:
+        input_data = json.load(json_file)
+    input_data["simulation parameters"].update(parameters or {})
+
+    # obstacle files are given relative to the inputfile
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(filename)))
+    try:
+        return setup_simulation(input_data)
+    finally:
+        os.chdir(cwd)
+
+
+def setup_simulation(input_data):
+    """
+    Set up a Simulation from the content of an inputfile without creating any output.
+
+    :param input_data: dictionary with simulation parameters, obstacle parameters
+        and boundary conditions like in an inputfile
+    :return: initialized Simulation instance
+    """
+
+    sim = Simulation()
+    sim.args = argparse.Namespace(show_obstacle=False, snapshot=None, resume=False,
+                                  profile=False, profile_memory=False)
+    utilities.simulation_parameters_definition(sim, input_data["simulation parameters"])
+    utilities.obstacles_definition(sim, input_data["obstacle parameters"])
+    utilities.set_boundary_conditions(sim, input_data["boundary conditions"])
+    sim.prepare_simulation()
+    return sim
@@ -17,6 +17,7 @@ setup(
     ],
     extras_require={
         'doc': ['Sphinx >= 1.6.5'],
+        'numba': ['numba >= 0.36'],
     },
     classifiers=[
         'Programming Language :: Python :: 3',
@@ -0,0 +1,844 @@
+# -*- coding: utf-8 -*-
+"""
+Compute backends for the Simulation.
+
+A backend performs the iteration steps of a Simulation.
+The NumPy backend calls the methods of the Simulation one after another
+and is the reference implementation.
+Further backends are registered by name with :func:`register_backend`
+and can be selected with the *backend* simulation parameter
+or the *-\\-backend* commandline argument.
+
+Backends that depend on optional packages (like Numba)
+fall back to the NumPy backend if the package is not installed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src import utilities
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+#: all registered backends by name
+BACKENDS = {}
+
+
+def register_backend(name):
+    """
+    Class decorator to make a backend selectable by name.
+
+    :param name: name that is used in the inputfile and on the commandline
+    """
+
+    def decorator(backend_class):
+        backend_class.name = name
+        BACKENDS[name] = backend_class
+        return backend_class
+    return decorator
+
+
+def get_backend(name, threads=1):
+    """
+    Create the backend with the given name.
+
+    If the backend is not available on this system,
+    fall back to the NumPy backend.
+
+    :param name: name of a registered backend
+    :param threads: number of threads for the NumPy backend
+    :return: backend instance
+    """
+
+    if name not in BACKENDS:
+        print("ERROR: backend '%s' does not exist. Valid backends are: %s"
+              % (name, ", ".join(sorted(BACKENDS))))
+        quit()
+
+    backend_class = BACKENDS[name]
+    if not backend_class.available():
+        print("WARNING: backend '%s' is not available, falling back to 'numpy'" % name)
+        backend_class = BACKENDS["numpy"]
+
+    if threads > 1:
+        if backend_class is NumpyBackend:
+            return ThreadedBackend(threads)
+        print("WARNING: threads are only used by the 'numpy' backend")
+    return backend_class()
+
+
+class Backend():
+    """
+    Base class of all backends
+    """
+
+    #: name the backend is registered with
+    name = None
+
+    #: whether the backend performs the trt and mrt collisions, otherwise only bgk
+    matrix_collision = True
+
+    @staticmethod
+    def available():
+        """
+        Check if all packages the backend depends on are installed.
+
+        :return: *True* if the backend can be used
+        """
+        return True
+
+    def prepare(self, sim):
+        """
+        Precompute everything the backend needs, called once before the main loop.
+
+        :param sim: Simulation instance with initial distribution function
+        """
+
+    def step(self, sim):
+        """
+        Perform an iteration step.
+
+        By default the NumPy methods of the Simulation (see Simulation.do_simulation_step),
+        backends with their own kernels override it.
+
+        :param sim: Simulation instance
+        """
+        sim.do_simulation_step()
+
+    def synchronize(self, sim):
+        """
+        Bring the distribution function *f_in* into its canonical layout.
+
+        Called before output is stored and by :meth:`finish`;
+        only backends that keep *f_in* in another layout during the main loop need it.
+
+        :param sim: Simulation instance
+        """
+
+    def finish(self, sim):
+        """
+        Clean up after the main loop.
+
+        :param sim: Simulation instance
+        """
+
+
+@register_backend("numpy")
+class NumpyBackend(Backend):
+    """
+    Reference backend: the NumPy methods of the Simulation (the step of :class:`Backend`)
+    """
+
+
+class ThreadedBackend(NumpyBackend):
+    """
+    NumPy backend that runs every phase of a step in several threads.
+
+    The lattice is split into slabs along x and every thread
+    performs the NumPy methods of the Simulation on one slab.
+    Large NumPy operations release the GIL, so the threads run in parallel.
+    Streaming reads the post-collision values of the neighbouring slabs,
+    which are complete because every phase waits for all threads.
+    The work on the borders (zou-he, outflow) is small and done in the main thread.
+    All operations are element-wise, so the results are bit-identical to the serial ones.
+    """
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.executor = None
+
+    def prepare(self, sim):
+        bounds = np.linspace(0, sim.shape[0], self.threads + 1).round().astype(int)
+        self.slabs = [
+            slab_simulation(sim, x_start, x_stop)
+            for x_start, x_stop in zip(bounds[:-1], bounds[1:])
+        ]
+        self.stream_plans = [
+            restrict_stream_plan(sim.stream_plan, sim.shape[0], x_start, x_stop)
+            for x_start, x_stop in zip(bounds[:-1], bounds[1:])
+        ]
+        self.bounce_back_links = [
+            (source, destination, np.empty_like(sim.bounce_back_buffer, shape=source.shape))
+            for source, destination in zip(
+                np.array_split(sim.bounce_back_source, self.threads),
+                np.array_split(sim.bounce_back_destination, self.threads)
+            )
+        ]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def run(self, function, items):
+        """
+        Call a function for every item in the threads and wait for all of them.
+
+        :param function: function taking one item
+        :param items: list of items, one per thread
+        """
+
+        for _ in self.executor.map(function, items):
+            pass
+
+    def step(self, sim):
+        self.run(lambda slab: slab.calc_macroscopic(), self.slabs)
+        sim.correct_macroscopic()
+        self.run(lambda slab: slab.calc_equilibrium(), self.slabs)
+        sim.correct_distr_func()
+        self.run(lambda slab: slab.collision_step(), self.slabs)
+        self.run(lambda links: bounce_back_links(sim, *links), self.bounce_back_links)
+        self.run(lambda plan: stream(sim, plan), self.stream_plans)
+        sim.correct_outflow()
+
+    def finish(self, sim):
+        self.executor.shutdown()
+        self.executor = None
+
+
+def slab_simulation(sim, x_start, x_stop, y_start=0, y_stop=None):
+    """
+    Create a Simulation whose arrays are views on a slab of another Simulation.
+
+    Only the arrays needed by the element-wise methods are set;
+    every slab gets its own scratch buffers.
+
+    :param sim: Simulation instance
+    :param x_start: first lattice point x of the slab
+    :param x_stop: lattice point x after the slab
+    :param y_start: first lattice point y of the slab
+    :param y_stop: lattice point y after the slab, *None* for all lattice points y
+    :return: Simulation instance for the slab
+    """
+
+    window = (slice(x_start, x_stop), slice(y_start, y_stop))
+    slab = type(sim)()
+    slab.tau = sim.tau
+    slab.collision_matrix = sim.collision_matrix
+    slab.f_in = sim.f_in[(slice(None),) + window]
+    slab.f_eq = sim.f_eq[(slice(None),) + window]
+    slab.f_out = sim.f_out[(slice(None),) + window]
+    slab.rho = sim.rho[window]
+    slab.vel = sim.vel[(slice(None),) + window]
+    slab.vel_squared = np.empty_like(slab.rho)
+    slab.e_dot_vel = np.empty_like(slab.rho)
+    slab.scratch = np.empty_like(slab.rho)
+    return slab
+
+
+def restrict_stream_plan(stream_plan, n_x, x_start, x_stop, y_range=None):
+    """
+    Restrict a streaming plan to the destination gridpoints of a slab.
+
+    :param stream_plan: list of (destination, source) index tuples (see Simulation.stream_step)
+    :param n_x: lattice points x
+    :param x_start: first lattice point x of the slab
+    :param x_stop: lattice point x after the slab
+    :param y_range: lattice points y, first lattice point y and lattice point y after the slab,
+        *None* for all lattice points y
+    :return: list of (destination, source) index tuples
+    """
+
+    plan = []
+    for destination, source in stream_plan:
+        x_slices = restrict_slices(destination[1], source[1], n_x, x_start, x_stop)
+        y_slices = (destination[2], source[2])
+        if y_range is not None:
+            y_slices = restrict_slices(destination[2], source[2], *y_range)
+        if x_slices is not None and y_slices is not None:
+            plan.append((
+                (destination[0], x_slices[0], y_slices[0]),
+                (source[0], x_slices[1], y_slices[1])
+            ))
+    return plan
+
+
+def restrict_slices(destination, source, length, start, stop):
+    """
+    Restrict a destination slice and the shifted source slice along one axis.
+
+    :param destination: slice of the destination gridpoints
+    :param source: slice of the source gridpoints, shifted against the destination
+    :param length: number of lattice points along the axis
+    :param start: first lattice point of the range
+    :param stop: lattice point after the range
+    :return: destination and source slice, *None* if no destination is in the range
+    """
+
+    dst_start, dst_stop, _ = destination.indices(length)
+    src_start, _, _ = source.indices(length)
+    start = max(dst_start, start)
+    stop = min(dst_stop, stop)
+    if start >= stop:
+        return None
+    offset = src_start - dst_start
+    return slice(start, stop), slice(start + offset, stop + offset)
+
+
+def stream(sim, stream_plan):
+    """
+    Copy the blocks of a streaming plan from *f_out* into *f_in*.
+
+    :param sim: Simulation instance
+    :param stream_plan: list of (destination, source) index tuples
+    """
+
+    for destination, source in stream_plan:
+        sim.f_in[destination] = sim.f_out[source]
+
+
+def bounce_back_links(sim, source, destination, buffer):
+    """
+    Apply bounce back to a part of the obstacle-to-fluid links (see Simulation.bounce_back).
+
+    :param sim: Simulation instance
+    :param source: flat indices into *f_in*
+    :param destination: flat indices into *f_out*
+    :param buffer: array with the size of *source*
+    """
+
+    np.take(sim.f_in, source, out=buffer)
+    np.put(sim.f_out, destination, buffer)
+
+
+@register_backend("numba")
+class NumbaBackend(Backend):
+    """
+    Backend with a JIT-compiled kernel that fuses the bulk of a step.
+
+    Macroscopic values, equilibrium, collision, bounce back and streaming
+    are done in a single pass over the lattice.
+    *zou-he* and *outflow* borders are handled with the NumPy methods
+    of the Simulation before and after the kernel.
+    The kernel streams from *f_in* into *f_out*, then both are swapped.
+    """
+
+    matrix_collision = False
+
+    @staticmethod
+    def available():
+        return numba is not None
+
+    def prepare(self, sim):
+        # gridpoints whose macroscopic values are set by zou-he
+        sim.fixed_macroscopic = np.full(shape=sim.shape, fill_value=False)
+        for border, *_ in sim.zou_he_macroscopic_plan:
+            sim.fixed_macroscopic[border] = True
+
+        self.periodic = (sim.boundarys["E"] == "periodic", sim.boundarys["N"] == "periodic")
+        self.kernel = compile_fused_step()
+
+    def step(self, sim):
+        # zou-he borders: set macroscopic values and incoming components
+        sim.correct_macroscopic()
+        border_equilibrium(sim)
+        sim.correct_distr_func()
+
+        self.kernel(
+            sim.f_in, sim.f_out, sim.rho, sim.vel, sim.fixed_macroscopic, sim.obstacle,
+            sim.tau, sim.e, sim.e_inverse, sim.w, self.periodic[0], self.periodic[1]
+        )
+        sim.f_in, sim.f_out = sim.f_out, sim.f_in
+
+        sim.correct_outflow()
+
+
+def border_equilibrium(sim):
+    """
+    Calculate the equilibrium distribution function at *zou-he* borders only.
+
+    Same calculation as Simulation.calc_equilibrium,
+    restricted to the gridpoints correct_distr_func needs.
+
+    :param sim: Simulation instance
+    """
+
+    for index, *_ in sim.zou_he_macroscopic_plan:
+        rho = sim.rho[index]
+        vel_x = sim.vel[0][index]
+        vel_y = sim.vel[1][index]
+        vel_squared = 1.5 * (vel_x * vel_x + vel_y * vel_y)
+        for i in range(9):
+            e_dot_vel = sim.e[i, 0] * vel_x + sim.e[i, 1] * vel_y
+            sim.f_eq[i][index] = (
+                ((4.5 * e_dot_vel + 3) * e_dot_vel + 1 - vel_squared) * rho * sim.w[i]
+            )
+
+
+_fused_step = None
+
+
+def compile_fused_step():
+    """
+    JIT-compile the fused kernel on first use.
+
+    :return: compiled kernel
+    """
+
+    global _fused_step
+    if _fused_step is None:
+        _fused_step = numba.njit(parallel=True)(fused_step)
+    return _fused_step
+
+
+def fused_step(f_in, f_out, rho, vel, fixed, obstacle, tau, e, e_inverse, w,
+               periodic_x, periodic_y):
+    """
+    One iteration step for every gridpoint in a single pass.
+
+    Push-streams the post-collision values of every gridpoint into *f_out*.
+    Components that would stream from an obstacle into the fluid
+    are replaced by their inverse component (bounce back).
+    Components entering from outside a non-periodic border keep their value.
+
+    Plain Python, meant to be compiled with Numba (see :func:`compile_fused_step`).
+    """
+
+    n_x, n_y = rho.shape
+    for x in numba.prange(n_x):
+        for y in range(n_y):
+            # macroscopic values
+            if fixed[x, y]:
+                rho_xy = rho[x, y]
+                vel_x = vel[0, x, y]
+                vel_y = vel[1, x, y]
+            else:
+                rho_xy = 0.0
+                mom_x = 0.0
+                mom_y = 0.0
+                for i in range(9):
+                    rho_xy += f_in[i, x, y]
+                    mom_x += e[i, 0] * f_in[i, x, y]
+                    mom_y += e[i, 1] * f_in[i, x, y]
+                vel_x = mom_x / rho_xy
+                vel_y = mom_y / rho_xy
+                rho[x, y] = rho_xy
+                vel[0, x, y] = vel_x
+                vel[1, x, y] = vel_y
+            vel_squared = 1.5 * (vel_x * vel_x + vel_y * vel_y)
+            solid = obstacle[x, y]
+            border = x == 0 or y == 0 or x == n_x - 1 or y == n_y - 1
+
+            for i in range(9):
+                # equilibrium and collision
+                e_dot_vel = e[i, 0] * vel_x + e[i, 1] * vel_y
+                f_eq = ((4.5 * e_dot_vel + 3) * e_dot_vel + 1 - vel_squared) * rho_xy * w[i]
+                f_post = f_in[i, x, y] - (f_in[i, x, y] - f_eq) / tau
+
+                # streaming with bounce back
+                x_next = x + e[i, 0]
+                y_next = y + e[i, 1]
+                if border:
+                    inside = True
+                    if x_next < 0 or x_next >= n_x:
+                        x_next = x_next % n_x
+                        inside = inside and periodic_x
+                    if y_next < 0 or y_next >= n_y:
+                        y_next = y_next % n_y
+                        inside = inside and periodic_y
+                    if not inside:
+                        continue
+                if solid and not obstacle[x_next, y_next]:
+                    f_post = f_in[e_inverse[i], x, y]
+                f_out[i, x_next, y_next] = f_post
+
+            # components entering from outside a non-periodic border keep their value
+            if border:
+                for i in range(9):
+                    x_prev = x - e[i, 0]
+                    y_prev = y - e[i, 1]
+                    if ((not periodic_x and (x_prev < 0 or x_prev >= n_x)) or
+                            (not periodic_y and (y_prev < 0 or y_prev >= n_y))):
+                        f_out[i, x, y] = f_in[i, x, y]
+
+
+@register_backend("aa")
+class AABackend(NumbaBackend):
+    """
+    Backend that keeps a single distribution function (AA pattern).
+
+    *f_eq* and *f_out* are released during the main loop,
+    so the lattice needs a third of the memory of the other backends
+    and every step reads and writes *f_in* only once.
+    Even steps store the post-collision values of a gridpoint in place,
+    in the position of the inverse component;
+    odd steps read them from the neighbours and write the canonical layout again
+    (see :func:`aa_step`).
+    *zou-he* and *outflow* borders are handled with the NumPy methods of the Simulation
+    on small copies of the two outermost lines (see :func:`border_band`).
+    """
+
+    def prepare(self, sim):
+        super().prepare(sim)
+        self.kernel = compile_aa_step()
+        self.odd = False
+        self.zou_he_bands = []
+        self.outflow_bands = []
+        for direction, condition in sim.boundarys.items():
+            if condition in ("zou-he", "outflow"):
+                band, points = border_band(sim, direction)
+                bands = self.zou_he_bands if condition == "zou-he" else self.outflow_bands
+                bands.append((band, aa_positions(sim, points, self.periodic)))
+        sim.f_eq = None
+        sim.f_out = None
+
+    def step(self, sim):
+        # zou-he borders: set macroscopic values and incoming components
+        for band, positions in self.zou_he_bands:
+            np.take(sim.f_in, positions[self.odd], out=band.f_in)
+            band.correct_macroscopic()
+        for band, positions in self.zou_he_bands:
+            border_equilibrium(band)
+            np.take(sim.f_in, positions[self.odd], out=band.f_in)
+            band.correct_distr_func()
+            np.put(sim.f_in, positions[self.odd], band.f_in)
+
+        self.kernel(
+            sim.f_in, sim.rho, sim.vel, sim.fixed_macroscopic, sim.obstacle,
+            sim.tau, sim.e, sim.e_inverse, sim.w, self.odd, self.periodic[0], self.periodic[1]
+        )
+        self.odd = not self.odd
+
+        for band, positions in self.outflow_bands:
+            np.take(sim.f_in, positions[self.odd], out=band.f_in)
+            band.correct_outflow()
+            np.put(sim.f_in, positions[self.odd], band.f_in)
+
+    def synchronize(self, sim):
+        # after an even step: swap every post-collision value with the one it streams onto
+        if self.odd:
+            for destination, source in sim.stream_plan:
+                i = destination[0]
+                j = sim.e_inverse[i]
+                if i < j:
+                    buffer = sim.scratch[destination[1:]]
+                    np.copyto(buffer, sim.f_in[destination])
+                    sim.f_in[destination] = sim.f_in[(j,) + source[1:]]
+                    sim.f_in[(j,) + source[1:]] = buffer
+            self.odd = False
+
+    def finish(self, sim):
+        self.synchronize(sim)
+        sim.f_eq = np.empty_like(sim.f_in)
+        sim.f_out = np.empty_like(sim.f_in)
+
+
+def border_band(sim, direction):
+    """
+    Create a Simulation for the two outermost lines at a border.
+
+    Its *rho* and *vel* are views on the Simulation, its *f_in* and *f_eq* are small buffers
+    that backends with another storage layout gather into and scatter from.
+
+    :param sim: Simulation instance
+    :param direction: cardinal direction of the border
+    :return: Simulation instance for the band and the flat indices of its gridpoints
+    """
+
+    lines = slice(-2, None) if sim.last_indices[direction][0] < 0 else slice(0, 2)
+    if direction == "N" or direction == "S":
+        index = (slice(None), lines)
+    else:
+        index = (lines, slice(None))
+
+    band = type(sim)()
+    band.rho = sim.rho[index]
+    band.vel = sim.vel[(slice(None),) + index]
+    band.f_in = np.empty_like(sim.f_in, shape=(9,) + band.rho.shape)
+    band.f_eq = np.empty_like(band.f_in)
+    band.dtype = sim.dtype
+    band.batch_shape = sim.batch_shape
+    band.boundarys = {direction: sim.boundarys[direction]}
+    band.zou_he_conditions = sim.zou_he_conditions
+    band.opposite_directions = sim.opposite_directions
+    band.last_indices = sim.last_indices
+    utilities.compile_boundary_plan(band)
+    return band, np.arange(sim.rho.size).reshape(sim.shape)[index]
+
+
+def neighbours(sim, points, shift, periodic):
+    """
+    Find the gridpoints at a shift from other gridpoints.
+
+    :param sim: Simulation instance
+    :param points: flat indices of gridpoints into a (*n_x*, *n_y*) array
+    :param shift: shift along x and y
+    :param periodic: for x and y, whether values wrap around at the borders
+    :return: flat indices of the shifted gridpoints
+        and whether they lie inside the lattice
+    """
+
+    x, y = np.unravel_index(points, sim.shape)
+    x = x + shift[0]
+    y = y + shift[1]
+    inside = np.full(shape=points.shape, fill_value=True)
+    for wrap, coordinate, n in zip(periodic, (x, y), sim.shape):
+        if not wrap:
+            inside &= (coordinate >= 0) & (coordinate < n)
+    return np.ravel_multi_index((x, y), sim.shape, mode="wrap"), inside
+
+
+def aa_positions(sim, points, periodic):
+    """
+    Positions of the components of gridpoints in the single distribution function of the AA pattern.
+
+    Before an even step every component is at its canonical position;
+    before an odd step it is at the inverse component of the gridpoint it comes from.
+
+    :param sim: Simulation instance
+    :param points: flat indices of gridpoints into a (*n_x*, *n_y*) array
+    :param periodic: for x and y, whether values wrap around at the borders
+    :return: flat indices into *f_in* before even and before odd steps
+    """
+
+    n_points = sim.rho.size
+    even = np.empty(shape=(9,) + points.shape, dtype=np.intp)
+    odd = np.empty_like(even)
+    for i in range(9):
+        previous, inside = neighbours(sim, points, -sim.e[i], periodic)
+        even[i] = i * n_points + points
+        odd[i] = np.where(inside, sim.e_inverse[i] * n_points + previous, even[i])
+    return even, odd
+
+
+_aa_step = None
+
+
+def compile_aa_step():
+    """
+    JIT-compile the AA pattern kernel on first use.
+
+    :return: compiled kernel
+    """
+
+    global _aa_step
+    if _aa_step is None:
+        _aa_step = numba.njit(parallel=True)(aa_step)
+    return _aa_step
+
+
+def aa_step(f, rho, vel, fixed, obstacle, tau, e, e_inverse, w, odd, periodic_x, periodic_y):
+    """
+    One iteration step in place on a single distribution function (AA pattern).
+
+    Even steps read the components of a gridpoint from its own position
+    and write the post-collision value of component *i* to the position of its inverse.
+    Odd steps read component *i* from the inverse position of the gridpoint it comes from
+    and write the post-collision values to the gridpoints they stream to.
+    Every gridpoint reads and writes the same positions, so no other gridpoint is affected
+    and the kernel works in place in any order.
+    Components entering from outside a non-periodic border keep their value.
+
+    Plain Python, meant to be compiled with Numba (see :func:`compile_aa_step`).
+    """
+
+    n_x, n_y = rho.shape
+    for x in numba.prange(n_x):
+        f_node = np.empty(9, dtype=f.dtype)
+        for y in range(n_y):
+            border = x == 0 or y == 0 or x == n_x - 1 or y == n_y - 1
+
+            # read the components
+            for i in range(9):
+                f_node[i] = f[i, x, y]
+                if odd:
+                    x_prev = x - e[i, 0]
+                    y_prev = y - e[i, 1]
+                    inside = True
+                    if border:
+                        if x_prev < 0 or x_prev >= n_x:
+                            x_prev = x_prev % n_x
+                            inside = inside and periodic_x
+                        if y_prev < 0 or y_prev >= n_y:
+                            y_prev = y_prev % n_y
+                            inside = inside and periodic_y
+                    if inside:
+                        f_node[i] = f[e_inverse[i], x_prev, y_prev]
+
+            # macroscopic values
+            if fixed[x, y]:
+                rho_xy = rho[x, y]
+                vel_x = vel[0, x, y]
+                vel_y = vel[1, x, y]
+            else:
+                rho_xy = 0.0
+                mom_x = 0.0
+                mom_y = 0.0
+                for i in range(9):
+                    rho_xy += f_node[i]
+                    mom_x += e[i, 0] * f_node[i]
+                    mom_y += e[i, 1] * f_node[i]
+                vel_x = mom_x / rho_xy
+                vel_y = mom_y / rho_xy
+                rho[x, y] = rho_xy
+                vel[0, x, y] = vel_x
+                vel[1, x, y] = vel_y
+            vel_squared = 1.5 * (vel_x * vel_x + vel_y * vel_y)
+            solid = obstacle[x, y]
+
+            for i in range(9):
+                # equilibrium and collision
+                e_dot_vel = e[i, 0] * vel_x + e[i, 1] * vel_y
+                f_eq = ((4.5 * e_dot_vel + 3) * e_dot_vel + 1 - vel_squared) * rho_xy * w[i]
+                f_post = f_node[i] - (f_node[i] - f_eq) / tau
+
+                # write with bounce back, components leaving a non-periodic border are lost
+                x_next = x + e[i, 0]
+                y_next = y + e[i, 1]
+                if border:
+                    inside = True
+                    if x_next < 0 or x_next >= n_x:
+                        x_next = x_next % n_x
+                        inside = inside and periodic_x
+                    if y_next < 0 or y_next >= n_y:
+                        y_next = y_next % n_y
+                        inside = inside and periodic_y
+                    if not inside:
+                        continue
+                if solid and not obstacle[x_next, y_next]:
+                    f_post = f_node[e_inverse[i]]
+                if odd:
+                    f[i, x_next, y_next] = f_post
+                else:
+                    f[e_inverse[i], x, y] = f_post
+
+
+@register_backend("sparse")
+class SparseBackend(Backend):
+    """
+    NumPy backend that only stores the gridpoints taking part in the flow.
+
+    These are the fluid, the obstacle gridpoints with a bounce back link into the fluid
+    and the two outermost lines at *zou-he* and *outflow* borders.
+    They are packed into a Simulation of shape (*n*, 1), which performs the NumPy methods;
+    streaming gathers along a precomputed neighbour table (see :func:`sparse_stream`).
+    The cost of a step scales with the number of these gridpoints, not with the lattice,
+    which pays off for geometries that are mostly obstacle.
+    The lattice arrays of the Simulation are only updated when output is stored;
+    gridpoints inside obstacles keep their initial values.
+    """
+
+    def prepare(self, sim):
+        self.periodic = (sim.boundarys["E"] == "periodic", sim.boundarys["N"] == "periodic")
+        self.points = active_gridpoints(sim)
+        n_points = sim.rho.size
+        n_active = len(self.points)
+
+        # packed Simulation, position in it for every gridpoint of the lattice
+        self.packed = packed = type(sim)()
+        packed.tau = sim.tau
+        packed.collision_matrix = sim.collision_matrix
+        packed.dtype = sim.dtype
+        packed.shape = (n_active, 1)
+        utilities.allocate_lattice(packed)
+        packed_index = np.full(shape=n_points, fill_value=-1, dtype=np.intp)
+        packed_index[self.points] = np.arange(n_active)
+
+        self.f_positions = (np.arange(9)[:, None] * n_points + self.points)[..., None]
+        self.vel_positions = (np.arange(2)[:, None] * n_points + self.points)[..., None]
+        np.take(sim.f_in, self.f_positions, out=packed.f_in)
+
+        # neighbour table: components without a stored source keep their value
+        self.sources = np.empty(shape=(9, n_active), dtype=np.intp)
+        self.missing = []
+        for i in range(9):
+            previous, inside = neighbours(sim, self.points, -sim.e[i], self.periodic)
+            source = np.where(inside, packed_index[previous], -1)
+            missing = np.flatnonzero(source < 0)
+            source[missing] = missing
+            self.sources[i] = source
+            self.missing.append((missing, np.empty_like(packed.f_in, shape=missing.shape)))
+
+        # bounce back links of the lattice, translated into the packed Simulation
+        links = sim.bounce_back_destination % n_points
+        directions = sim.bounce_back_destination // n_points
+        packed.bounce_back_destination = directions * n_active + packed_index[links]
+        packed.bounce_back_source = sim.e_inverse[directions] * n_active + packed_index[links]
+        packed.bounce_back_buffer = np.empty_like(sim.bounce_back_buffer)
+
+        # borders are corrected on the lines of the lattice
+        self.zou_he_bands = []
+        self.outflow_bands = []
+        for direction, condition in sim.boundarys.items():
+            if condition in ("zou-he", "outflow"):
+                band, points = border_band(sim, direction)
+                positions = packed_index[points]
+                bands = self.zou_he_bands if condition == "zou-he" else self.outflow_bands
+                bands.append((band, (
+                    np.arange(9)[:, None, None] * n_active + positions,
+                    positions,
+                    np.arange(2)[:, None, None] * n_active + positions
+                )))
+
+        sim.calc_macroscopic()
+        sim.f_eq = None
+        sim.f_out = None
+
+    def step(self, sim):
+        packed = self.packed
+        packed.calc_macroscopic()
+
+        # zou-he borders: set macroscopic values and incoming components
+        for band, (f_positions, rho_positions, vel_positions) in self.zou_he_bands:
+            np.take(packed.f_in, f_positions, out=band.f_in)
+            np.take(packed.rho, rho_positions, out=band.rho)
+            np.take(packed.vel, vel_positions, out=band.vel)
+            band.correct_macroscopic()
+            np.put(packed.rho, rho_positions, band.rho)
+            np.put(packed.vel, vel_positions, band.vel)
+        packed.calc_equilibrium()
+        for band, (f_positions, _, _) in self.zou_he_bands:
+            np.take(packed.f_in, f_positions, out=band.f_in)
+            np.take(packed.f_eq, f_positions, out=band.f_eq)
+            band.correct_distr_func()
+            np.put(packed.f_in, f_positions, band.f_in)
+
+        packed.collision_step()
+        packed.bounce_back()
+        sparse_stream(packed, self.sources, self.missing)
+
+        for band, (f_positions, _, _) in self.outflow_bands:
+            np.take(packed.f_in, f_positions, out=band.f_in)
+            band.correct_outflow()
+            np.put(packed.f_in, f_positions, band.f_in)
+
+    def synchronize(self, sim):
+        np.put(sim.f_in, self.f_positions, self.packed.f_in)
+        np.put(sim.rho, self.points, self.packed.rho)
+        np.put(sim.vel, self.vel_positions, self.packed.vel)
+
+    def finish(self, sim):
+        self.synchronize(sim)
+        sim.f_eq = np.empty_like(sim.f_in)
+        sim.f_out = np.empty_like(sim.f_in)
+
+
+def active_gridpoints(sim):
+    """
+    Find the gridpoints a sparse simulation has to store.
+
+    :param sim: Simulation instance with boundary conditions already set
+    :return: sorted flat indices into a (*n_x*, *n_y*) array
+    """
+
+    active = ~sim.obstacle
+    active.ravel()[sim.bounce_back_source % active.size] = True
+    for direction, condition in sim.boundarys.items():
+        if condition in ("zou-he", "outflow"):
+            active.ravel()[border_band(sim, direction)[1].ravel()] = True
+    return np.flatnonzero(active)
+
+
+def sparse_stream(sim, sources, missing):
+    """
+    Streaming step of a packed Simulation with a neighbour table.
+
+    :param sim: packed Simulation instance of shape (*n*, 1)
+    :param sources: for every component and gridpoint the gridpoint it streams from
+    :param missing: for every component the gridpoints without source
+        and a buffer of the same size; these components keep their value
+    """
+
+    for i, (points, buffer) in enumerate(missing):
+        f_in = sim.f_in[i, :, 0]
+        np.take(f_in, points, out=buffer)
+        np.take(sim.f_out[i, :, 0], sources[i], out=f_in)
+        np.put(f_in, points, buffer)
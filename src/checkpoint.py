@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Rotating checkpoints and graceful stops.
+
+A checkpoint is a snapshot with metadata (see utilities.load_snapshot)
+in the directory *checkpoints* of the output.
+It is written by a background thread to a temporary file that is renamed when complete,
+so a killed simulation never leaves a partially written checkpoint behind.
+SIGTERM and SIGINT let the simulation finish its current step,
+write a final checkpoint and close its output.
+The final checkpoint is also written without *checkpoint* output,
+so every stopped simulation can be resumed.
+With *--resume* the simulation continues from the newest valid checkpoint.
+"""
+import json
+import os
+import signal
+import threading
+import numpy as np
+from src import utilities
+
+
+def checkpoint_directory(sim):
+    """
+    Directory of the checkpoints of a simulation.
+
+    :param sim: Simulation instance
+    :return: path of the directory
+    """
+
+    return sim.args.output + "checkpoints" + os.sep
+
+
+def list_checkpoints(directory):
+    """
+    Find the complete checkpoints in a directory.
+
+    The metadata file is renamed last, so only checkpoints that have one are complete.
+
+    :param directory: directory of the checkpoints
+    :return: list of (step, path to the *.npy* file), oldest first
+    """
+
+    if not os.path.isdir(directory):
+        return []
+    checkpoints = []
+    for name in os.listdir(directory):
+        if name.startswith("checkpoint_") and name.endswith(".json"):
+            checkpoints.append((int(name[len("checkpoint_"):-len(".json")]),
+                                directory + name[:-len(".json")] + ".npy"))
+    return sorted(checkpoints)
+
+
+def latest_checkpoint(directory):
+    """
+    Find the newest checkpoint that can be read.
+
+    :param directory: directory of the checkpoints
+    :return: path to the *.npy* file of the checkpoint, *None* if there is none
+    """
+
+    for _, path in reversed(list_checkpoints(directory)):
+        try:
+            np.load(path, mmap_mode="r")
+            with open(os.path.splitext(path)[0] + ".json") as metadata_file:
+                json.load(metadata_file)
+            return path
+        except (IOError, ValueError) as error:
+            print("WARNING: skipping the invalid checkpoint %s. " % path + str(error))
+    return None
+
+
+def resume(sim):
+    """
+    Set the initial distribution function from the newest valid checkpoint.
+
+    The step offset is set to the step of the checkpoint
+    and the remaining time steps are reduced by the steps done before.
+
+    :param sim: Simulation instance with allocated lattice
+    :return: *True* if a checkpoint was loaded
+    """
+
+    path = latest_checkpoint(checkpoint_directory(sim))
+    if path is None:
+        print("WARNING: no valid checkpoint was found, the simulation starts from the beginning.")
+        return False
+    first_step = sim.step_offset
+    utilities.load_snapshot(sim, path)
+    sim.timesteps -= sim.step_offset - first_step
+    print("Resuming from the checkpoint at step %i." % sim.step_offset)
+    return True
+
+
+class CheckpointManager():
+    """
+    Writes rotating checkpoints in a background thread.
+
+    The distribution function is copied into a buffer,
+    so the simulation goes on while the checkpoint is written.
+    Only the newest *keep* checkpoints are kept.
+    """
+
+    def __init__(self, sim):
+        """
+        Initialize the manager.
+
+        :param sim: Simulation instance with initialized output
+        """
+
+        self.sim = sim
+        self.directory = checkpoint_directory(sim)
+        self.thread = None
+        self.error = None
+        self.last_step = None
+        self.buffer = None
+        self.keep = sim.checkpoint_keep if sim.checkpoint else 1
+        if sim.checkpoint:
+            self.buffer = np.empty_like(sim.f_in)
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+    def submit(self, step):
+        """
+        Write a checkpoint if one is due at a step.
+
+        :param step: number specifying the current simulation step
+        """
+
+        sim = self.sim
+        if sim.checkpoint and utilities.step_due(sim, step, sim.checkpoint_frequency):
+            self.save(step)
+
+    def save(self, step, always=False):
+        """
+        Write a checkpoint of the current distribution function in the background.
+
+        Waits until the previous checkpoint is written.
+
+        :param step: number specifying the current simulation step
+        :param always: also write it without *checkpoint* output
+        """
+
+        if not (self.sim.checkpoint or always) or step == self.last_step:
+            return
+        self.wait()
+        if self.buffer is None:
+            self.buffer = np.empty_like(self.sim.f_in)
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+        np.copyto(self.buffer, self.sim.f_in)
+        metadata = utilities.snapshot_metadata(self.sim, step, self.buffer.dtype)
+        self.last_step = step
+        self.thread = threading.Thread(target=self.write, args=(metadata,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, step):
+        """
+        Write the final checkpoint of a stopped simulation.
+
+        :param step: number specifying the current simulation step
+        """
+
+        if not self.sim.checkpoint:
+            print("\nWriting a final checkpoint to %s, there is no checkpoint output."
+                  % self.directory)
+        self.save(step, always=True)
+
+    def write(self, metadata):
+        """
+        Write the buffer and its metadata atomically and remove old checkpoints.
+
+        Runs in the background thread; an error is reported by :meth:`wait`.
+
+        :param metadata: metadata of the checkpoint
+        """
+
+        path = self.directory + "checkpoint_%05i" % metadata["step"]
+        try:
+            with open(path + ".npy.tmp", "wb") as checkpoint_file:
+                np.save(checkpoint_file, self.buffer)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            os.replace(path + ".npy.tmp", path + ".npy")
+            with open(path + ".json.tmp", "w") as metadata_file:
+                json.dump(metadata, metadata_file, indent=4)
+                metadata_file.flush()
+                os.fsync(metadata_file.fileno())
+            os.replace(path + ".json.tmp", path + ".json")
+
+            checkpoints = list_checkpoints(self.directory)
+            for _, old_path in checkpoints[:max(len(checkpoints) - self.keep, 0)]:
+                os.remove(os.path.splitext(old_path)[0] + ".json")
+                os.remove(old_path)
+        except Exception as error:
+            self.error = error
+
+    def wait(self):
+        """
+        Wait until the current checkpoint is written and abort the simulation if that failed.
+        """
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            print("\nERROR: could not write checkpoint. Simulation was aborted.\n"
+                  + str(self.error))
+            quit()
+
+    def close(self):
+        """
+        Wait until the last checkpoint is written.
+        """
+
+        self.wait()
+
+
+class StopRequest():
+    """
+    Context manager that turns SIGTERM and SIGINT into a request
+    to stop the simulation after the current step.
+
+    A second signal stops the simulation immediately.
+    Signal handlers can only be installed in the main thread,
+    elsewhere the signals keep their handlers.
+    """
+
+    def __init__(self):
+        """
+        Initialize without a request.
+        """
+
+        self.requested = False
+        self.handlers = {}
+
+    def __enter__(self):
+        """
+        Install the signal handlers.
+        """
+
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                self.handlers[signum] = signal.signal(signum, self.request)
+        return self
+
+    def request(self, signum, frame):
+        """
+        Signal handler: request a stop, or stop immediately at the second signal.
+
+        :param signum: number of the signal
+        :param frame: current stack frame
+        """
+
+        if self.requested:
+            raise KeyboardInterrupt
+        self.requested = True
+        print("\nReceived signal %i: stopping after the current step." % signum)
+
+    def __exit__(self, *exception):
+        """
+        Restore the previous signal handlers.
+        """
+
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+        self.handlers = {}
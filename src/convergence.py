@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Steady-state convergence detection.
+
+With the optional *convergence* simulation parameter the velocity is compared
+every *check frequency* steps with the velocity of the previous check.
+The residual is the relative L2 change
+
+.. math:: r = \\frac{\\lVert \\vec{u}(t) - \\vec{u}(t - k) \\rVert_2}{\\lVert \\vec{u}(t) \\rVert_2}
+
+over the whole lattice (per ensemble member).
+As soon as the residual of every member is below the *threshold*,
+the simulation writes all of its output for the final step and stops,
+so the number of time steps only has to be an upper bound.
+The residuals of all checks are written into the group *convergence* of the hdf5 file.
+"""
+import numpy as np
+from src import utilities
+
+
+class ConvergenceMonitor():
+    """
+    Computes the residual of the velocity at the check steps and keeps their history.
+    """
+
+    def __init__(self, sim):
+        """
+        Initialize without history.
+
+        :param sim: Simulation instance with convergence parameters already set
+        """
+
+        self.sim = sim
+        self.enabled = sim.convergence_threshold is not None
+        self.steps = []
+        self.residuals = []
+        self.previous = None
+        self.difference = None
+        if self.enabled:
+            self.previous = np.empty_like(sim.vel)
+            self.difference = np.empty_like(sim.vel)
+        self.has_previous = False
+        self.converged_step = None
+
+    def due(self, step):
+        """
+        Check if the residual is computed at a step.
+
+        :param step: number specifying the simulation step
+        :return: *True* if the velocity is needed at this step
+        """
+
+        return self.enabled and utilities.step_due(self.sim, step, self.sim.convergence_frequency)
+
+    def check(self, step):
+        """
+        Compute the residual if it is due at a step.
+
+        The first check of a run only stores the velocity.
+
+        :param step: number specifying the simulation step
+        :return: *True* if the simulation converged at this step
+        """
+
+        if not self.due(step):
+            return False
+        sim = self.sim
+        if not self.has_previous:
+            np.copyto(self.previous, sim.vel)
+            self.has_previous = True
+            return False
+
+        # squared norms per ensemble member, without lattice-sized temporaries
+        axes = (0, 1, 2)
+        np.subtract(sim.vel, self.previous, out=self.difference)
+        np.square(self.difference, out=self.difference)
+        change = np.sum(self.difference, axis=axes, dtype=np.float64)
+        np.square(sim.vel, out=self.difference)
+        norm = np.sum(self.difference, axis=axes, dtype=np.float64)
+        np.copyto(self.previous, sim.vel)
+        residual = np.sqrt(change / np.maximum(norm, np.finfo(np.float64).tiny))
+
+        self.steps.append(step + sim.step_offset)
+        self.residuals.append(residual)
+        if np.all(residual < sim.convergence_threshold):
+            self.converged_step = step
+            return True
+        return False
+
+    def write_history(self):
+        """
+        Append the residuals to the group *convergence* of the hdf5 file of the raw data output.
+
+        A resumed simulation continues the history (see utilities.discard_output).
+        """
+
+        sim = self.sim
+        if not self.enabled or not sim.raw_output or not self.steps:
+            return
+        group = sim.h5_file.require_group("convergence")
+        residual_shape = sim.batch_shape
+        for name, values, shape, dtype in (
+                ("steps", self.steps, (), np.int64),
+                ("residual", self.residuals, residual_shape, np.float64)):
+            if name not in group:
+                group.create_dataset(name, shape=(0,) + shape, maxshape=(None,) + shape,
+                                     chunks=True, dtype=dtype)
+            dataset = group[name]
+            n_checks = dataset.shape[0]
+            dataset.resize(n_checks + len(values), axis=0)
+            dataset[n_checks:] = np.array(values, dtype=dtype)
+        group.attrs["threshold"] = sim.convergence_threshold
+        group.attrs["check frequency"] = sim.convergence_frequency
+        if self.converged_step is not None:
+            group.attrs["converged step"] = self.converged_step + sim.step_offset
+
+    def feedback(self):
+        """
+        Print the result of the convergence detection.
+        """
+
+        if not self.enabled:
+            return
+        if self.converged_step is not None:
+            print("\nConverged at step %i (residual %.3g < %g)." % (
+                self.converged_step + self.sim.step_offset,
+                np.max(self.residuals[-1]), self.sim.convergence_threshold
+            ))
+        elif self.residuals:
+            print("\nNot converged, last residual %.3g (threshold %g)."
+                  % (np.max(self.residuals[-1]), self.sim.convergence_threshold))
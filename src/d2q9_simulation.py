@@ -6,6 +6,14 @@ The Simulation is not intendet to run without its utilities, tho.
 import time
 import numpy as np
 from src import utilities
+from src import backends
+from src import parallel
+from src import writer
+from src import checkpoint
+from src import profiling
+from src import refinement
+from src import convergence
+from src import setup_cache
 
 
 class Simulation():
@@ -44,6 +52,28 @@ class Simulation():
     #: indices for directions-array that have no y component
     horizontal_indices = np.asarray([i for i, e_i in enumerate(e) if e_i[1] == 0])
 
+    #: indices for directions-array with positive and negative x (first) and y (second) component
+    momentum_indices = (
+        (np.flatnonzero(e[:, 0] > 0), np.flatnonzero(e[:, 0] < 0)),
+        (np.flatnonzero(e[:, 1] > 0), np.flatnonzero(e[:, 1] < 0))
+    )
+
+    #: floating point type of all lattice arrays
+    dtype = np.dtype(np.float64)
+
+    #: shape of the trailing ensemble axis of all lattice arrays, empty for a single simulation
+    batch_shape = ()
+
+    #: collision operator, the matrix of trt and mrt (see utilities.collision_definition)
+    collision = "bgk"
+    collision_matrix = None
+
+    #: refinement blocks (see refinement.refinement_definition)
+    refinement_blocks = ()
+
+    #: residual below which the simulation stops, *None* without convergence detection
+    convergence_threshold = None
+
     #: weights according to directions
     w = np.array([
         4 / 9,
@@ -70,9 +100,32 @@ class Simulation():
         if (inputfile is not None) and (args is not None):
             self.args = args
             utilities.simulation_parameters_definition(self, inputfile["simulation parameters"])
-            utilities.obstacles_definition(self, inputfile["obstacle parameters"])
-            utilities.set_boundary_conditions(self, inputfile["boundary conditions"])
+            cache = None
+            if args.setup_cache:
+                cache = setup_cache.SetupCache(args.setup_cache, args.setup_cache_size * 2**20)
+            setup_cache.geometry_definition(
+                self, inputfile["obstacle parameters"], inputfile["boundary conditions"], cache
+            )
+            refinement.refinement_definition(
+                self, inputfile.get("refinement", []), inputfile["obstacle parameters"]
+            )
             utilities.initialize_output(self, inputfile["output configuration"])
+            self.backend = backends.get_backend(args.backend or self.backend_name, args.threads)
+            if self.batch_shape and not isinstance(self.backend, backends.NumpyBackend):
+                print("WARNING: ensembles always use the 'numpy' backend")
+                self.backend = backends.get_backend("numpy", args.threads)
+            if self.collision_matrix is not None and not self.backend.matrix_collision:
+                print("WARNING: the '%s' backend only has the 'bgk' collision, "
+                      "using the 'numpy' backend" % self.backend.name)
+                self.backend = backends.get_backend("numpy", args.threads)
+            if self.refinement_blocks:
+                if args.processes > 1:
+                    print("ERROR: refinement blocks can not be used with several processes")
+                    quit()
+                if not isinstance(self.backend, backends.NumpyBackend):
+                    print("WARNING: refinement blocks always use the 'numpy' backend")
+                    self.backend = backends.get_backend("numpy", args.threads)
+                self.backend = refinement.RefinedBackend(self.backend)
 
         # create mockup Simulation
         elif (inputfile is None) and (args is None):
@@ -87,31 +140,29 @@ class Simulation():
         """
         pre-iteration: Set initial distribution function.
 
+        If resumed and a checkpoint exists:
+            Load initial distribution function, step offset and remaining time steps
+            from the newest checkpoint (see :func:`checkpoint.resume`)
         If snapshot is loaded:
-            Load initial distribution function from snapshot
+            Load initial distribution function and step offset from snapshot
+            (see :func:`utilities.load_snapshot`)
         Else:
             Set initial macroscopic values and
             calculate initial distribution function
         """
 
-        if self.args.snapshot:
-            try:
-                self.f_in = np.load(self.args.snapshot)
-                if self.step_offset == 0:
-                    print(
-                        """
-                        WARNING: Starting from a snapshot but 'step offset' was not changed.\n
-                        This will cause duplication in naming the steps in your output.\n
-                        """
-                    )
-            except IOError as error:
-                print("Error: could not open snapshot-file. Simulation was aborted.\n" + str(error))
-                quit()
+        if self.args.resume and checkpoint.resume(self):
+            pass
+        elif self.args.snapshot:
+            utilities.load_snapshot(self, self.args.snapshot)
         else:
             self.vel[:] = 0
             self.rho[:] = 1
             self.calc_equilibrium()
-            self.f_in = self.f_eq
+            np.copyto(self.f_in, self.f_eq)
+
+        if self.args.resume:
+            utilities.discard_output(self, self.step_offset)
 
     def calc_macroscopic(self):
         """
@@ -126,10 +177,19 @@ class Simulation():
                 \\rho(\\vec{x}) = \sum_{i} f_{i}(\\vec{x})
             .. math::
                 \\vec{u}(\\vec{x}) = \\frac{1}{\\rho}\sum_{i} f_{i}\\vec{e}_{i}
+
+        Both are written into the preallocated *rho* and *vel* arrays.
         """
 
-        self.rho = np.sum(self.f_in, axis=0)
-        self.vel = np.dot(self.e.T, self.f_in.transpose((1, 0, 2))) / self.rho
+        np.sum(self.f_in, axis=0, out=self.rho)
+        for axis, (positive, negative) in enumerate(self.momentum_indices):
+            # element-wise, so every gridpoint is summed in the same order
+            np.subtract(self.f_in[positive[0]], self.f_in[negative[0]], out=self.vel[axis])
+            for i in positive[1:]:
+                self.vel[axis] += self.f_in[i]
+            for i in negative[1:]:
+                self.vel[axis] -= self.f_in[i]
+            self.vel[axis] /= self.rho
 
     def correct_macroscopic(self):
         """
@@ -141,36 +201,16 @@ class Simulation():
         and calculate according density at these borders.
         """
 
-        # find all borders that are set to zou-he condition
-        for direction, condition in self.boundarys.items():
-            if condition == "zou-he":
-
-                # setup
-                last = self.last_indices[direction][0]
-                v_x, v_y = self.zou_he_conditions[direction]
-                direction_indices = self.direction_sets[direction]
-
-                # horizontal case
-                if direction == "N" or direction == "S":
-                    # set velocities at border to fixed values (from inputfile)
-                    self.vel[0, :, last] = v_x
-                    self.vel[1, :, last] = v_y
-
-                    # calculate according density at border
-                    f1 = np.sum(self.f_in[self.horizontal_indices, :, last], axis=0)
-                    f2 = np.sum(self.f_in[direction_indices, :, last], axis=0)
-                    self.rho[:, last] = f1 + (2 * f2) / (1 - self.vel[1, :, last])
-
-                # vertical case
-                elif direction == "E" or direction == "W":
-                    # set velocities at border to fixed values (from inputfile)
-                    self.vel[0, last, :] = v_x
-                    self.vel[1, last, :] = v_y
-
-                    # calculate according density at border
-                    f1 = np.sum(self.f_in[self.vertical_indices, last, :], axis=0)
-                    f2 = np.sum(self.f_in[direction_indices, last, :], axis=0)
-                    self.rho[last, :] = f1 + (2 * f2) / (1 - self.vel[0, last, :])
+        # borders and their precomputed terms (see utilities.compile_boundary_plan)
+        for border, vel_border, velocity, tangential, outgoing, divisor in (
+                self.zou_he_macroscopic_plan):
+            # set velocities at border to fixed values (from inputfile)
+            self.vel[vel_border] = velocity
+
+            # calculate according density at border
+            f1 = np.sum(self.f_in[tangential], axis=0)
+            f2 = np.sum(self.f_in[outgoing], axis=0)
+            self.rho[border] = f1 + f2 / divisor
 
     def calc_equilibrium(self):
         """
@@ -191,15 +231,29 @@ class Simulation():
                 \\right)
         """
 
-        vel_sqared = self.vel[0] * self.vel[0] + self.vel[1] * self.vel[1]
-        for i in range(9):  # loop is actually faster than NumPy for large arrays
-            e_n_x_vel = self.e[i, 0] * self.vel[0] + self.e[i, 1] * self.vel[1]
-            self.f_eq[i] = self.rho * self.w[i] * (
-                1 +
-                (3 * e_n_x_vel) +
-                (4.5 * e_n_x_vel * e_n_x_vel) -
-                (1.5 * vel_sqared)
-            )
+        # 1.5 * u.u, computed once into a scratch buffer
+        np.multiply(self.vel[0], self.vel[0], out=self.vel_squared)
+        np.multiply(self.vel[1], self.vel[1], out=self.scratch)
+        self.vel_squared += self.scratch
+        self.vel_squared *= 1.5
+
+        # plain Python numbers keep the precision of the arrays
+        directions = zip(self.e.tolist(), self.w.tolist())
+        for i, ((e_x, e_y), w_i) in enumerate(directions):  # loop is faster than NumPy
+            # e_i . u
+            np.multiply(self.vel[0], e_x, out=self.e_dot_vel)
+            np.multiply(self.vel[1], e_y, out=self.scratch)
+            self.e_dot_vel += self.scratch
+
+            # rho * w_i * (1 + e_i.u * (3 + 4.5 * e_i.u) - 1.5 * u.u), in place
+            f_eq_i = self.f_eq[i]
+            np.multiply(self.e_dot_vel, 4.5, out=f_eq_i)
+            f_eq_i += 3
+            f_eq_i *= self.e_dot_vel
+            f_eq_i += 1
+            f_eq_i -= self.vel_squared
+            f_eq_i *= self.rho
+            f_eq_i *= w_i
 
     def correct_distr_func(self):
         """
@@ -216,31 +270,11 @@ class Simulation():
         with *i*, *j* satisfying :math:`\\vec{e}_i = -\\vec{e}_j`.
         """
 
-        # find all borders that are set to zou-he condition
-        for direction, condition in self.boundarys.items():
-            if condition == "zou-he":
-
-                # setup
-                last = self.last_indices[direction][0]
-                opposite_direction = self.opposite_directions[direction]
-                opposite_direction_indices = self.direction_sets[opposite_direction]
-                matching_direction_indices = self.e_inverse[opposite_direction_indices]
-
-                # horizontal case
-                if direction == "N" or direction == "S":
-                    self.f_in[opposite_direction_indices, :, last] = (
-                        self.f_eq[opposite_direction_indices, :, last] +
-                        self.f_in[matching_direction_indices, :, last] -
-                        self.f_eq[matching_direction_indices, :, last]
-                    )
-
-                # vertical case
-                elif direction == "E" or direction == "W":
-                    self.f_in[opposite_direction_indices, last, :] = (
-                        self.f_eq[opposite_direction_indices, last, :] +
-                        self.f_in[matching_direction_indices, last, :] -
-                        self.f_eq[matching_direction_indices, last, :]
-                    )
+        # incoming and inverse components (see utilities.compile_boundary_plan)
+        for incoming, matching in self.zou_he_distr_plan:
+            self.f_in[incoming] = (
+                self.f_eq[incoming] + self.f_in[matching] - self.f_eq[matching]
+            )
 
     def collision_step(self):
         """
@@ -253,9 +287,25 @@ class Simulation():
 
             .. math::
                 f_i^* = f_i - \\frac{1}{\\tau} (f_i - f_i^{eq})
+
+        The *trt* and *mrt* collisions multiply the non-equilibrium part
+        with the precomputed *collision_matrix* :math:`C` instead:
+
+            .. math::
+                f_i^* = f_i - \\sum_j C_{ij} (f_j - f_j^{eq})
+
+        *f_eq* is used as buffer for the non-equilibrium part, it is not needed after the collision.
         """
 
-        self.f_out = self.f_in - (self.f_in - self.f_eq) / self.tau
+        if self.collision_matrix is None:
+            np.subtract(self.f_in, self.f_eq, out=self.f_out)
+            self.f_out /= self.tau
+            np.subtract(self.f_in, self.f_out, out=self.f_out)
+        else:
+            np.subtract(self.f_in, self.f_eq, out=self.f_eq)
+            np.matmul(self.collision_matrix, utilities.component_rows(self.f_eq),
+                      out=utilities.component_rows(self.f_out))
+            np.subtract(self.f_in, self.f_out, out=self.f_out)
 
     def bounce_back(self):
         """
@@ -275,10 +325,14 @@ class Simulation():
                 f_i^*(\\vec{x} = obstacle) := f_j(\\vec{x} = obstacle)
 
         with *i*, *j* satisfying :math:`\\vec{e}_i = -\\vec{e}_j`.
+
+        Only components that stream from the obstacle into the fluid are corrected.
+        Their flat indices are precomputed (see :func:`utilities.compile_bounce_back_links`),
+        so the cost scales with the surface of the obstacles, not their area.
         """
 
-        for i, j in enumerate(self.e_inverse):  # problem with NumPy. see Issue #9
-            self.f_out[i, self.obstacle] = self.f_in[j, self.obstacle]
+        np.take(self.f_in, self.bounce_back_source, out=self.bounce_back_buffer)
+        np.put(self.f_out, self.bounce_back_destination, self.bounce_back_buffer)
 
     def stream_step(self):
         """
@@ -290,10 +344,53 @@ class Simulation():
 
             .. math::
                 f_i^*(\\vec{x}) = f_i(\\vec{x} + \\vec{e}_i)
+
+        The shifted blocks are precomputed in *stream_plan*
+        (see :func:`utilities.compile_stream_plan`).
+        Values only wrap around at *periodic* borders;
+        incoming components at all other borders are left untouched,
+        they are set by the boundary conditions.
+        Collision (*f_in* to *f_out*) and streaming (*f_out* to *f_in*) already alternate
+        between the two preallocated buffers, so swapping them would not save a copy.
         """
 
-        for i in range(9):
-            self.f_in[i] = np.roll(self.f_out[i], shift=self.e[i], axis=(0, 1))
+        for destination, source in self.stream_plan:
+            self.f_in[destination] = self.f_out[source]
+
+    @staticmethod
+    def shift_slices(shift, periodic=(True, True)):
+        """
+        Translate a shift into pairs of slices.
+
+        Copying every *source* block of an array into the *destination* block
+        of another array has the same effect as
+        ``np.roll(array, shift=shift, axis=(0, 1))``, without allocating a
+        temporary copy.
+        Along an axis that is not periodic the wrapped-around block is omitted.
+
+        :param shift: shift along x and y, every component in {-1, 0, 1}
+        :param periodic: for x and y, whether values wrap around at the borders
+        :return: list of (destination, source) tuples of slices
+        """
+
+        axis_slices = []
+        for s, wrap in zip(shift, periodic):
+            if s == 0:
+                axis_slices.append([(slice(None), slice(None))])
+            elif s > 0:
+                axis_slices.append([(slice(s, None), slice(None, -s))])
+                if wrap:
+                    axis_slices[-1].append((slice(None, s), slice(-s, None)))
+            else:
+                axis_slices.append([(slice(None, s), slice(-s, None))])
+                if wrap:
+                    axis_slices[-1].append((slice(s, None), slice(None, -s)))
+
+        return [
+            ((dst_x, dst_y), (src_x, src_y))
+            for dst_x, src_x in axis_slices[0]
+            for dst_y, src_y in axis_slices[1]
+        ]
 
     def correct_outflow(self):
         """
@@ -306,29 +403,16 @@ class Simulation():
         from that same distribution function.
         """
 
-        # find all borders that are set to outflow condition
-        for direction, condition in self.boundarys.items():
-            if condition == "outflow":
-
-                # setup
-                opposite_direction = self.opposite_directions[direction]
-                opposite_direction_indices = self.direction_sets[opposite_direction]
-                last, second_to_last = self.last_indices[direction]
-
-                # horizontal case
-                if direction == "N" or direction == "S":
-                    self.f_in[opposite_direction_indices, :, last] = (
-                        self.f_in[opposite_direction_indices, :, second_to_last]
-                    )
-                # vertical case
-                elif direction == "E" or direction == "W":
-                    self.f_in[opposite_direction_indices, last, :] = (
-                        self.f_in[opposite_direction_indices, second_to_last, :]
-                    )
+        # incoming components and their neighbours (see utilities.compile_boundary_plan)
+        for incoming, neighbour in self.outflow_plan:
+            self.f_in[incoming] = self.f_in[neighbour]
 
     def do_simulation_step(self):
         """
         Perform an iteration step with the current Simulation
+
+        This is the NumPy reference implementation of a step;
+        run_simulation lets the selected backend perform the steps.
         """
 
         self.calc_macroscopic()
@@ -346,16 +430,82 @@ class Simulation():
         """
 
         self.prepare_simulation()
-
-        # main simulation loop
-        t0 = time.time()
-        for step in range(1, self.timesteps + 1):
-            self.do_simulation_step()
-            utilities.store_output(self, step)
-            if not self.args.no_progessbar:
-                utilities.progress_bar(step - 1, self.timesteps)
-        t1 = time.time()
+        output_writer = writer.OutputWriter(self, self.args.output_queue)
+        checkpoints = checkpoint.CheckpointManager(self)
+        monitor = convergence.ConvergenceMonitor(self)
+
+        def store_output(step, final=False):
+            output_writer.submit(step, final)
+            if final:
+                checkpoints.save(step)
+            else:
+                checkpoints.submit(step)
+
+        # measuring wrappers replace the methods only while profiling
+        profiler = None
+        if self.args.profile or self.args.profile_memory:
+            profiler = profiling.Profiler(self.args.profile_memory)
+            store_output = profiler.instrument(self, store_output)
+            profiler.start()
+
+        try:
+            # main simulation loop, split into slabs for several processes
+            if self.args.processes > 1:
+                if self.backend.name != "numpy":
+                    print("WARNING: parallel processes always use the 'numpy' backend")
+                with checkpoint.StopRequest() as stop:
+                    t0, t1 = parallel.run_parallel(
+                        self, self.args.processes, store_output, monitor, stop
+                    )
+                    if stop.requested:
+                        checkpoints.stop(self.timesteps)
+                        print("\nSimulation was stopped at step %i."
+                              % (self.timesteps + self.step_offset))
+                output_writer.close()
+
+            # main simulation loop, SIGTERM and SIGINT stop it after a step
+            else:
+                self.backend.prepare(self)
+                t0 = time.time()
+                with checkpoint.StopRequest() as stop:
+                    for step in range(1, self.timesteps + 1):
+                        self.backend.step(self)
+                        if (utilities.output_due(self, step) or stop.requested
+                                or monitor.due(step)):
+                            self.backend.synchronize(self)
+                        # a converged simulation writes all output and stops
+                        if monitor.check(step):
+                            store_output(step, final=True)
+                            self.timesteps = step
+                            break
+                        store_output(step)
+                        if stop.requested:
+                            checkpoints.stop(step)
+                            self.timesteps = step
+                            print("\nSimulation was stopped at step %i."
+                                  % (step + self.step_offset))
+                            break
+                        if not self.args.no_progessbar:
+                            utilities.progress_bar(step - 1, self.timesteps)
+                output_writer.close()
+                t1 = time.time()
+                self.backend.finish(self)
+            if profiler is not None:
+                profiler.stop()
+
+        # write everything that was submitted, also if the simulation was aborted
+        finally:
+            if profiler is not None:
+                profiler.restore()
+            output_writer.close()
+            checkpoints.close()
+            monitor.write_history()
+            utilities.close_output(self)
 
         # performance feedback
         if self.args.performance_feedback:
             utilities.give_powerfeedback(self, t0, t1)
+            output_writer.feedback()
+        monitor.feedback()
+        if profiler is not None:
+            profiler.report(self.args.output)
@@ -18,19 +18,45 @@ From the hdf5 files the density and the speed are read out
 and displayed in two independent videos.
 The plot settings are adapted for the kaLB example simulation
 and can be customized in the code for the desired problem.
+
+With *-\\-pipe* no temporary images are written:
+the frames are rendered with the lookup table of src/render.py (same colors, without title and axes)
+into raw RGB buffers and piped in order to ffmpeg.
+Both videos are encoded at the same time.
+
+Every worker process opens the hdf5 file read-only by itself
+and only reads the frames it renders.
+*-\\-start*, *-\\-stop* and *-\\-stride* select a part of the stored frames,
+e.g. for a quick preview of a long simulation.
 """
 
 from multiprocessing import Pool
 import argparse
+import collections
 import os
+import shutil
+import subprocess
+import threading
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
 import numpy as np
 import h5py
+from src import render, utilities
 
-# Set plot layout and higher resolution
-plt.style.use('bmh')
-plt.rcParams['figure.figsize'] = (16.0, 9.0)
+# hdf5 file and lookup table of the current process, see open_input
+source = {}
+
+
+def positive_int(value):
+    """
+    Argument type of numbers that have to be at least 1.
+    :param value: commandline argument
+    :return: the number
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("%s is not a positive number" % value)
+    return number
 
 
 def parse_arguments():
@@ -42,17 +68,85 @@ def parse_arguments():
         '-i', '--input', required=True, type=str,
         help="Specify path to input hdf5 file."
     )
+    parser.add_argument(
+        '-p', '--pipe', action='store_true',
+        help="Pipe raw frames to ffmpeg instead of writing temporary png files."
+    )
+    parser.add_argument(
+        '-a', '--ahead', type=int, default=2 * os.cpu_count(),
+        help="Specify the number of frames per video rendered in advance with --pipe."
+    )
+    parser.add_argument(
+        '--start', type=int, default=None,
+        help="Specify the first simulation step to make a frame of."
+    )
+    parser.add_argument(
+        '--stop', type=int, default=None,
+        help="Specify the simulation step before which the video ends."
+    )
+    parser.add_argument(
+        '--stride', type=positive_int, default=1,
+        help="Specify to use only every n-th stored frame."
+    )
     return parser.parse_args()
 
 
-def make_density_pictures(number):
+def open_input(path):
+    """
+    Open the hdf5 file read-only in the current process.
+    Runs once in every worker process of the pool.
+    :param path: path to the hdf5 file
+    """
+    # Set plot layout and higher resolution
+    plt.style.use('bmh')
+    plt.rcParams['figure.figsize'] = (16.0, 9.0)
+
+    source["file"] = h5py.File(path, 'r')
+    source["group"] = source["file"]['raw data output configuration']
+    source["lookup_table"] = render.lookup_table()
+    if 'steps' in source["group"]:
+        source["positions"] = {
+            int(step): position for position, step in enumerate(source["group"]['steps'][()])
+        }
+
+
+def read_frame(field, step):
+    """
+    Read a single frame of the raw data output in the current process.
+    :param field: "velocity" or "density"
+    :param step: simulation step of the frame
+    :return: array of the frame
+    """
+    if isinstance(source["group"][field], h5py.Dataset):
+        return source["group"][field][source["positions"][step]]
+    return source["group"][field]["%i" % step][()]
+
+
+def select_steps(group, field, start=None, stop=None, stride=1):
+    """
+    Select the stored steps of a field to make frames of.
+    :param group: hdf5 group *raw data output configuration*
+    :param field: "velocity" or "density"
+    :param start: first simulation step, *None* for the first stored step
+    :param stop: simulation step before which the selection ends, *None* for no limit
+    :param stride: take every n-th of the stored steps in range
+    :return: sorted list of the selected steps
+    """
+    steps, _ = utilities.raw_output_frames(group, field)
+    steps = [step for step in steps
+             if (start is None or step >= start) and (stop is None or step < stop)]
+    return steps[::stride]
+
+
+def make_density_pictures(number, step):
     """
     The plot command for the density
     At this point you can change the settings for the plot.
     :param number: number of the picture to be made. The pictures are listed with ascending number.
+    :param step: simulation step of the picture
     """
-    plt.imshow(np.array(density_values[number]).T, origin="lower")
-    plt.title("t = %i" % velocity_names[number])
+    plt.imshow(read_frame('density', step).T, origin="lower")
+    plt.title("t = %i" % step)
     plt.xlabel("x")
     plt.ylabel("y")
     plt.tight_layout()
@@ -60,16 +154,17 @@ def make_density_pictures(number):
     plt.cla()
 
 
-def make_velocity_pictures(number):
+def make_velocity_pictures(number, step):
     """
     The plot command for the speed
     At this point you can change the settings for the plot.
     :param number: number of the picture to be made. The pictures are listed with ascending number.
+    :param step: simulation step of the picture
     """
-    plt.imshow(np.sqrt(np.array(velocity_values[number][0]) ** 2 +
-                       np.array(velocity_values[number][1]) ** 2).T,
+    velocity = read_frame('velocity', step)
+    plt.imshow(np.sqrt(velocity[0] ** 2 + velocity[1] ** 2).T,
                norm=LogNorm(vmin=1e-3, vmax=1e-1), origin="lower")
-    plt.title("t = %i" % velocity_names[number])
+    plt.title("t = %i" % step)
     plt.xlabel("x")
     plt.ylabel("y")
     plt.tight_layout()
@@ -77,70 +172,156 @@ def make_velocity_pictures(number):
     plt.cla()
 
 
-# security check so that no files are overwritten
-if os.path.isfile("clip_density.mp4"):
-    print("file clip_density.mp4 already exists. Please rename it and start again.")
-    quit()
-if os.path.isfile("clip_velocity.mp4"):
-    print("file clip_velocity.mp4 already exists. Please rename it and start again.")
-    quit()
-
-# hdf5 file is read.
-args = parse_arguments()
-f = h5py.File(args.input, 'r')
-a_group_key = list(f.keys())
-
-# Values are read for the density and for speed and names are given.
-if 'raw data output configuration' in a_group_key:
-
-    if 'density' in list(f['raw data output configuration']):
-        density_values = []
-        density_names = list(f['raw data output configuration']['density'])
-        for i, name in enumerate(density_names):
-            density_names[i] = int(name)
-        for i in f['raw data output configuration']['density']:
-            density_values.append(f['raw data output configuration']['density'][i])
-        density_values = [x for y, x in sorted(zip(density_names, density_values))]
-        density_names.sort()
-
-    if 'velocity' in list(f['raw data output configuration']):
-        velocity_values = []
-        velocity_names = list(f['raw data output configuration']['velocity'])
-        for i, name in enumerate(velocity_names):
-            velocity_names[i] = int(name)
-        for i in f['raw data output configuration']['velocity']:
-            velocity_values.append(f['raw data output configuration']['velocity'][i])
-        velocity_values = [x for y, x in sorted(zip(velocity_names, velocity_values))]
-        velocity_names.sort()
-
-# a folder for the images is created temporarily
-if not os.path.exists("temp_png_to_mp4"):
-    os.makedirs("temp_png_to_mp4")
-
-# images are created in parallel
-pool = Pool()
-print("\n Start building density pictures: 0% done \n")
-pool.map(make_density_pictures, range(len(density_values)))
-print("\n Start building velocity pictures: 40% done \n")
-pool.map(make_velocity_pictures, range(len(velocity_values)))
-
-# images are processed into videos
-if os.path.isfile("clip_density.mp4"):
-    print("file clip_density.mp4 already exists. Please rename it and start again.")
-else:
-    print("\n Start building density video: 80% done \n")
-    os.system(
-        "ffmpeg -r 30 -i ./temp_png_to_mp4/density_%01d.png -vb 10M ./clip_density.mp4")
-if os.path.isfile("clip_velocity.mp4"):
-    print("file clip_velocity.mp4 already exists. Please rename it and start again.")
-else:
-    print("\n Start building velocity video: 90% done \n")
-    os.system(
-        "ffmpeg -r 30 -i ./temp_png_to_mp4/velocity_%01d.png -vb 10M ./clip_velocity.mp4")
-
-# Delete the images and the temporary folder
-for root, dirs, files in os.walk("temp_png_to_mp4", topdown=False):
-    for name in files:
-        os.remove(os.path.join(root, name))
-os.rmdir("temp_png_to_mp4")
-print("\n Everything ready: 100% done \n")
+def render_density_frame(step):
+    """
+    Render a density frame for the ffmpeg pipe with the colors of make_density_pictures.
+    :param step: simulation step of the frame
+    :return: raw RGB bytes of the frame
+    """
+    density = read_frame('density', step)
+    vmin = density.min()
+    vmax = density.max() if density.max() > vmin else vmin + 1
+    return render.render_frame(density, vmin, vmax, source["lookup_table"]).tobytes()
+
+
+def render_velocity_frame(step):
+    """
+    Render a speed frame for the ffmpeg pipe with the colors of make_velocity_pictures.
+    The logarithmic norm is a linear mapping of the logarithm of the speed.
+    :param step: simulation step of the frame
+    :return: raw RGB bytes of the frame
+    """
+    velocity = read_frame('velocity', step)
+    with np.errstate(divide="ignore"):
+        log_speed = 0.5 * np.log10(velocity[0] ** 2 + velocity[1] ** 2)
+    return render.render_frame(log_speed, -3, -1, source["lookup_table"]).tobytes()
+
+
+def encode_video(pool, render_frame, steps, shape, filename, ahead):
+    """
+    Render frames in the pool and pipe them in order to ffmpeg.
+    Up to *ahead* frames are rendered in advance. Finished frames wait in this
+    bounded reorder buffer until all previous frames have been written.
+    :param pool: process pool rendering the frames
+    :param render_frame: function returning the raw RGB bytes of the frame of a step
+    :param steps: simulation steps of the frames
+    :param shape: lattice points x and y of a frame
+    :param filename: name of the video
+    :param ahead: number of frames rendered in advance
+    """
+    ffmpeg = subprocess.Popen(
+        ["ffmpeg", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "%ix%i" % shape, "-r", "30",
+         "-i", "-", "-vb", "10M", filename],
+        stdin=subprocess.PIPE
+    )
+    pending = collections.deque()
+    try:
+        for step in steps:
+            pending.append(pool.apply_async(render_frame, (step,)))
+            if len(pending) >= ahead:
+                ffmpeg.stdin.write(pending.popleft().get())
+        while pending:
+            ffmpeg.stdin.write(pending.popleft().get())
+    except BrokenPipeError:
+        print("ERROR: ffmpeg stopped before %s was complete." % filename)
+    finally:
+        try:
+            ffmpeg.stdin.close()
+        except BrokenPipeError:
+            pass
+        ffmpeg.wait()
+
+
+def main():
+    """
+    Main function
+    """
+
+    # security check so that no files are overwritten
+    if os.path.isfile("clip_density.mp4"):
+        print("file clip_density.mp4 already exists. Please rename it and start again.")
+        quit()
+    if os.path.isfile("clip_velocity.mp4"):
+        print("file clip_velocity.mp4 already exists. Please rename it and start again.")
+        quit()
+
+    # only the steps and the shape of the frames are read here, the workers read the frames.
+    # Both layouts of the raw data output are supported (see utilities.raw_output_frames).
+    args = parse_arguments()
+    with h5py.File(args.input, 'r') as f:
+        if 'raw data output configuration' not in f:
+            print("ERROR: %s holds no raw data output." % args.input)
+            quit()
+        group = f['raw data output configuration']
+        if 'density' not in group or 'velocity' not in group:
+            print("ERROR: %s holds no density and velocity frames. "
+                  "Ensemble members are not supported." % args.input)
+            quit()
+        density_steps = select_steps(group, 'density', args.start, args.stop, args.stride)
+        velocity_steps = select_steps(group, 'velocity', args.start, args.stop, args.stride)
+        if not density_steps or not velocity_steps:
+            print("ERROR: no frames were selected.")
+            quit()
+        _, density_frames = utilities.raw_output_frames(group, 'density')
+        shape = density_frames[0].shape[-2:]
+
+    if args.pipe and shutil.which("ffmpeg") is None:
+        print("ERROR: ffmpeg was not found.")
+        quit()
+
+    pool = Pool(initializer=open_input, initargs=(args.input,))
+
+    # frames are rendered in parallel and piped to two ffmpeg processes at the same time
+    if args.pipe:
+        print("\n Start building density and velocity videos \n")
+        encoders = [
+            threading.Thread(target=encode_video, args=(
+                pool, render_density_frame, density_steps, shape,
+                "clip_density.mp4", max(args.ahead, 1))),
+            threading.Thread(target=encode_video, args=(
+                pool, render_velocity_frame, velocity_steps, shape,
+                "clip_velocity.mp4", max(args.ahead, 1))),
+        ]
+        for encoder in encoders:
+            encoder.start()
+        for encoder in encoders:
+            encoder.join()
+        pool.close()
+        print("\n Everything ready: 100% done \n")
+        return
+
+    # a folder for the images is created temporarily
+    if not os.path.exists("temp_png_to_mp4"):
+        os.makedirs("temp_png_to_mp4")
+
+    # images are created in parallel
+    print("\n Start building density pictures: 0% done \n")
+    pool.starmap(make_density_pictures, enumerate(density_steps))
+    print("\n Start building velocity pictures: 40% done \n")
+    pool.starmap(make_velocity_pictures, enumerate(velocity_steps))
+    pool.close()
+
+    # images are processed into videos
+    if os.path.isfile("clip_density.mp4"):
+        print("file clip_density.mp4 already exists. Please rename it and start again.")
+    else:
+        print("\n Start building density video: 80% done \n")
+        os.system(
+            "ffmpeg -r 30 -i ./temp_png_to_mp4/density_%01d.png -vb 10M ./clip_density.mp4")
+    if os.path.isfile("clip_velocity.mp4"):
+        print("file clip_velocity.mp4 already exists. Please rename it and start again.")
+    else:
+        print("\n Start building velocity video: 90% done \n")
+        os.system(
+            "ffmpeg -r 30 -i ./temp_png_to_mp4/velocity_%01d.png -vb 10M ./clip_velocity.mp4")
+
+    # Delete the images and the temporary folder
+    for root, dirs, files in os.walk("temp_png_to_mp4", topdown=False):
+        for name in files:
+            os.remove(os.path.join(root, name))
+    os.rmdir("temp_png_to_mp4")
+    print("\n Everything ready: 100% done \n")
+
+
+if __name__ == '__main__':
+    main()
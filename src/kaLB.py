@@ -50,6 +50,43 @@ def parse_arguments():
         '-s', '--snapshot', required=False, type=str,
         help="Specify path to the existing snapshot that you want to use as initial condition."
     )
+    parser.add_argument(
+        '-r', '--resume', required=False, action='store_true',
+        help="With this command, you can continue the simulation from its newest checkpoint."
+    )
+    parser.add_argument(
+        '-b', '--backend', required=False, type=str,
+        help="Specify the compute backend (e.g. 'numpy' or 'numba'), overrides the inputfile."
+    )
+    parser.add_argument(
+        '-t', '--threads', required=False, type=int, default=1,
+        help="Specify the number of threads for the numpy backend."
+    )
+    parser.add_argument(
+        '-pr', '--processes', required=False, type=int, default=1,
+        help="Specify the number of processes that share the lattice (in slabs along x)."
+    )
+    parser.add_argument(
+        '-q', '--output_queue', required=False, type=int, default=2,
+        help="Specify the number of output steps that may wait for the background writer, "
+             "0 writes output synchronously."
+    )
+    parser.add_argument(
+        '-pf', '--profile', required=False, action='store_true',
+        help="With this command, you can measure the time spent in every phase of a step."
+    )
+    parser.add_argument(
+        '-pm', '--profile_memory', required=False, action='store_true',
+        help="With this command, you can also measure memory peaks while profiling (slower)."
+    )
+    parser.add_argument(
+        '-sc', '--setup_cache', required=False, type=str,
+        help="Specify a directory to cache the obstacle and boundary setup in between runs."
+    )
+    parser.add_argument(
+        '-cs', '--setup_cache_size', required=False, type=float, default=1024,
+        help="Specify the size of the setup cache in MiB, least recently used entries are removed."
+    )
 
     return parser.parse_args()
 
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel simulation on one node with several processes.
+
+The lattice is split into slabs along x.
+Every slab is held in shared memory together with one halo column
+on each side that has a neighbour.
+A worker process advances its slab with the methods of the Simulation
+and pulls the post-collision values of its neighbours into its halo columns
+before streaming. Barriers keep the workers in lockstep.
+
+The main process only gathers density, velocity and distribution function
+from the slabs when output is due and performs the output as usual.
+The workers ignore SIGTERM and SIGINT: the main process stops them at the next
+synchronized step (see checkpoint.StopRequest).
+"""
+import multiprocessing
+from multiprocessing import shared_memory
+import signal
+from threading import BrokenBarrierError, Thread
+import time
+import numpy as np
+from src import utilities
+
+
+def decompose(n_x, processes, periodic_x):
+    """
+    Split the x axis into slabs.
+
+    :param n_x: lattice points x
+    :param processes: number of slabs
+    :param periodic_x: whether the E and W borders are periodic
+    :return: list of (x_start, x_stop, halo_left, halo_right) for every slab
+    """
+
+    bounds = np.linspace(0, n_x, processes + 1).round().astype(int)
+    slabs = []
+    for rank in range(processes):
+        halo_left = int(rank > 0 or periodic_x)
+        halo_right = int(rank < processes - 1 or periodic_x)
+        slabs.append((bounds[rank], bounds[rank + 1], halo_left, halo_right))
+    return slabs
+
+
+def block_arrays(buffer, width, n_y, dtype, batch_shape=()):
+    """
+    Create the arrays of a slab inside a shared memory buffer.
+
+    :param buffer: buffer of the shared memory block
+    :param width: number of columns of the slab including halo columns
+    :param n_y: lattice points y
+    :param dtype: floating point type of the arrays
+    :param batch_shape: shape of the trailing ensemble axis
+    :return: dictionary with the arrays f_in, f_out, rho and vel
+    """
+
+    lattice = (width, n_y) + batch_shape
+    shapes = {
+        "f_in": (9,) + lattice,
+        "f_out": (9,) + lattice,
+        "rho": lattice,
+        "vel": (2,) + lattice,
+    }
+    arrays = {}
+    offset = 0
+    for name, shape in shapes.items():
+        arrays[name] = np.ndarray(shape=shape, dtype=dtype, buffer=buffer, offset=offset)
+        offset += arrays[name].nbytes
+    return arrays
+
+
+def block_size(width, n_y, dtype, batch_shape=()):
+    """
+    Number of bytes needed for the arrays of a slab.
+
+    :param width: number of columns of the slab including halo columns
+    :param n_y: lattice points y
+    :param dtype: floating point type of the arrays
+    :param batch_shape: shape of the trailing ensemble axis
+    """
+
+    members = int(np.prod(batch_shape, dtype=int))
+    return (9 + 9 + 1 + 2) * width * n_y * members * np.dtype(dtype).itemsize
+
+
+def slab_simulation(spec, rank, arrays):
+    """
+    Create a Simulation that works on one slab.
+
+    Borders that face a neighbour are neither periodic nor have a boundary condition,
+    their values are provided by the halo columns.
+
+    :param spec: dictionary describing the global Simulation (see :func:`run_parallel`)
+    :param rank: index of the slab
+    :param arrays: arrays of the slab in shared memory
+    :return: Simulation instance for the slab
+    """
+
+    from src.d2q9_simulation import Simulation
+
+    x_start, x_stop, halo_left, halo_right = spec["slabs"][rank]
+    columns = np.arange(x_start - halo_left, x_stop + halo_right) % spec["shape"][0]
+
+    sim = Simulation()
+    sim.tau = spec["tau"]
+    sim.collision_matrix = spec["collision_matrix"]
+    sim.dtype = spec["dtype"]
+    sim.batch_shape = spec["batch_shape"]
+    sim.shape = (len(columns), spec["shape"][1])
+    utilities.allocate_lattice(sim)
+    sim.f_in = arrays["f_in"]
+    sim.f_out = arrays["f_out"]
+    sim.rho = arrays["rho"]
+    sim.vel = arrays["vel"]
+
+    sim.obstacle = spec["obstacle"][columns]
+    sim.opposite_directions = spec["opposite_directions"]
+    sim.last_indices = spec["last_indices"]
+    sim.zou_he_conditions = spec["zou_he_conditions"]
+    sim.boundarys = dict(spec["boundarys"])
+    if halo_left:
+        sim.boundarys["W"] = "halo"
+    if halo_right:
+        sim.boundarys["E"] = "halo"
+    utilities.compile_stream_plan(sim)
+    utilities.compile_bounce_back_links(sim)
+    utilities.compile_boundary_plan(sim)
+    return sim
+
+
+def worker(spec, rank, step_barrier, sync_barrier, stop):
+    """
+    Advance one slab for all timesteps.
+
+    :param spec: dictionary describing the global Simulation (see :func:`run_parallel`)
+    :param rank: index of the slab
+    :param step_barrier: barrier shared by all workers
+    :param sync_barrier: barrier shared by all workers and the main process
+    :param stop: shared flag, set by the main process to stop after a synchronized step
+    """
+
+    # signals are handled by the main process, which stops the workers
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    processes = len(spec["slabs"])
+    left = (rank - 1) % processes
+    right = (rank + 1) % processes
+    blocks = {}
+    try:
+        for neighbour in {left, rank, right}:
+            x_start, x_stop, halo_left, halo_right = spec["slabs"][neighbour]
+            width = x_stop - x_start + halo_left + halo_right
+            memory = shared_memory.SharedMemory(name=spec["memory"][neighbour])
+            blocks[neighbour] = (
+                memory, block_arrays(
+                    memory.buf, width, spec["shape"][1], spec["dtype"], spec["batch_shape"]
+                )
+            )
+
+        sim = slab_simulation(spec, rank, blocks[rank][1])
+        halo_left, halo_right = spec["slabs"][rank][2:]
+        left_f_out = blocks[left][1]["f_out"]
+        right_f_out = blocks[right][1]["f_out"]
+        left_last = -1 - spec["slabs"][left][3]
+        right_first = spec["slabs"][right][2]
+
+        for step in range(1, spec["timesteps"] + 1):
+            sim.calc_macroscopic()
+            sim.correct_macroscopic()
+            sim.calc_equilibrium()
+            sim.correct_distr_func()
+
+            # neighbours have finished reading the halo columns of the last step
+            step_barrier.wait()
+            sim.collision_step()
+            sim.bounce_back()
+
+            # post-collision values of all slabs are ready: fill halo columns
+            step_barrier.wait()
+            if halo_left:
+                sim.f_out[:, 0] = left_f_out[:, left_last]
+            if halo_right:
+                sim.f_out[:, -1] = right_f_out[:, right_first]
+            sim.stream_step()
+            sim.correct_outflow()
+
+            # let the main process gather output
+            if spec["sync_steps"][step]:
+                sync_barrier.wait()
+                sync_barrier.wait()
+                if stop.value:
+                    break
+
+    except BrokenBarrierError:
+        pass
+    except BaseException:
+        step_barrier.abort()
+        sync_barrier.abort()
+        raise
+    finally:
+        sim = None
+        left_f_out = right_f_out = None
+        for memory, arrays in blocks.values():
+            arrays.clear()
+            memory.close()
+
+
+def watch_workers(workers, barriers):
+    """
+    Break all barriers as soon as a worker process dies with an error.
+
+    Otherwise the remaining processes would wait for it forever.
+    Meant to run in a background thread of the main process.
+
+    :param workers: list of worker processes
+    :param barriers: list of barriers to abort
+    """
+
+    while any(process.exitcode is None for process in workers):
+        if any(process.exitcode for process in workers):
+            for barrier in barriers:
+                barrier.abort()
+            return
+        time.sleep(0.1)
+
+
+def gather(sim, spec, blocks):
+    """
+    Copy density, velocity and distribution function of all slabs into the Simulation.
+
+    :param sim: Simulation instance of the main process
+    :param spec: dictionary describing the global Simulation (see :func:`run_parallel`)
+    :param blocks: arrays of every slab
+    """
+
+    for (x_start, x_stop, halo_left, _), arrays in zip(spec["slabs"], blocks):
+        inner = slice(halo_left, halo_left + x_stop - x_start)
+        sim.f_in[:, x_start:x_stop] = arrays["f_in"][:, inner]
+        sim.rho[x_start:x_stop] = arrays["rho"][inner]
+        sim.vel[:, x_start:x_stop] = arrays["vel"][:, inner]
+
+
+def run_parallel(sim, processes, store_output=None, monitor=None, stop_request=None):
+    """
+    Perform the main simulation loop with several worker processes.
+
+    The initial distribution function has to be set (see prepare_simulation).
+    Output is stored like in the serial loop.
+    When all steps are done, the final state is gathered into the Simulation.
+    A requested stop is noticed at the next synchronized step, at least every 100 steps;
+    the simulation then ends at this step and *sim.timesteps* is set to it.
+
+    :param sim: Simulation instance
+    :param processes: number of worker processes
+    :param store_output: function taking the step (and *final*) that stores the output,
+        by default utilities.store_output
+    :param monitor: convergence.ConvergenceMonitor that may stop the simulation early
+    :param stop_request: checkpoint.StopRequest that may stop the simulation early
+    :return: start and end time of the main loop
+    """
+
+    if store_output is None:
+        def store_output(step, final=False):
+            utilities.store_output(sim, step, final)
+
+    periodic_x = sim.boundarys["E"] == "periodic"
+    slabs = decompose(sim.n_x, processes, periodic_x)
+    if min(x_stop - x_start for x_start, x_stop, _, _ in slabs) < 2:
+        print("ERROR: every process needs at least 2 lattice points in x. Simulation was aborted.")
+        quit()
+
+    # steps at which the main process needs the current state
+    sync_steps = [False] + [
+        utilities.output_due(sim, step) or
+        (monitor is not None and monitor.due(step)) or
+        (not sim.args.no_progessbar and (step - 1) % 100 == 0) or
+        (stop_request is not None and step % 100 == 0)
+        for step in range(1, sim.timesteps + 1)
+    ]
+
+    # shared memory for every slab, initialized from the Simulation
+    memories = []
+    blocks = []
+    try:
+        for x_start, x_stop, halo_left, halo_right in slabs:
+            width = x_stop - x_start + halo_left + halo_right
+            memory = shared_memory.SharedMemory(
+                create=True, size=block_size(width, sim.n_y, sim.dtype, sim.batch_shape)
+            )
+            memories.append(memory)
+            blocks.append(block_arrays(memory.buf, width, sim.n_y, sim.dtype, sim.batch_shape))
+            columns = np.arange(x_start - halo_left, x_stop + halo_right) % sim.n_x
+            blocks[-1]["f_in"][:] = sim.f_in[:, columns]
+
+        spec = {
+            "shape": sim.shape,
+            "tau": sim.tau,
+            "collision_matrix": sim.collision_matrix,
+            "dtype": sim.dtype,
+            "batch_shape": sim.batch_shape,
+            "timesteps": sim.timesteps,
+            "obstacle": sim.obstacle,
+            "boundarys": sim.boundarys,
+            "zou_he_conditions": sim.zou_he_conditions,
+            "opposite_directions": sim.opposite_directions,
+            "last_indices": sim.last_indices,
+            "slabs": slabs,
+            "memory": [memory.name for memory in memories],
+            "sync_steps": sync_steps,
+        }
+
+        # fresh interpreters: forking a process with running thread pools is not safe
+        context = multiprocessing.get_context("spawn")
+        step_barrier = context.Barrier(processes)
+        sync_barrier = context.Barrier(processes + 1)
+        stop = context.Value("b", 0, lock=False)
+        workers = [
+            context.Process(target=worker, args=(spec, rank, step_barrier, sync_barrier, stop))
+            for rank in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        watchdog = Thread(target=watch_workers, args=(workers, [step_barrier, sync_barrier]))
+        watchdog.daemon = True
+        watchdog.start()
+
+        # main simulation loop: gather and store output while the workers wait
+        t0 = time.time()
+        try:
+            for step in range(1, sim.timesteps + 1):
+                if sync_steps[step]:
+                    sync_barrier.wait()
+                    gather(sim, spec, blocks)
+                    # a converged simulation writes all output and stops the workers
+                    if monitor is not None and monitor.check(step):
+                        store_output(step, final=True)
+                        sim.timesteps = step
+                        stop.value = 1
+                        sync_barrier.wait()
+                        break
+                    store_output(step)
+                    # a stopped simulation ends at this step, the caller writes the checkpoint
+                    if stop_request is not None and stop_request.requested:
+                        sim.timesteps = step
+                        stop.value = 1
+                        sync_barrier.wait()
+                        break
+                    if not sim.args.no_progessbar:
+                        utilities.progress_bar(step - 1, sim.timesteps)
+                    sync_barrier.wait()
+        except BrokenBarrierError:
+            print("\nERROR: a worker process failed. Simulation was aborted.")
+            for process in workers:
+                process.kill()
+            quit()
+        except BaseException:
+            # e.g. a second signal: the workers ignore signals and would wait forever
+            for process in workers:
+                process.kill()
+            raise
+        for process in workers:
+            process.join()
+        t1 = time.time()
+        if any(process.exitcode for process in workers):
+            print("\nERROR: a worker process failed. Simulation was aborted.")
+            quit()
+
+        gather(sim, spec, blocks)
+
+    finally:
+        blocks.clear()
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+    return t0, t1
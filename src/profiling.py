@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of the simulation loop.
+
+With *-\\-profile* the Simulation measures the wall time and the number of calls
+of every phase of a step, of whole steps, of the synchronization of the backend
+and of *store_output* (submitting output and checkpoints).
+With *-\\-profile_memory* the peak of the memory allocated by Python (tracemalloc)
+during every phase is measured as well, which slows the simulation down.
+At the end a summary table is printed and written to *profile.json* and *profile.csv*
+in the output directory.
+
+The methods are measured by replacing them on the instances with measuring wrappers
+and the original methods are restored afterwards,
+so a simulation without profiling runs exactly the same code as before.
+
+Callbacks registered with :func:`register_hook` are called after every measured call,
+e.g. to stream the timings to a monitoring system.
+"""
+import csv
+import json
+import time
+import tracemalloc
+from src import backends
+
+#: phases of a step of the NumPy backend in the order of do_simulation_step
+PHASES = [
+    "calc_macroscopic", "correct_macroscopic", "calc_equilibrium", "correct_distr_func",
+    "collision_step", "bounce_back", "stream_step", "correct_outflow"
+]
+
+#: registered hook callbacks
+HOOKS = []
+
+
+def register_hook(hook):
+    """
+    Register a callback that is called after every measured call of a profiled simulation.
+
+    Can be used as decorator.
+
+    :param hook: function taking the name of the phase, the seconds of the call
+        and the peak of the allocated memory in bytes (0 without *-\\-profile_memory*)
+    :return: the hook
+    """
+
+    HOOKS.append(hook)
+    return hook
+
+
+def unregister_hook(hook):
+    """
+    Remove a registered callback.
+
+    :param hook: function that was registered with register_hook
+    """
+
+    HOOKS.remove(hook)
+
+
+class Profiler():
+    """
+    Collects wall times, call counts and memory peaks of measured functions.
+
+    Measured calls may be nested (e.g. the phases inside a step);
+    the summary shows them indented below the outer call.
+    """
+
+    def __init__(self, trace_memory=False):
+        """
+        Initialize without measurements.
+
+        :param trace_memory: whether to measure memory peaks with tracemalloc
+        """
+
+        self.trace_memory = trace_memory
+        self.records = {}
+        self.order = []
+        self.hooks = list(HOOKS)
+        self.patched = []
+        self.depth = 0
+        self.memory_stack = []
+        self.started_tracing = False
+        self.start_time = None
+        self.wall_time = 0.0
+
+    def measure(self, name, function):
+        """
+        Wrap a function so every call is measured.
+
+        :param name: name of the measurement
+        :param function: function to be measured
+        :return: measuring function with the same arguments
+        """
+
+        record = self.records.setdefault(
+            name, {"calls": 0, "seconds": 0.0, "peak": 0, "depth": None}
+        )
+
+        def measured(*args, **kwargs):
+            if record["depth"] is None:
+                record["depth"] = self.depth
+                self.order.append(name)
+            if self.trace_memory:
+                self.enter_memory()
+            self.depth += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                self.depth -= 1
+                peak = self.exit_memory() if self.trace_memory else 0
+                record["calls"] += 1
+                record["seconds"] += seconds
+                record["peak"] = max(record["peak"], peak)
+                for hook in self.hooks:
+                    hook(name, seconds, peak)
+        return measured
+
+    def patch(self, owner, name):
+        """
+        Replace a method of an instance with a measuring wrapper until :meth:`restore`.
+
+        :param owner: instance
+        :param name: name of the method and of the measurement
+        """
+
+        setattr(owner, name, self.measure(name, getattr(owner, name)))
+        self.patched.append((owner, name))
+
+    def instrument(self, sim, store_output):
+        """
+        Measure the steps, the synchronization and the output of a simulation.
+
+        The single phases can only be measured for the NumPy backend in one process,
+        the other backends perform them together.
+
+        :param sim: Simulation instance with backend
+        :param store_output: function storing the output of a step
+        :return: measuring store_output function
+        """
+
+        self.patch(sim.backend, "step")
+        self.patch(sim.backend, "synchronize")
+        if type(sim.backend) is backends.NumpyBackend and sim.args.processes == 1:
+            for phase in PHASES:
+                self.patch(sim, phase)
+        return self.measure("store_output", store_output)
+
+    def restore(self):
+        """
+        Restore the original methods and stop tracing memory.
+        """
+
+        for owner, name in reversed(self.patched):
+            delattr(owner, name)
+        self.patched = []
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def enter_memory(self):
+        """
+        Start measuring the memory peak of a call.
+
+        The peak counter is shared, so the peak reached so far is handed to the outer call.
+        """
+
+        current, peak = tracemalloc.get_traced_memory()
+        if self.memory_stack:
+            self.memory_stack[-1][1] = max(self.memory_stack[-1][1], peak)
+        self.memory_stack.append([current, 0])
+        tracemalloc.reset_peak()
+
+    def exit_memory(self):
+        """
+        Finish measuring the memory peak of a call.
+
+        :return: peak of the allocated memory in bytes above the memory at the start of the call
+        """
+
+        current, peak = self.memory_stack.pop()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if self.memory_stack:
+            self.memory_stack[-1][1] = max(self.memory_stack[-1][1], peak)
+        return peak - current
+
+    def start(self):
+        """
+        Start the wall time of the simulation loop and tracing memory.
+        """
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        """
+        Stop the wall time of the simulation loop.
+        """
+
+        self.wall_time = time.perf_counter() - self.start_time
+
+    def summary(self):
+        """
+        Summarize the measurements.
+
+        :return: list of dictionaries, one per called measurement in the order of the first calls
+        """
+
+        rows = []
+        for name in self.order:
+            record = self.records[name]
+            rows.append({
+                "name": name,
+                "depth": record["depth"],
+                "calls": record["calls"],
+                "total [s]": record["seconds"],
+                "mean [s]": record["seconds"] / record["calls"],
+                "share": record["seconds"] / self.wall_time if self.wall_time else 0.0,
+                "peak [bytes]": record["peak"] if self.trace_memory else None,
+            })
+        return rows
+
+    def report(self, output):
+        """
+        Print the summary table and write it to *profile.json* and *profile.csv*.
+
+        :param output: path of the output directory
+        """
+
+        rows = self.summary()
+        print("\nProfile of the simulation loop (%.2f s):" % self.wall_time)
+        print("%-26s %8s %12s %12s %8s %12s"
+              % ("phase", "calls", "total [s]", "mean [ms]", "share", "peak [MiB]"))
+        for row in rows:
+            print("%-26s %8i %12.3f %12.4f %7.1f%% %12s" % (
+                "  " * row["depth"] + row["name"], row["calls"], row["total [s]"],
+                row["mean [s]"] * 1e3, row["share"] * 100,
+                "" if row["peak [bytes]"] is None else "%.2f" % (row["peak [bytes]"] / 2**20)
+            ))
+
+        with open(output + "profile.json", "w") as profile_file:
+            json.dump({"wall time [s]": self.wall_time, "phases": rows}, profile_file, indent=4)
+        with open(output + "profile.csv", "w", newline="") as profile_file:
+            table = csv.DictWriter(profile_file, fieldnames=list(rows[0]) if rows else ["name"])
+            table.writeheader()
+            table.writerows(rows)
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+Local grid refinement with nested blocks.
+
+A refinement block covers a rectangle of the lattice of its parent (the simulation
+or another block) with a lattice of half the spacing: every gridpoint of the parent
+in the rectangle is also a gridpoint of the block, with one more gridpoint in between.
+Blocks are declared in the optional *refinement* section of the inputfile, e.g.
+around obstacles, so most of the domain can be simulated on a coarse lattice.
+
+The coupling follows Dupuis and Chopard (2003) with acoustic scaling:
+
+* velocities are the same in the units of both lattices,
+  time steps of the block are half as long, so it performs two steps per step of its parent
+  (temporal sub-cycling) and its relaxation parameter is :math:`\\tau_f = 2 \\tau_c - 1/2`
+  to keep the viscosity
+* the outermost ring of gridpoints of the block is set from the parent after every step
+  of the block, interpolated linearly in space and, after the first step, in time;
+  the non-equilibrium part is rescaled by :math:`\\tau_f / (2 \\tau_c)`
+* after both steps, the gridpoints of the parent inside the ring are set from the block,
+  with the non-equilibrium part rescaled by :math:`2 \\tau_c / \\tau_f`
+
+The restriction replaces the parent inside the ring, so the parent does not compute
+the inside of blocks that cover at least half of its height: its steps perform
+the *numpy* methods of the Simulation on views of the rectangles around them
+(see :func:`lattice_pieces`). Only the gridpoints directly inside the ring are still computed,
+their post-collision values stream across it.
+A step of the simulation therefore costs the coarse lattice (outside of such blocks)
+plus two steps of every block, instead of two steps of a lattice with half the spacing everywhere;
+*benchmarks/bench_refinement.py* compares these costs.
+Blocks use the *bgk* collision.
+The output shows the lattice of the simulation; the fields of a block are found in
+*sim.refinement_blocks[i].sim* (*rho*, *vel*).
+"""
+import numpy as np
+from src import backends, utilities
+
+
+def refinement_definition(sim, refinement_parameters, obstacle_parameters):
+    """
+    Set up the refinement blocks of a simulation.
+
+    :param sim: Simulation instance with obstacles and boundary conditions already set
+    :param refinement_parameters: list of blocks, each a dictionary with
+        *x-range* and *y-range* (first and last gridpoint of the block in the parent)
+        and optionally *refinement* (list of nested blocks in gridpoints of this block)
+    :param obstacle_parameters: obstacle parameters of the inputfile,
+        which are rasterized again at the resolution of every block
+    """
+
+    sim.refinement_blocks = []
+    if refinement_parameters and (sim.batch_shape or sim.collision_matrix is not None):
+        print("ERROR: refinement blocks need a single simulation with the 'bgk' collision")
+        quit()
+    for block_parameters in refinement_parameters:
+        sim.refinement_blocks.append(
+            RefinementBlock(sim, sim, block_parameters, obstacle_parameters)
+        )
+
+
+def rescale(packed, factor):
+    """
+    Rescale the non-equilibrium part of a packed distribution function in place.
+
+    :param packed: Simulation instance of shape (*n*, 1) with *f_in* set
+    :param factor: factor of the non-equilibrium part
+    """
+
+    packed.calc_macroscopic()
+    packed.calc_equilibrium()
+    packed.f_in -= packed.f_eq
+    packed.f_in *= factor
+    packed.f_in += packed.f_eq
+
+
+def uncovered_rectangles(shape, holes):
+    """
+    Split a lattice into rectangles around some holes.
+
+    :param shape: lattice points x and y
+    :param holes: list of rectangles (x_start, x_stop, y_start, y_stop) to leave out, may overlap
+    :return: list of rectangles (x_start, x_stop, y_start, y_stop) that cover the rest
+        of the lattice exactly once
+    """
+
+    cuts = sorted({0, shape[0]} | {x for hole in holes for x in hole[:2]})
+    rectangles = []
+    for x_start, x_stop in zip(cuts[:-1], cuts[1:]):
+        y_start = 0
+        for hole_start, hole_stop in sorted(
+                hole[2:] for hole in holes if hole[0] <= x_start and x_stop <= hole[1]):
+            if hole_start > y_start:
+                rectangles.append((x_start, x_stop, y_start, hole_start))
+            y_start = max(y_start, hole_stop)
+        if y_start < shape[1]:
+            rectangles.append((x_start, x_stop, y_start, shape[1]))
+    return rectangles
+
+
+def lattice_pieces(sim, blocks, threads=1):
+    """
+    Create views on the parts of a lattice that are not inside one of its blocks.
+
+    The rows above and below a hole are strided views, which cost about twice as much
+    per gridpoint as whole rows, so only holes of at least half the lattice points y are left out.
+
+    :param sim: Simulation instance of the lattice
+    :param blocks: refinement blocks of the lattice
+    :param threads: number of slabs every rectangle is split into along x, e.g. one per thread
+    :return: list of Simulation instances on the rectangles (see backends.slab_simulation),
+        their streaming plans and Simulation instances on the holes that are left out
+    """
+
+    holes = [block.hole for block in blocks
+             if block.hole is not None and 2 * (block.hole[3] - block.hole[2]) >= sim.shape[1]]
+    pieces = []
+    stream_plans = []
+    for x_start, x_stop, y_start, y_stop in uncovered_rectangles(sim.shape, holes):
+        bounds = np.linspace(x_start, x_stop, min(threads, x_stop - x_start) + 1)
+        bounds = bounds.round().astype(int)
+        for slab_start, slab_stop in zip(bounds[:-1], bounds[1:]):
+            pieces.append(backends.slab_simulation(sim, slab_start, slab_stop, y_start, y_stop))
+            stream_plans.append(backends.restrict_stream_plan(
+                sim.stream_plan, sim.shape[0], slab_start, slab_stop,
+                (sim.shape[1], y_start, y_stop)
+            ))
+    return pieces, stream_plans, [backends.slab_simulation(sim, *hole) for hole in holes]
+
+
+def run_serial(function, items):
+    """
+    Call a function for every item, like backends.ThreadedBackend.run without threads.
+
+    :param function: function taking one item
+    :param items: list of items
+    """
+
+    for item in items:
+        function(item)
+
+
+def masked_step(sim, pieces, stream_plans, run=run_serial):
+    """
+    Perform an iteration step on the pieces of a lattice (see Simulation.do_simulation_step).
+
+    The borders, bounce back and the outflow correction are done for the whole lattice,
+    they do not touch the inside of a block.
+
+    :param sim: Simulation instance of the lattice
+    :param pieces: views on the lattice (see :func:`lattice_pieces`)
+    :param stream_plans: streaming plans of the pieces
+    :param run: function calling a function for every item of a list
+    """
+
+    run(lambda piece: piece.calc_macroscopic(), pieces)
+    sim.correct_macroscopic()
+    run(lambda piece: piece.calc_equilibrium(), pieces)
+    sim.correct_distr_func()
+    run(lambda piece: piece.collision_step(), pieces)
+    sim.bounce_back()
+    run(lambda plan: backends.stream(sim, plan), stream_plans)
+    sim.correct_outflow()
+
+
+def packed_simulation(sim, n_points):
+    """
+    Create a Simulation for a list of gridpoints, e.g. to compute their equilibrium.
+
+    :param sim: Simulation instance the gridpoints belong to
+    :param n_points: number of gridpoints
+    :return: Simulation instance of shape (*n_points*, 1)
+    """
+
+    packed = type(sim)()
+    packed.tau = sim.tau
+    packed.dtype = sim.dtype
+    packed.shape = (n_points, 1)
+    utilities.allocate_lattice(packed)
+    return packed
+
+
+class RefinementBlock():
+    """
+    A block of the lattice with half the spacing of its parent, see the module description.
+    """
+
+    def __init__(self, root, parent, block_parameters, obstacle_parameters):
+        """
+        Create the lattice of the block and precompute its coupling to the parent.
+
+        :param root: Simulation instance of the whole domain
+        :param parent: Simulation instance of the parent lattice
+        :param block_parameters: dictionary with *x-range*, *y-range*
+            and optionally nested *refinement* blocks
+        :param obstacle_parameters: obstacle parameters of the inputfile
+        """
+
+        self.parent = parent
+        x_range = block_parameters["x-range"]
+        y_range = block_parameters["y-range"]
+        if (x_range[0] < 1 or y_range[0] < 1 or x_range[1] > parent.shape[0] - 2
+                or y_range[1] > parent.shape[1] - 2
+                or x_range[1] - x_range[0] < 3 or y_range[1] - y_range[0] < 3):
+            print("ERROR: a refinement block has to cover at least 4x4 gridpoints "
+                  "and keep one gridpoint distance to the borders of its parent: %s"
+                  % block_parameters)
+            quit()
+        self.origin = (x_range[0], y_range[0])
+
+        # gridpoints of the parent that are neither computed by it nor next to its computed ones
+        self.hole = None
+        if x_range[1] - x_range[0] >= 4 and y_range[1] - y_range[0] >= 4:
+            self.hole = (x_range[0] + 2, x_range[1] - 1, y_range[0] + 2, y_range[1] - 1)
+
+        # lattice of the block
+        self.sim = sim = type(parent)()
+        sim.tau = 2 * parent.tau - 0.5
+        sim.dtype = parent.dtype
+        sim.shape = (2 * (x_range[1] - x_range[0]) + 1, 2 * (y_range[1] - y_range[0]) + 1)
+        sim.n_x, sim.n_y = sim.shape
+        sim.scale = getattr(parent, "scale", 1) * 2
+        sim.position = tuple(
+            getattr(parent, "position", (0, 0))[axis]
+            + self.origin[axis] / getattr(parent, "scale", 1)
+            for axis in (0, 1)
+        )
+        utilities.allocate_lattice(sim)
+        sim.obstacle = block_obstacle(root, sim, obstacle_parameters)
+        sim.opposite_directions = root.opposite_directions
+        sim.last_indices = root.last_indices
+        sim.boundarys = dict.fromkeys("NESW", "interface")
+        utilities.compile_stream_plan(sim)
+        utilities.compile_bounce_back_links(sim)
+        utilities.compile_boundary_plan(sim)
+
+        x, y = np.indices(sim.shape)
+        ring = (x == 0) | (y == 0) | (x == sim.shape[0] - 1) | (y == sim.shape[1] - 1)
+        if np.any(sim.obstacle[ring]):
+            print("WARNING: an obstacle touches the border of the refinement block %s"
+                  % block_parameters)
+
+        # gridpoints of the ring, interpolated from the parent
+        self.ring = np.flatnonzero(ring)
+        self.ring_sources, self.ring_weights = self.interpolation(self.ring)
+        self.ring_packed = packed_simulation(sim, len(self.ring))
+        self.previous = np.empty_like(self.ring_packed.f_in[:, :, 0])
+
+        # fluid gridpoints inside the ring that are also fluid gridpoints of the parent
+        inner = ~ring & ~sim.obstacle & (x % 2 == 0) & (y % 2 == 0)
+        inner[inner] = ~parent.obstacle[self.origin[0] + x[inner] // 2,
+                                        self.origin[1] + y[inner] // 2]
+        self.inner = np.flatnonzero(inner)
+        self.inner_targets = np.ravel_multi_index(
+            (self.origin[0] + x[inner] // 2, self.origin[1] + y[inner] // 2), parent.shape
+        )
+        self.inner_packed = packed_simulation(parent, len(self.inner))
+
+        self.children = [
+            RefinementBlock(root, sim, child_parameters, obstacle_parameters)
+            for child_parameters in block_parameters.get("refinement", [])
+        ]
+
+    def interpolation(self, points):
+        """
+        Find the gridpoints of the parent around gridpoints of the block.
+
+        :param points: flat indices of gridpoints of the block
+        :return: flat indices of the 4 surrounding gridpoints of the parent, shape (4, *n*),
+            and their weights of the bilinear interpolation
+        """
+
+        x, y = np.unravel_index(points, self.sim.shape)
+        sources = []
+        weights = []
+        for x_parent, x_weight in ((x // 2, 1 - x % 2 / 2), ((x + 1) // 2, x % 2 / 2)):
+            for y_parent, y_weight in ((y // 2, 1 - y % 2 / 2), ((y + 1) // 2, y % 2 / 2)):
+                sources.append(np.ravel_multi_index(
+                    (self.origin[0] + x_parent, self.origin[1] + y_parent), self.parent.shape
+                ))
+                weights.append(x_weight * y_weight)
+        return np.array(sources), np.array(weights)
+
+    def interpolate(self, sources, weights):
+        """
+        Interpolate the distribution function of the parent.
+
+        :param sources: flat indices of the surrounding gridpoints of the parent, shape (4, *n*)
+        :param weights: weights of the surrounding gridpoints
+        :return: interpolated distribution function, shape (9, *n*)
+        """
+
+        f_parent = utilities.component_rows(self.parent.f_in)
+        return np.einsum("ikn,kn->in", f_parent[:, sources], weights).astype(self.sim.dtype)
+
+    def set_ring(self, f_ring):
+        """
+        Set the ring of the block from interpolated values of the parent.
+
+        :param f_ring: interpolated distribution function of the parent on the ring
+        """
+
+        self.ring_packed.f_in[:, :, 0] = f_ring
+        rescale(self.ring_packed, self.sim.tau / (2 * self.parent.tau))
+        utilities.component_rows(self.sim.f_in)[:, self.ring] = self.ring_packed.f_in[:, :, 0]
+
+    def initialize(self):
+        """
+        Set the whole block from the parent, e.g. after the initial condition is set,
+        and create the pieces its steps are performed on.
+        """
+
+        self.pieces, self.stream_plans, self.holes = lattice_pieces(self.sim, self.children)
+
+        points = np.arange(self.sim.rho.size)
+        packed = packed_simulation(self.sim, len(points))
+        packed.f_in[:, :, 0] = self.interpolate(*self.interpolation(points))
+        rescale(packed, self.sim.tau / (2 * self.parent.tau))
+        utilities.component_rows(self.sim.f_in)[:] = packed.f_in[:, :, 0]
+        for child in self.children:
+            child.initialize()
+
+    def save(self):
+        """
+        Remember the ring values of the parent before its step, for the time interpolation.
+        """
+
+        self.previous[:] = self.interpolate(self.ring_sources, self.ring_weights)
+
+    def advance(self):
+        """
+        Perform the two steps of the block after the step of its parent
+        and set the parent inside the ring from the block.
+        """
+
+        current = self.interpolate(self.ring_sources, self.ring_weights)
+        for f_ring in ((self.previous + current) / 2, current):
+            for child in self.children:
+                child.save()
+            masked_step(self.sim, self.pieces, self.stream_plans)
+            self.set_ring(f_ring)
+            for child in self.children:
+                child.advance()
+
+        # restriction
+        self.inner_packed.f_in[:, :, 0] = utilities.component_rows(self.sim.f_in)[:, self.inner]
+        rescale(self.inner_packed, 2 * self.parent.tau / self.sim.tau)
+        utilities.component_rows(self.parent.f_in)[:, self.inner_targets] = (
+            self.inner_packed.f_in[:, :, 0]
+        )
+
+    def synchronize(self):
+        """
+        Compute density and velocity inside the children, which the steps leave out.
+        """
+
+        for hole in self.holes:
+            hole.calc_macroscopic()
+        for child in self.children:
+            child.synchronize()
+
+
+def block_obstacle(root, sim, obstacle_parameters):
+    """
+    Rasterize the obstacles of the inputfile on the lattice of a block.
+
+    Cylinders and rectangles are rasterized at the resolution of the block,
+    obstacles from png files are taken from the nearest gridpoint of the simulation.
+
+    :param root: Simulation instance of the whole domain
+    :param sim: Simulation instance of the block with *shape*, *position* and *scale* set
+    :param obstacle_parameters: obstacle parameters of the inputfile
+    :return: boolean ndarray with the shape of the block
+    """
+
+    obstacle = np.full(shape=sim.shape, fill_value=False)
+    for obstacle_parameter in obstacle_parameters:
+        if obstacle_parameter["type"] == "cylindrical obstacle":
+            utilities.rasterize_cylinders(
+                obstacle, obstacle_parameter["x-position"], obstacle_parameter["y-position"],
+                obstacle_parameter["radius"], sim.position, sim.scale
+            )
+        elif obstacle_parameter["type"] == "recktangle obstacle":
+            utilities.rasterize_rectangles(
+                obstacle, obstacle_parameter["bottom_left"], obstacle_parameter["top_right"],
+                sim.position, sim.scale
+            )
+        elif obstacle_parameter["type"] == "png import":
+            # positions of the gridpoints in gridpoints of the simulation
+            x, y = np.indices(sim.shape)
+            x = np.rint(sim.position[0] + x / sim.scale).astype(int)
+            y = np.rint(sim.position[1] + y / sim.scale).astype(int)
+            obstacle |= utilities.png_importer(root, obstacle_parameter["file name"])[x, y]
+    return obstacle
+
+
+class RefinedBackend(backends.Backend):
+    """
+    Backend that performs the steps of the simulation lattice without the inside of its blocks
+    and advances the refinement blocks after every step.
+
+    It wraps the *numpy* backend, with threads the pieces of the lattice
+    are computed in the threads of the wrapped backend.
+    """
+
+    def __init__(self, backend):
+        """
+        Wrap a backend.
+
+        :param backend: *numpy* backend, with or without threads
+        """
+
+        self.backend = backend
+        self.name = backend.name
+
+    def prepare(self, sim):
+        self.backend.prepare(sim)
+        threads = 1
+        self.run = run_serial
+        if isinstance(self.backend, backends.ThreadedBackend):
+            threads = self.backend.threads
+            self.run = self.backend.run
+        self.pieces, self.stream_plans, self.holes = lattice_pieces(
+            sim, sim.refinement_blocks, threads
+        )
+        for block in sim.refinement_blocks:
+            block.initialize()
+
+    def step(self, sim):
+        for block in sim.refinement_blocks:
+            block.save()
+        masked_step(sim, self.pieces, self.stream_plans, self.run)
+        for block in sim.refinement_blocks:
+            block.advance()
+
+    def synchronize(self, sim):
+        for hole in self.holes:
+            hole.calc_macroscopic()
+        for block in sim.refinement_blocks:
+            block.synchronize()
+
+    def finish(self, sim):
+        self.synchronize(sim)
+        self.backend.finish(sim)
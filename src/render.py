@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight renderer for picture output.
+
+A scalar field is mapped through a precomputed lookup table of a matplotlib colormap
+straight into an RGB image of unsigned bytes and written as PNG (or raw RGB) file,
+without building a matplotlib figure.
+The colors are the same as those of ``plt.imshow(values.T, origin='lower', vmin=vmin, vmax=vmax)``,
+but there is no title, axes or colorbar.
+"""
+import struct
+import zlib
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def lookup_table(colormap=None, size=256):
+    """
+    Precompute the RGB colors of a matplotlib colormap.
+
+    :param colormap: name of the colormap, *None* for the default colormap of matplotlib
+    :param size: number of colors
+    :return: array of shape (*size*, 3) with unsigned bytes
+    """
+
+    cmap = plt.get_cmap(colormap, size)
+    return cmap(np.arange(size), bytes=True)[:, :3].copy()
+
+
+def render_frame(values, vmin, vmax, table):
+    """
+    Map a field to the colors of a lookup table.
+
+    Values below *vmin* (above *vmax*) get the first (last) color, like in matplotlib.
+    Non-finite values of a diverged simulation do not break the frame:
+    NaN and -inf get the first color, inf the last one.
+
+    :param values: field with shape (*n_x*, *n_y*)
+    :param vmin: value that is mapped to the first color
+    :param vmax: value that is mapped to the last color
+    :param table: lookup table (see :func:`lookup_table`)
+    :return: RGB image with shape (*n_y*, *n_x*, 3), y pointing upwards
+    """
+
+    size = len(table)
+    index = values.T[::-1] - vmin
+    index *= size / (vmax - vmin)
+    np.nan_to_num(index, nan=0, posinf=size - 1, neginf=0, copy=False)
+    np.clip(index, 0, size - 1, out=index)
+    return table[index.astype(np.intp)]
+
+
+def write_png(filename, image, level=1):
+    """
+    Write an RGB image as PNG file.
+
+    :param filename: path of the file
+    :param image: RGB image with shape (height, width, 3) and unsigned bytes
+    :param level: zlib compression level, low levels are fast
+    """
+
+    height, width, _ = image.shape
+    scanlines = np.zeros(shape=(height, 1 + 3 * width), dtype=np.uint8)  # filter type 0
+    scanlines[:, 1:] = image.reshape(height, 3 * width)
+
+    def chunk(kind, data):
+        checksum = zlib.crc32(kind + data) & 0xffffffff
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", checksum)
+
+    with open(filename, "wb") as png:
+        png.write(b"\x89PNG\r\n\x1a\n")
+        png.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        png.write(chunk(b"IDAT", zlib.compress(scanlines.tobytes(), level)))
+        png.write(chunk(b"IEND", b""))
+
+
+def save_picture(filename, values, vmin, vmax, table, file_type="png"):
+    """
+    Render a field and write it to a file.
+
+    :param filename: path of the file without extension
+    :param values: field with shape (*n_x*, *n_y*)
+    :param vmin: value that is mapped to the first color
+    :param vmax: value that is mapped to the last color
+    :param table: lookup table (see :func:`lookup_table`)
+    :param file_type: "png", or "rgb" for the raw bytes of the image
+    """
+
+    image = render_frame(values, vmin, vmax, table)
+    if file_type == "png":
+        write_png(filename + ".png", image)
+    else:
+        image.tofile(filename + ".rgb")
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the geometry of a simulation.
+
+Setting up a simulation rasterizes the obstacles (decoding png files),
+adds the walls of the *bounce_back* borders and finds the bounce back links.
+With *-\\-setup_cache* these arrays are stored in a directory,
+keyed on a hash of everything they depend on:
+the lattice size, the obstacle parameters, the types of the boundary conditions
+and the contents of the png files. Other parameters, e.g. *tau* or the velocities
+of *zou-he* borders, are not part of the key, so a sweep over them reuses one entry.
+
+Every entry is a directory of *.npy* files, which are memory-mapped when loaded:
+the obstacle without the walls of the *bounce_back* borders and the bounce back links.
+Entries are written to a temporary directory that is renamed when complete,
+so several simulations can share a cache. When the cache gets larger than
+*-\\-setup_cache_size* MiB, the least recently used entries are removed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from src import utilities
+
+#: version of the entries, part of the key so changed setup code does not use old entries
+CACHE_VERSION = 2
+
+
+def setup_key(sim, obstacle_parameters, boundary_conditions):
+    """
+    Hash everything the geometry of a simulation depends on.
+
+    :param sim: Simulation instance with simulation parameters already set
+    :param obstacle_parameters: obstacle parameters of the inputfile
+    :param boundary_conditions: boundary conditions of the inputfile
+    :return: hexadecimal sha256 hash
+    """
+
+    key = hashlib.sha256()
+    key.update(json.dumps({
+        "version": CACHE_VERSION,
+        "shape": sim.shape,
+        "obstacle parameters": obstacle_parameters,
+        "boundary conditions": {
+            direction: condition["type"] for direction, condition in boundary_conditions.items()
+        },
+    }, sort_keys=True, default=lambda value: np.asarray(value).tolist()).encode())
+    for obstacle_parameter in obstacle_parameters:
+        if obstacle_parameter["type"] == "png import":
+            try:
+                with open(obstacle_parameter["file name"], "rb") as png_file:
+                    key.update(png_file.read())
+            except IOError:
+                # png_importer reports the missing file
+                pass
+    return key.hexdigest()
+
+
+def geometry_definition(sim, obstacle_parameters, boundary_conditions, cache=None):
+    """
+    Set the obstacle and the boundary conditions, from the cache if possible.
+
+    Without cache this is utilities.obstacles_definition and
+    utilities.set_boundary_conditions; with cache only the cheap parts
+    of the boundary conditions are set up when the geometry is found.
+    *-\\-show_obstacle* shows the obstacle before the walls are added in both cases.
+
+    :param sim: Simulation instance with simulation parameters already set
+    :param obstacle_parameters: obstacle parameters of the inputfile
+    :param boundary_conditions: boundary conditions of the inputfile
+    :param cache: SetupCache instance, *None* to set everything up
+    """
+
+    if cache is None:
+        utilities.obstacles_definition(sim, obstacle_parameters)
+        utilities.set_boundary_conditions(sim, boundary_conditions)
+        return
+
+    key = setup_key(sim, obstacle_parameters, boundary_conditions)
+    arrays = cache.load(key, ("obstacle", "bounce_back_links"))
+    if arrays is None:
+        utilities.obstacles_definition(sim, obstacle_parameters)
+        obstacle = sim.obstacle.copy()
+        links = utilities.set_boundary_conditions(sim, boundary_conditions)
+        cache.store(key, {"obstacle": obstacle, "bounce_back_links": links})
+        return
+
+    # the walls are set on the copy-on-write mapping, like on a new obstacle
+    sim.obstacle = arrays["obstacle"]
+    if sim.args.show_obstacle:
+        utilities.show_obstacle(sim)
+    utilities.set_boundary_conditions(sim, boundary_conditions, arrays["bounce_back_links"])
+
+
+class SetupCache():
+    """
+    Directory of cached geometries with least recently used eviction.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Open or create a cache directory.
+
+        :param directory: path of the cache directory
+        :param max_bytes: size of the cache in bytes, older entries are removed beyond it
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def load(self, key, names):
+        """
+        Memory-map the arrays of an entry and mark it as used.
+
+        The arrays are mapped copy-on-write: they can be changed in memory,
+        e.g. by setting the walls of the borders again, but the files stay unchanged.
+
+        :param key: key of the entry
+        :param names: names of the arrays
+        :return: dictionary of the arrays by name, *None* if there is no valid entry
+        """
+
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays = {
+                name: np.load(os.path.join(path, name + ".npy"), mmap_mode="c").view(np.ndarray)
+                for name in names
+            }
+            os.utime(path)
+            return arrays
+        except (OSError, ValueError) as error:
+            # e.g. removed by another simulation in the meantime
+            print("WARNING: could not read the setup cache entry %s. " % path + str(error))
+            return None
+
+    def store(self, key, arrays):
+        """
+        Write an entry and remove the least recently used entries beyond the size of the cache.
+
+        :param key: key of the entry
+        :param arrays: dictionary of ndarrays by name
+        """
+
+        path = os.path.join(self.directory, key)
+        temporary = path + ".tmp%i" % os.getpid()
+        try:
+            os.makedirs(temporary)
+            for name, array in arrays.items():
+                np.save(os.path.join(temporary, name + ".npy"), array)
+            os.rename(temporary, path)
+        except OSError as error:
+            # another simulation stored the same entry first, or the cache is not writable
+            shutil.rmtree(temporary, ignore_errors=True)
+            if not os.path.isdir(path):
+                print("WARNING: could not write the setup cache entry %s. " % path + str(error))
+            return
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        List the complete entries.
+
+        :return: list of (time of the last use, size in bytes, key), least recently used first
+        """
+
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if ".tmp" in key or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, key))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits into its size.
+
+        :param keep: key of an entry that is never removed, e.g. the one just stored
+        """
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= size
@@ -5,10 +5,13 @@ kaLB is not intendet to run without these helper functions.
 """
 import sys
 import os
+import hashlib
+import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.image as img
 import h5py
+from src import render
 
 
 def simulation_parameters_definition(sim, simulation_parameters):
@@ -25,22 +28,181 @@ def simulation_parameters_definition(sim, simulation_parameters):
     sim.step_offset = simulation_parameters["step offset"]
     sim.n_x = simulation_parameters["lattice points x"]
     sim.n_y = simulation_parameters["lattice points y"]
-    sim.tau = simulation_parameters["tau"]
+    sim.backend_name = simulation_parameters.get("backend", "numpy")
+    precision = simulation_parameters.get("precision", "float64")
+    if precision not in ("float32", "float64"):
+        print("ERROR: precision has to be 'float32' or 'float64'")
+        quit()
+    sim.dtype = np.dtype(precision)
+    if "ensemble members" in simulation_parameters:
+        sim.batch_shape = (simulation_parameters["ensemble members"],)
+    sim.tau = ensemble_parameter(sim, simulation_parameters["tau"], "tau")
+    collision_definition(sim, simulation_parameters)
+    convergence_definition(sim, simulation_parameters)
 
     # initialize instance variables
     sim.shape = (sim.n_x, sim.n_y)
-    sim.rho = np.empty(shape=sim.shape)
-    sim.vel = np.empty(shape=(2, sim.shape[0], sim.shape[1]))
-    sim.f_in = np.empty(shape=(9, sim.shape[0], sim.shape[1]))
+    allocate_lattice(sim)
+
+
+def ensemble_parameter(sim, value, name):
+    """
+    Helper function to read a parameter that may differ between the members of an ensemble.
+
+    :param sim: Simulation instance with *batch_shape* already set
+    :param value: a number, or a list with one number per ensemble member
+    :param name: name of the parameter for error messages
+    :return: the number, or an array that broadcasts against the trailing ensemble axis
+    """
+
+    if not isinstance(value, list):
+        return value
+    if not sim.batch_shape or len(value) != sim.batch_shape[0]:
+        print("ERROR: '%s' needs a single value or one value per ensemble member" % name)
+        quit()
+    return np.array(value, dtype=sim.dtype)
+
+
+def collision_definition(sim, simulation_parameters):
+    """
+    Helper function to set up the collision operator.
+
+    *bgk* (default) relaxes all components with :math:`1/\\tau`.
+    *trt* and *mrt* relax the moments of the distribution function with their own rates;
+    this is precomputed into a single matrix :math:`C` (*collision_matrix*),
+    so a collision is :math:`f^* = f - C (f - f^{eq})` on all gridpoints at once.
+
+    * *trt*: the symmetric part of :math:`f - f^{eq}` relaxes with :math:`1/\\tau`,
+      the antisymmetric part with :math:`1/\\tau^-`, chosen so that
+      :math:`(\\tau - 1/2)(\\tau^- - 1/2)` equals the *magic parameter* (default 1/4)
+    * *mrt*: the moments of Lallemand and Luo, the stress moments relax with :math:`1/\\tau`,
+      energy, energy square and heat flux with the *relaxation rates* "e", "epsilon" and "q"
+
+    :param sim: Simulation instance with *tau* already set
+    :param simulation_parameters: dictionary containing the simulation parameters
+    """
+
+    sim.collision = simulation_parameters.get("collision", "bgk")
+    if sim.collision == "bgk":
+        sim.collision_matrix = None
+        return
+    if sim.collision not in ("trt", "mrt"):
+        print("ERROR: collision has to be 'bgk', 'trt' or 'mrt'")
+        quit()
+    if np.ndim(sim.tau):
+        print("ERROR: the collision '%s' needs the same tau for all ensemble members"
+              % sim.collision)
+        quit()
+
+    omega = 1 / sim.tau
+    if sim.collision == "trt":
+        magic = simulation_parameters.get("magic parameter", 0.25)
+        omega_minus = 1 / (0.5 + magic / (sim.tau - 0.5))
+        inverse = np.eye(9)[sim.e_inverse]
+        matrix = omega * (np.eye(9) + inverse) / 2 + omega_minus * (np.eye(9) - inverse) / 2
+    else:
+        rates = dict({"e": 1.64, "epsilon": 1.54, "q": 1.9},
+                     **simulation_parameters.get("relaxation rates", {}))
+        moments = mrt_moments(sim.e)
+        # conserved moments relax like in bgk, so equal rates give the bgk operator
+        relaxation = np.diag([omega, rates["e"], rates["epsilon"], omega, rates["q"],
+                              omega, rates["q"], omega, omega])
+        matrix = np.linalg.solve(moments, relaxation @ moments)
+    sim.collision_matrix = matrix.astype(sim.dtype)
+
+
+def convergence_definition(sim, simulation_parameters):
+    """
+    Helper function to set up the convergence detection (see :mod:`convergence`).
+
+    :param sim: Simulation instance
+    :param simulation_parameters: dictionary containing the simulation parameters,
+        optionally *convergence* with *threshold* and *check frequency* (default 100)
+    """
+
+    convergence_parameters = simulation_parameters.get("convergence")
+    if convergence_parameters is None:
+        sim.convergence_threshold = None
+        return
+    sim.convergence_threshold = convergence_parameters["threshold"]
+    sim.convergence_frequency = convergence_parameters.get("check frequency", 100)
+    if sim.convergence_threshold <= 0 or sim.convergence_frequency < 1:
+        print("ERROR: the convergence threshold has to be positive "
+              "and the check frequency at least 1")
+        quit()
+
+
+def mrt_moments(e):
+    """
+    Helper function to build the moment matrix of the d2q9 mrt collision.
+
+    The rows are density, energy, energy square, momentum x, heat flux x,
+    momentum y, heat flux y and the two stress moments (Lallemand and Luo).
+
+    :param e: directions-array
+    :return: 9x9 matrix that transforms a distribution function into its moments
+    """
+
+    e_x, e_y = e[:, 0], e[:, 1]
+    c_squared = e_x ** 2 + e_y ** 2
+    return np.array([
+        np.ones(9),
+        -4 + 3 * c_squared,
+        4 - 10.5 * c_squared + 4.5 * c_squared ** 2,
+        e_x,
+        (-5 + 3 * c_squared) * e_x,
+        e_y,
+        (-5 + 3 * c_squared) * e_y,
+        e_x ** 2 - e_y ** 2,
+        e_x * e_y
+    ])
+
+
+def component_rows(array):
+    """
+    Helper function to view a lattice array as matrix with one row per component.
+
+    :param array: array of shape (9, ...) whose gridpoints are contiguous for every component
+    :return: view of shape (9, number of gridpoints), writing to it changes the array
+    """
+
+    rows = array.view()
+    rows.shape = (array.shape[0], -1)  # raises instead of copying
+    return rows
+
+
+def allocate_lattice(sim):
+    """
+    Allocate every lattice-sized array the simulation needs.
+
+    All buffers are created exactly once here and are reused in place by
+    the methods of the Simulation, so the main loop does not allocate
+    new lattice-sized arrays at every step.
+    An ensemble adds its members as the trailing axis of every array.
+
+    :param sim: Simulation instance with *shape* already set
+    """
+
+    sim.rho = np.empty(shape=sim.shape + sim.batch_shape, dtype=sim.dtype)
+    sim.vel = np.empty(shape=(2,) + sim.rho.shape, dtype=sim.dtype)
+    sim.f_in = np.empty(shape=(9,) + sim.rho.shape, dtype=sim.dtype)
     sim.f_eq = np.empty_like(sim.f_in)
     sim.f_out = np.empty_like(sim.f_in)
 
+    # scratch buffers for calc_equilibrium
+    sim.vel_squared = np.empty_like(sim.rho)
+    sim.e_dot_vel = np.empty_like(sim.rho)
+    sim.scratch = np.empty_like(sim.rho)
+
 
 def obstacles_definition(sim, obstacle_parameters):
     """
     Function to combine the management and association of different obstacles.\n
     In the loop over the obstacle can be added further types of them.
 
+    All obstacles are drawn into one preallocated mask;
+    cylinders and rectangles only touch the gridpoints of their bounding boxes.
+
     :param sim: Simulation instance
     :param obstacle_parameters: dictionary containing the characteristics of the obstacle
     :return: **obstacle**
@@ -50,66 +212,140 @@ def obstacles_definition(sim, obstacle_parameters):
     sim.obstacle = np.full(shape=sim.shape, fill_value=False)
     for obstacle_parameter in obstacle_parameters:
         if obstacle_parameter["type"] == "cylindrical obstacle":
-            sim.obstacle = np.logical_or(sim.obstacle,
-                                         cylinder_function(sim, obstacle_parameter))
+            cylinder_function(sim, obstacle_parameter, sim.obstacle)
         elif obstacle_parameter["type"] == "recktangle obstacle":
-            sim.obstacle = np.logical_or(sim.obstacle,
-                                         recktangle_function(sim, obstacle_parameter))
+            recktangle_function(sim, obstacle_parameter, sim.obstacle)
         elif obstacle_parameter["type"] == "png import":
-            sim.obstacle = np.logical_or(sim.obstacle,
-                                         png_importer(sim, obstacle_parameter["file name"]))
+            np.logical_or(sim.obstacle, png_importer(sim, obstacle_parameter["file name"]),
+                          out=sim.obstacle)
         else:
             print("obstacle ", obstacle_parameter, "not recognised")
             quit()
 
     if sim.args.show_obstacle:
-        plt.imshow(sim.obstacle.T, origin='lower', cmap='Greys', interpolation='nearest')
-        plt.show()
+        show_obstacle(sim)
 
 
-def cylinder_function(sim, obstacle_parameter):
+def show_obstacle(sim):
+    """
+    Helper function to show the obstacle in a window before the simulation starts.
+
+    :param sim: Simulation instance with obstacle already set
+    """
+
+    plt.imshow(sim.obstacle.T, origin='lower', cmap='Greys', interpolation='nearest')
+    plt.show()
+
+
+def cylinder_function(sim, obstacle_parameter, obstacle=None):
     """
     Helper function to define round obstacles.
 
-    Create a boolean numpy-array with the same shape as the simulated grid
-    with *True*-values at every gridpoint that is blocked by the obstacle.
+    Set *True*-values at every gridpoint that is blocked by the obstacle
+    in a boolean numpy-array with the same shape as the simulated grid.
+    *x-position*, *y-position* and *radius* can be lists (or arrays) to define
+    many cylinders at once, e.g. a packed bed; a single value is used for all of them.
 
     :param sim: Simulation instance
     :param obstacle_parameter: dictionary containing the characteristics of the circle
+    :param obstacle: boolean ndarray to draw the cylinders into, *None* for a new one
     :return: **obstacle**
         boolean ndarray that specifies the cylindrical obstacle
         in an array with shape = (*n_x*, *n_y*)
     """
 
-    cylinder_y = obstacle_parameter["y-position"]
-    cylinder_x = obstacle_parameter["x-position"]
-    cylinder_r = obstacle_parameter["radius"]
-    cylinder = np.fromfunction(
-        lambda x, y: (cylinder_x - x) ** 2 + (cylinder_y - y) ** 2 < cylinder_r ** 2,
-        sim.shape
+    if obstacle is None:
+        obstacle = np.full(shape=sim.shape, fill_value=False)
+    rasterize_cylinders(
+        obstacle,
+        obstacle_parameter["x-position"],
+        obstacle_parameter["y-position"],
+        obstacle_parameter["radius"]
     )
-    return cylinder
+    return obstacle
 
 
-def recktangle_function(sim, obstacle_parameter):
+def recktangle_function(sim, obstacle_parameter, obstacle=None):
     """
     Helper function to define rectangular obstacles.
 
-    Create a boolean numpy-array with the same shape as the simulated grid
-    with *True*-values at every gridpoint that is blocked by the obstacle.
+    Set *True*-values at every gridpoint that is blocked by the obstacle
+    in a boolean numpy-array with the same shape as the simulated grid.
+    *bottom_left* and *top_right* can be lists of corners to define many rectangles at once.
 
     :param sim: Simulation instance
     :param obstacle_parameter: dictionary containing the characteristics of the rectangle
+    :param obstacle: boolean ndarray to draw the rectangles into, *None* for a new one
     :return: **obstacle**
         boolean ndarray that specifies the rectangular obstacle
         in an array with shape = (*n_x*, *n_y*)
     """
 
-    point1 = obstacle_parameter["bottom_left"]
-    point2 = obstacle_parameter["top_right"]
-    recktangle = np.full(shape=sim.shape, fill_value=False)
-    recktangle[point1[0]:point2[0] + 1, point1[1]:point2[1] + 1] = True
-    return recktangle
+    if obstacle is None:
+        obstacle = np.full(shape=sim.shape, fill_value=False)
+    rasterize_rectangles(obstacle, obstacle_parameter["bottom_left"],
+                         obstacle_parameter["top_right"])
+    return obstacle
+
+
+def rasterize_cylinders(obstacle, x_positions, y_positions, radii, origin=(0, 0), scale=1):
+    """
+    Helper function to draw cylinders into a boolean mask.
+
+    A gridpoint is blocked if its distance to the center is less than the radius.
+    Only the bounding boxes of the cylinders are evaluated:
+    cylinders with the same rounded up radius are drawn together
+    with one vectorized stencil of their bounding box size.
+
+    :param obstacle: boolean ndarray, changed in place
+    :param x_positions: x-coordinate of the centers, a number or an array
+    :param y_positions: y-coordinate of the centers, a number or an array
+    :param radii: radii of the cylinders, a number or an array
+    :param origin: coordinates of the gridpoint (0, 0) of the mask
+    :param scale: number of gridpoints of the mask per unit of the coordinates
+    """
+
+    x_positions, y_positions, radii = (array.ravel() for array in np.broadcast_arrays(
+        (np.asarray(x_positions, dtype=float) - origin[0]) * scale,
+        (np.asarray(y_positions, dtype=float) - origin[1]) * scale,
+        np.asarray(radii, dtype=float) * scale
+    ))
+    reaches = np.ceil(radii).astype(int)
+    for reach in np.unique(reaches):
+        members = reaches == reach
+        center_x = x_positions[members][:, None, None]
+        center_y = y_positions[members][:, None, None]
+        radius = radii[members][:, None, None]
+
+        # gridpoints of the bounding boxes, shape (cylinders, width, 1) and (cylinders, 1, width)
+        offsets = np.arange(-reach, reach + 2)
+        x = np.floor(center_x).astype(int) + offsets[None, :, None]
+        y = np.floor(center_y).astype(int) + offsets[None, None, :]
+        inside = (center_x - x) ** 2 + (center_y - y) ** 2 < radius ** 2
+        inside &= (x >= 0) & (x < obstacle.shape[0]) & (y >= 0) & (y < obstacle.shape[1])
+        x, y = np.broadcast_arrays(x, y)
+        obstacle[x[inside], y[inside]] = True
+
+
+def rasterize_rectangles(obstacle, bottom_left, top_right, origin=(0, 0), scale=1):
+    """
+    Helper function to draw rectangles into a boolean mask.
+
+    A gridpoint is blocked if it lies inside a rectangle or on its border.
+
+    :param obstacle: boolean ndarray, changed in place
+    :param bottom_left: bottom left corners, a list of 2 or an array of shape (*n*, 2)
+    :param top_right: top right corners, a list of 2 or an array of shape (*n*, 2)
+    :param origin: coordinates of the gridpoint (0, 0) of the mask
+    :param scale: number of gridpoints of the mask per unit of the coordinates
+    """
+
+    lower = np.ceil((np.asarray(bottom_left, dtype=float) - origin) * scale).astype(int)
+    upper = np.floor((np.asarray(top_right, dtype=float) - origin) * scale).astype(int) + 1
+    lower, upper = (np.clip(corners, 0, obstacle.shape).reshape(-1, 2)
+                    for corners in np.broadcast_arrays(lower, upper))
+    for (x_start, y_start), (x_stop, y_stop) in zip(lower, upper):
+        obstacle[x_start:x_stop, y_start:y_stop] = True
 
 
 def png_importer(sim, png_path):
@@ -141,7 +377,7 @@ def png_importer(sim, png_path):
     quit()
 
 
-def set_boundary_conditions(sim, boundary_conditions):
+def set_boundary_conditions(sim, boundary_conditions, bounce_back_links=None):
     """
     Helper function to check and define boundary conditions.
 
@@ -154,6 +390,9 @@ def set_boundary_conditions(sim, boundary_conditions):
 
     :param sim: Simulation instance
     :param boundary_conditions: dictionary containing the boundary conditions
+    :param bounce_back_links: links of the obstacle, e.g. from the setup cache,
+        *None* to find them (see :func:`compile_bounce_back_links`)
+    :return: the links of the obstacle (see :func:`bounce_back_links`)
     """
 
     # setup
@@ -195,13 +434,159 @@ def set_boundary_conditions(sim, boundary_conditions):
         # save zou-he velocity in a dictionary in connection to the direction
         elif bc["type"] == "zou-he":
             sim.boundarys[direction] = "zou-he"
-            sim.zou_he_conditions[direction] = (bc["v_x"], bc["v_y"])
+            sim.zou_he_conditions[direction] = (
+                ensemble_parameter(sim, bc["v_x"], "v_x"),
+                ensemble_parameter(sim, bc["v_y"], "v_y")
+            )
 
         # ERROR
         else:
             print("ERROR: A boundary condition is not valid or does not exist")
             quit()
 
+    compile_stream_plan(sim)
+    bounce_back_links = compile_bounce_back_links(sim, bounce_back_links)
+    compile_boundary_plan(sim)
+    return bounce_back_links
+
+
+def compile_stream_plan(sim):
+    """
+    Helper function to precompute the blocks copied during streaming.
+
+    For every direction the shift is translated into (destination, source)
+    pairs of index tuples into the distribution function,
+    so that stream_step is a flat list of slice assignments.
+    Values only wrap around the x (y) axis if the E and W (N and S) borders are periodic.
+
+    :param sim: Simulation instance with boundary conditions already set
+    """
+
+    periodic = (sim.boundarys["E"] == "periodic", sim.boundarys["N"] == "periodic")
+    sim.stream_plan = [
+        ((i,) + destination, (i,) + source)
+        for i in range(9)
+        for destination, source in sim.shift_slices(sim.e[i], periodic)
+    ]
+
+
+def bounce_back_links(sim):
+    """
+    Helper function to find the links between obstacle and fluid.
+
+    Only components that stream from an obstacle gridpoint into the fluid
+    are affected by bounce back; everything else stays inside the obstacle.
+    For every such link a flat index into the post-collision distribution function
+    and the flat index of its inverse component in the distribution function
+    are found, so bounce_back only touches the surface of the obstacles.
+    The streaming plan decides where a component streams to,
+    so it has to be compiled first.
+
+    :param sim: Simulation instance with obstacle and stream_plan already set
+    :return: integer ndarray of shape (2, *links*) with the flat indices
+        into the post-collision and into the distribution function of a single simulation
+    """
+
+    n_points = sim.shape[0] * sim.shape[1]
+    destinations = []
+    sources = []
+    for i, j in enumerate(sim.e_inverse):
+        # does the component i of a gridpoint stream into the fluid?
+        streams_into_fluid = np.full(shape=sim.shape, fill_value=False)
+        for destination, source in sim.stream_plan:
+            if destination[0] == i:
+                streams_into_fluid[source[1:]] = ~sim.obstacle[destination[1:]]
+
+        links = np.flatnonzero(np.logical_and(sim.obstacle, streams_into_fluid))
+        destinations.append(i * n_points + links)
+        sources.append(j * n_points + links)
+    return np.array([np.concatenate(destinations), np.concatenate(sources)])
+
+
+def compile_bounce_back_links(sim, links=None):
+    """
+    Helper function to store the links between obstacle and fluid for bounce_back.
+
+    :param sim: Simulation instance with obstacle and stream_plan already set
+    :param links: result of :func:`bounce_back_links` for this obstacle, *None* to find them
+    :return: the links, e.g. to store them in the setup cache
+    """
+
+    if links is None:
+        links = bounce_back_links(sim)
+
+    # every member of an ensemble has the same links, it is the last index
+    members = int(np.prod(sim.batch_shape, dtype=int))
+    sim.bounce_back_destination = (links[0][:, None] * members + np.arange(members)).ravel()
+    sim.bounce_back_source = (links[1][:, None] * members + np.arange(members)).ravel()
+    sim.bounce_back_buffer = np.empty(shape=sim.bounce_back_source.shape, dtype=sim.f_in.dtype)
+    return links
+
+
+def compile_boundary_plan(sim):
+    """
+    Helper function to precompute the corrections at *zou-he* and *outflow* borders.
+
+    The borders are translated into index tuples, so that correct_macroscopic,
+    correct_distr_func and correct_outflow are flat lists of array operations
+    without looking up directions and conditions at every step:
+
+    * *zou_he_macroscopic_plan*: for every *zou-he* border the index of its gridpoints,
+      the fixed velocity, the indices of the tangential and the outgoing components
+      and the divisor :math:`(1 - u_n) / 2` of the density, :math:`u_n` being the velocity
+      along the axis of the border
+    * *zou_he_distr_plan*: for every *zou-he* border the indices of the incoming components
+      and of their inverse components
+    * *outflow_plan*: for every *outflow* border the indices of the incoming components
+      and of the same components one gridpoint away from the border
+
+    The divisor is computed in the precision of the simulation,
+    so the density is bit-identical to dividing by :math:`1 - u_n` at every step.
+
+    :param sim: Simulation instance with boundary conditions already set
+    """
+
+    sim.zou_he_macroscopic_plan = []
+    sim.zou_he_distr_plan = []
+    sim.outflow_plan = []
+    for direction, condition in sim.boundarys.items():
+        if condition not in ("zou-he", "outflow"):
+            continue
+
+        last, second_to_last = sim.last_indices[direction]
+        incoming_indices = sim.direction_sets[sim.opposite_directions[direction]]
+        if direction == "N" or direction == "S":
+            border = (slice(None), last)
+            neighbour = (slice(None), second_to_last)
+            tangential_indices = sim.horizontal_indices
+            normal_axis = 1
+        else:
+            border = (last, slice(None))
+            neighbour = (second_to_last, slice(None))
+            tangential_indices = sim.vertical_indices
+            normal_axis = 0
+
+        if condition == "outflow":
+            sim.outflow_plan.append(((incoming_indices,) + border, (incoming_indices,) + neighbour))
+            continue
+
+        # one velocity per member, broadcast against the gridpoints of the border
+        velocity = np.array([np.broadcast_to(v, sim.batch_shape)
+                             for v in sim.zou_he_conditions[direction]])
+        divisor = (1 - np.asarray(velocity[normal_axis], dtype=sim.dtype)) / 2
+        sim.zou_he_macroscopic_plan.append((
+            border,
+            (slice(None),) + border,
+            np.expand_dims(velocity, axis=1),
+            (tangential_indices,) + border,
+            (sim.direction_sets[direction],) + border,
+            divisor
+        ))
+        sim.zou_he_distr_plan.append((
+            (incoming_indices,) + border,
+            (sim.e_inverse[incoming_indices],) + border
+        ))
+
 
 def initialize_output(sim, output_parameters):
     """
@@ -218,6 +603,7 @@ def initialize_output(sim, output_parameters):
     sim.raw_output = False
     sim.picture_output = False
     sim.snapshot = False
+    sim.checkpoint = False
 
     # create output directory
     if not os.path.exists(sim.args.output):
@@ -228,6 +614,19 @@ def initialize_output(sim, output_parameters):
             os.makedirs(sim.args.output + "snapshots")
         sim.snapshot = True
         sim.snapshot_frequency = output_parameters["snapshot"]["output frequency"]
+        sim.snapshot_compressed = output_parameters["snapshot"].get("compressed", False)
+        sim.snapshot_precision = output_parameters["snapshot"].get("precision")
+        if sim.snapshot_precision not in (None, "float32", "float64"):
+            print("ERROR: precision of the snapshots has to be 'float32' or 'float64'")
+            quit()
+
+    if "checkpoint" in output_parameters:
+        sim.checkpoint = True
+        sim.checkpoint_frequency = output_parameters["checkpoint"]["output frequency"]
+        sim.checkpoint_keep = output_parameters["checkpoint"].get("keep", 2)
+        if sim.checkpoint_keep < 1:
+            print("ERROR: at least 1 checkpoint has to be kept")
+            quit()
 
     if "picture output configuration" in output_parameters:
         picture_parameter = output_parameters["picture output configuration"]
@@ -235,49 +634,368 @@ def initialize_output(sim, output_parameters):
         sim.picture_output_frequency = picture_parameter["output frequency"]
         sim.picture_output_typ = picture_parameter["file type"]
         sim.picture_output_name = picture_parameter["file name"]
+        sim.picture_vmin = picture_parameter.get("vmin", 0)
+        sim.picture_vmax = picture_parameter.get("vmax", 0.004)
+        sim.picture_renderer = picture_parameter.get("renderer", "matplotlib")
+        if sim.picture_renderer == "fast":
+            if sim.picture_output_typ not in ("png", "rgb"):
+                print("ERROR: the fast renderer writes pictures of file type 'png' or 'rgb'")
+                quit()
+            sim.picture_lookup_table = render.lookup_table(picture_parameter.get("colormap"))
+        elif sim.picture_renderer != "matplotlib":
+            print("ERROR: renderer of the picture output has to be 'matplotlib' or 'fast'")
+            quit()
 
     if "raw data output configuration" in output_parameters:
         raw_parameter = output_parameters["raw data output configuration"]
         sim.raw_output = True
         sim.raw_output_frequency = raw_parameter["output frequency"]
-        h5file = h5py.File(sim.args.output + raw_parameter["file name"] + ".hdf5", "w")
-        h5_output = h5file.create_group("raw data output configuration")
-        sim.h5_velocity = h5_output.create_group("velocity")
-        sim.h5_density = h5_output.create_group("density")
+        sim.raw_output_layout = raw_parameter.get("layout", "datasets")
+        # a resumed simulation continues its hdf5 file (see discard_output)
+        sim.h5_file = h5py.File(
+            sim.args.output + raw_parameter["file name"] + ".hdf5", "a" if sim.args.resume else "w"
+        )
+        h5_output = sim.h5_file.require_group("raw data output configuration")
+        if sim.batch_shape:
+            # every ensemble member gets its own group
+            h5_outputs = [
+                h5_output.require_group("member %i" % member)
+                for member in range(sim.batch_shape[0])
+            ]
+        else:
+            h5_outputs = [h5_output]
+
+        # one dataset per output step
+        if sim.raw_output_layout == "datasets":
+            sim.h5_velocity = [group.require_group("velocity") for group in h5_outputs]
+            sim.h5_density = [group.require_group("density") for group in h5_outputs]
+
+        # one dataset per field with time as first axis, chunked per frame
+        elif sim.raw_output_layout == "chunked":
+            compression = raw_parameter.get("compression")
+            if compression not in (None, "gzip", "lzf"):
+                print("ERROR: compression of the raw data output has to be 'gzip' or 'lzf'")
+                quit()
+            vel, rho = ensemble_member(sim, 0)
+            sim.h5_velocity = []
+            sim.h5_density = []
+            sim.h5_steps = []
+            for group in h5_outputs:
+                for datasets, name, shape in ((sim.h5_velocity, "velocity", vel.shape),
+                                              (sim.h5_density, "density", rho.shape)):
+                    datasets.append(group[name] if name in group else group.create_dataset(
+                        name, shape=(0,) + shape, maxshape=(None,) + shape,
+                        chunks=(1,) + shape, dtype=sim.dtype, compression=compression,
+                        shuffle=raw_parameter.get("shuffle", False)
+                    ))
+                sim.h5_steps.append(group["steps"] if "steps" in group else group.create_dataset(
+                    "steps", shape=(0,), maxshape=(None,), chunks=(1024,), dtype=np.int64
+                ))
+
+        else:
+            print("ERROR: layout of the raw data output has to be 'datasets' or 'chunked'")
+            quit()
 
 
-def store_output(sim, step):
+def store_output(sim, step, final=False):
     """
     Helper function to save output.
 
     Check if output-flags are set and save output with specified frequencies.
     :param sim: Simulation instance
     :param step: number specifying the current simulation step
+    :param final: save every output regardless of the frequencies, e.g. at the last step
+        of a converged simulation
     """
 
     if sim.snapshot:
-        if step % sim.snapshot_frequency == 0:
-            np.save(sim.args.output + "snapshots/snap_%05i" % (step + sim.step_offset), sim.f_in)
+        if final or step_due(sim, step, sim.snapshot_frequency):
+            save_snapshot(sim, step)
     if sim.raw_output:
-        if step % sim.raw_output_frequency == 0:
-            sim.h5_velocity.create_dataset("%i" % (step + sim.step_offset), data=sim.vel)
-            sim.h5_density.create_dataset("%i" % (step + sim.step_offset), data=sim.rho)
+        if final or step_due(sim, step, sim.raw_output_frequency):
+            for member, (velocity, density) in enumerate(zip(sim.h5_velocity, sim.h5_density)):
+                vel, rho = ensemble_member(sim, member)
+                if sim.raw_output_layout == "chunked":
+                    append_frame(velocity, vel)
+                    append_frame(density, rho)
+                    steps = sim.h5_steps[member]
+                    steps.resize(steps.shape[0] + 1, axis=0)
+                    steps[-1] = step + sim.step_offset
+                else:
+                    velocity.create_dataset("%i" % (step + sim.step_offset), data=vel)
+                    density.create_dataset("%i" % (step + sim.step_offset), data=rho)
     if sim.picture_output:
-        if step % sim.picture_output_frequency == 0:
-            plt.imshow(
-                (sim.vel[0] * sim.vel[0] + sim.vel[1] * sim.vel[1]).T,
-                origin='lower',
-                vmin=0,
-                vmax=0.004
-            )
-            plt.title("t = %i" % (step + sim.step_offset))
-            plt.xlabel("x")
-            plt.ylabel("y")
-            plt.savefig(
-                sim.args.output + sim.picture_output_name + "%05i."
-                % (step + sim.step_offset) + sim.picture_output_typ
-            )
-            plt.cla()
+        if final or step_due(sim, step, sim.picture_output_frequency):
+            for member in range(sim.batch_shape[0] if sim.batch_shape else 1):
+                vel, _ = ensemble_member(sim, member)
+                filename = (
+                    sim.args.output + sim.picture_output_name +
+                    ("_member%i_" % member if sim.batch_shape else "") +
+                    "%05i" % (step + sim.step_offset)
+                )
+                if sim.picture_renderer == "fast":
+                    render.save_picture(
+                        filename,
+                        vel[0] * vel[0] + vel[1] * vel[1],
+                        sim.picture_vmin,
+                        sim.picture_vmax,
+                        sim.picture_lookup_table,
+                        sim.picture_output_typ
+                    )
+                    continue
+                plt.imshow(
+                    (vel[0] * vel[0] + vel[1] * vel[1]).T,
+                    origin='lower',
+                    vmin=sim.picture_vmin,
+                    vmax=sim.picture_vmax
+                )
+                plt.title("t = %i" % (step + sim.step_offset))
+                plt.xlabel("x")
+                plt.ylabel("y")
+                plt.savefig(filename + "." + sim.picture_output_typ)
+                plt.cla()
+
+
+def append_frame(dataset, frame):
+    """
+    Helper function to append a frame to a dataset with time as first axis.
+
+    :param dataset: resizable hdf5 dataset
+    :param frame: array with the shape of one frame
+    """
+
+    n_frames = dataset.shape[0]
+    dataset.resize(n_frames + 1, axis=0)
+    dataset.write_direct(np.ascontiguousarray(frame), dest_sel=np.s_[n_frames])
+
+
+def geometry_hash(sim):
+    """
+    Helper function to identify the geometry of a simulation.
+
+    :param sim: Simulation instance with obstacle and boundary conditions already set
+    :return: hexadecimal sha256 hash of shape, boundary conditions and obstacle
+    """
+
+    geometry = hashlib.sha256(json.dumps([sim.shape, sim.boundarys], sort_keys=True).encode())
+    geometry.update(np.packbits(sim.obstacle).tobytes())
+    return geometry.hexdigest()
+
+
+def save_snapshot(sim, step):
+    """
+    Helper function to save the distribution function as snapshot.
+
+    The snapshot *snap_<step>.npy* (or *.npz* if compressed) is written together with
+    *snap_<step>.json*, which holds the step, the simulation parameters and the geometry hash.
+
+    :param sim: Simulation instance
+    :param step: number specifying the current simulation step
+    """
+
+    path = sim.args.output + "snapshots/snap_%05i" % (step + sim.step_offset)
+    f_in = sim.f_in
+    if sim.snapshot_precision is not None:
+        f_in = f_in.astype(sim.snapshot_precision, copy=False)
+    if sim.snapshot_compressed:
+        np.savez_compressed(path + ".npz", f_in=f_in)
+    else:
+        np.save(path + ".npy", f_in)
+
+    with open(path + ".json", "w") as metadata_file:
+        json.dump(snapshot_metadata(sim, step, f_in.dtype), metadata_file, indent=4)
+
+
+def snapshot_metadata(sim, step, precision):
+    """
+    Helper function to describe a snapshot.
+
+    :param sim: Simulation instance
+    :param step: number specifying the current simulation step
+    :param precision: floating point type the distribution function is stored in
+    :return: dictionary with the step, the simulation parameters and the geometry hash
+    """
+
+    return {
+        "step": step + sim.step_offset,
+        "simulation name": sim.name,
+        "simulation id": sim.id,
+        "tau": np.asarray(sim.tau).tolist(),
+        "collision": sim.collision,
+        "lattice points x": sim.shape[0],
+        "lattice points y": sim.shape[1],
+        "ensemble members": sim.batch_shape[0] if sim.batch_shape else None,
+        "precision": np.dtype(sim.dtype).name,
+        "snapshot precision": np.dtype(precision).name,
+        "boundary conditions": sim.boundarys,
+        "geometry": geometry_hash(sim),
+    }
+
+
+def load_snapshot(sim, path):
+    """
+    Helper function to set the initial distribution function from a snapshot.
+
+    If the metadata file of the snapshot exists, the step offset is set to its step
+    and a different geometry is reported.
+    An uncompressed snapshot in the precision of the simulation is memory-mapped copy-on-write
+    instead of read, so its pages are only loaded when the first step touches them.
+
+    :param sim: Simulation instance with allocated lattice
+    :param path: path to the *.npy* or *.npz* snapshot
+    """
+
+    try:
+        if path.endswith(".npz"):
+            with np.load(path) as archive:
+                f_in = archive["f_in"]
+        else:
+            f_in = np.load(path, mmap_mode="c")
+    except (IOError, ValueError, KeyError) as error:
+        print("ERROR: could not open snapshot-file. Simulation was aborted.\n" + str(error))
+        quit()
+    if f_in.shape != sim.f_in.shape:
+        print("ERROR: the shape %s of the snapshot does not match the simulation %s. "
+              "Simulation was aborted." % (f_in.shape, sim.f_in.shape))
+        quit()
+
+    metadata_path = os.path.splitext(path)[0] + ".json"
+    if os.path.isfile(metadata_path):
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        if metadata["geometry"] != geometry_hash(sim):
+            print("WARNING: the snapshot was taken with other obstacles or boundary conditions.")
+        if sim.step_offset not in (0, metadata["step"]):
+            print("WARNING: 'step offset' is replaced by the step %i of the snapshot."
+                  % metadata["step"])
+        sim.step_offset = metadata["step"]
+    elif sim.step_offset == 0:
+        print("WARNING: Starting from a snapshot without metadata "
+              "but 'step offset' was not changed. "
+              "This will cause duplication in naming the steps in your output.")
+
+    if isinstance(f_in, np.memmap) and f_in.dtype == sim.f_in.dtype:
+        sim.f_in = f_in.view(np.ndarray)
+    else:
+        sim.f_in[:] = f_in
+
+
+def discard_output(sim, step):
+    """
+    Helper function to remove the raw data output after a step.
+
+    A resumed simulation continues its hdf5 file; frames and convergence checks
+    after the checkpoint it resumes from are written again.
+
+    :param sim: Simulation instance
+    :param step: last step (including the step offset) to keep
+    """
+
+    if not sim.raw_output:
+        return
+    if "convergence" in sim.h5_file:
+        group = sim.h5_file["convergence"]
+        checks = int(np.count_nonzero(group["steps"][()] <= step))
+        for dataset in (group["steps"], group["residual"]):
+            dataset.resize(checks, axis=0)
+        if group.attrs.get("converged step", step + 1) > step:
+            group.attrs.pop("converged step", None)
+    for member in range(len(sim.h5_velocity)):
+        if sim.raw_output_layout == "chunked":
+            steps = sim.h5_steps[member]
+            frames = int(np.count_nonzero(steps[()] <= step))
+            for dataset in (sim.h5_velocity[member], sim.h5_density[member], steps):
+                dataset.resize(frames, axis=0)
+        else:
+            for group in (sim.h5_velocity[member], sim.h5_density[member]):
+                for name in list(group):
+                    if int(name) > step:
+                        del group[name]
+
+
+def close_output(sim):
+    """
+    Helper function to close the hdf5 file of the raw data output.
+
+    :param sim: Simulation instance
+    """
+
+    if sim.raw_output:
+        sim.h5_file.close()
+
+
+def raw_output_frames(group, field):
+    """
+    Helper function to read a field of the raw data output in any layout.
+
+    :param group: hdf5 group *raw data output configuration* or the group of an ensemble member
+    :param field: "velocity" or "density"
+    :return: sorted list of the steps and a sequence of the frames in the same order;
+        in the *chunked* layout this is the dataset itself, so a frame is only read on access
+    """
+
+    if isinstance(group[field], h5py.Dataset):
+        return [int(step) for step in group["steps"]], group[field]
+    steps = sorted(int(name) for name in group[field])
+    return steps, [group[field]["%i" % step] for step in steps]
+
+
+def ensemble_member(sim, member):
+    """
+    Helper function to get velocity and density of one member of an ensemble.
+
+    :param sim: Simulation instance
+    :param member: index of the ensemble member, 0 for a single simulation
+    :return: velocity and density of the member
+    """
+
+    if sim.batch_shape:
+        return sim.vel[..., member], sim.rho[..., member]
+    return sim.vel, sim.rho
+
+
+def step_due(sim, step, frequency):
+    """
+    Helper function to check if a periodic output is due at a step.
+
+    The steps are counted including the step offset,
+    so a restarted or resumed simulation keeps the steps of its output.
+
+    :param sim: Simulation instance
+    :param step: number specifying the simulation step
+    :param frequency: number of iteration-steps between output
+    :return: *True* if the output is due at this step
+    """
+
+    return (step + sim.step_offset) % frequency == 0
+
+
+def output_due(sim, step):
+    """
+    Helper function to check if store_output or a checkpoint writes anything at a step.
+
+    :param sim: Simulation instance
+    :param step: number specifying the simulation step
+    :return: *True* if any output is due at this step
+    """
+
+    return (
+        (sim.snapshot and step_due(sim, step, sim.snapshot_frequency)) or
+        (sim.checkpoint and step_due(sim, step, sim.checkpoint_frequency)) or
+        (sim.raw_output and step_due(sim, step, sim.raw_output_frequency)) or
+        (sim.picture_output and step_due(sim, step, sim.picture_output_frequency))
+    )
+
+
+def total_mass(sim):
+    """
+    Helper function to sum up the distribution function in double precision.
+
+    :param sim: Simulation instance
+    :return: total mass on the lattice
+    """
+
+    return float(np.sum(sim.f_in, dtype=np.float64))
 
 
 def progress_bar(value, endvalue, bar_length=50):
@@ -311,7 +1029,7 @@ def give_powerfeedback(sim, t0, t1):
                                     ||----w |
                                     ||     ||
         """ % (sim.timesteps,
-               t1 - t0, sim.n_x * sim.n_y * sim.timesteps * 1e-6 / (t1 - t0)))
+               t1 - t0, sim.rho.size * sim.timesteps * 1e-6 / (t1 - t0)))
 
 
 def system_test(args):
@@ -332,13 +1050,13 @@ def system_test(args):
     """
 
     # reading velocity values of the last timestep hdf5 file
-    f = h5py.File(args.output + "temp_system_test.hdf5", 'r')
-    velocity_names = list(f['raw data output configuration']['velocity'])
-    velocity_value = (f['raw data output configuration']['velocity'][velocity_names[-1]])
+    with h5py.File(args.output + "temp_system_test.hdf5", 'r') as f:
+        steps, velocity_values = raw_output_frames(f['raw data output configuration'], 'velocity')
+        velocity_value = velocity_values[len(steps) - 1][()]
     os.remove(args.output + "temp_system_test.hdf5")
 
-    # Fit the speed profile at the exit of the tube
-    y_speed = velocity_value[0, -2, :]
+    # Fit the speed profile at the exit of the tube, without the bounce back walls
+    y_speed = velocity_value[0, -2, 1:-1]
     x = range(len(y_speed))
     coefs, residuals, _, _, _ = np.polyfit(x, y_speed, 2, full=True)
 
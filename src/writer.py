@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Background writer for the output of a Simulation.
+
+Storing output (snapshots, hdf5 datasets, pictures) takes long compared to an iteration step.
+The OutputWriter copies the arrays of an output step into one of a few preallocated frames
+and hands the frame to a background thread, which performs the output
+with utilities.store_output while the simulation goes on.
+If every frame is still waiting to be written, the simulation waits for the writer.
+"""
+import copy
+import queue
+import threading
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from src import utilities
+
+
+class OutputWriter():
+    """
+    Double-buffered output writer with a background thread.
+
+    A frame is a shallow copy of the Simulation with its own *rho*, *vel*
+    and, if snapshots are written, *f_in*, so store_output can be called on it
+    like on the Simulation itself.
+    """
+
+    def __init__(self, sim, frames=2):
+        """
+        Initialize the writer and start its thread.
+
+        :param sim: Simulation instance with initialized output
+        :param frames: number of output steps that may wait to be written,
+            0 writes synchronously in the main loop
+        """
+
+        self.sim = sim
+        self.error = None
+
+        # seconds spent by the main loop copying and waiting, by the writer writing
+        self.copy_time = 0
+        self.wait_time = 0
+        self.write_time = 0
+
+        self.free_frames = queue.Queue()
+        self.jobs = queue.Queue()
+        for _ in range(frames):
+            frame = copy.copy(sim)
+            frame.rho = np.empty_like(sim.rho)
+            frame.vel = np.empty_like(sim.vel)
+            frame.f_in = np.empty_like(sim.f_in) if sim.snapshot else None
+            self.free_frames.put(frame)
+
+        self.thread = None
+        if frames > 0:
+            # GUI backends of pyplot only work in the main thread, pictures go to files anyway
+            if sim.picture_output and sim.picture_renderer == "matplotlib":
+                plt.switch_backend("Agg")
+            self.thread = threading.Thread(target=self.write_frames)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def submit(self, step, final=False):
+        """
+        Store the output that is due at a step.
+
+        Waits for a free frame if the writer is behind (backpressure).
+
+        :param step: number specifying the current simulation step
+        :param final: store every output, see utilities.store_output
+        """
+
+        sim = self.sim
+        if not (final or utilities.output_due(sim, step)):
+            return
+
+        # synchronous output
+        if self.thread is None:
+            t0 = time.perf_counter()
+            utilities.store_output(sim, step, final)
+            self.wait_time += time.perf_counter() - t0
+            self.write_time += time.perf_counter() - t0
+            return
+
+        t0 = time.perf_counter()
+        frame = self.free_frames.get()
+        t1 = time.perf_counter()
+        self.check()
+        np.copyto(frame.rho, sim.rho)
+        np.copyto(frame.vel, sim.vel)
+        if sim.snapshot and (final or utilities.step_due(sim, step, sim.snapshot_frequency)):
+            np.copyto(frame.f_in, sim.f_in)
+        self.jobs.put((frame, step, final))
+        self.wait_time += t1 - t0
+        self.copy_time += time.perf_counter() - t1
+
+    def write_frames(self):
+        """
+        Write submitted frames until the writer is closed; runs in the background thread.
+
+        After an error the remaining frames are skipped, the main loop aborts at the next submit.
+        """
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            frame, step, final = job
+            if self.error is None:
+                t0 = time.perf_counter()
+                try:
+                    utilities.store_output(frame, step, final)
+                except Exception as error:
+                    self.error = error
+                self.write_time += time.perf_counter() - t0
+            self.free_frames.put(frame)
+
+    def check(self):
+        """
+        Abort the simulation if the writer failed.
+        """
+
+        if self.error is not None:
+            print("\nERROR: could not write output. Simulation was aborted.\n" + str(self.error))
+            quit()
+
+    def close(self):
+        """
+        Wait until every submitted frame is written and stop the thread.
+        """
+
+        if self.thread is not None:
+            t0 = time.perf_counter()
+            self.jobs.put(None)
+            self.thread.join()
+            self.thread = None
+            self.wait_time += time.perf_counter() - t0
+        self.check()
+
+    def feedback(self):
+        """
+        Print how much of the time spent writing output was hidden behind the simulation.
+        """
+
+        hidden = max(self.write_time - self.wait_time, 0)
+        print("Output: %.2f s writing, %.2f s copying, %.2f s waiting for the writer"
+              " -> %.2f s of writing hidden behind the simulation"
+              % (self.write_time, self.copy_time, self.wait_time, hidden))
@@ -2,9 +2,61 @@
 """
 Unittests for core functions of the algorithm
 """
+import argparse
+import tracemalloc
 import unittest
 import numpy as np
 from src.d2q9_simulation import Simulation
+from src import utilities
+
+
+def channel_simulation(nx, ny, precision="float64", tau=0.8, v_x=0.04, members=None,
+                       collision="bgk"):
+    """
+    Create a channel flow around a cylinder
+
+    Initialize a Simulation with the utilities, like kaLB does,
+    but without any output.
+
+    :param nx: lattice points x
+    :param ny: lattice points y
+    :param precision: "float32" or "float64"
+    :param tau: relaxation parameter, a list for an ensemble
+    :param v_x: inflow velocity, a list for an ensemble
+    :param members: number of ensemble members, *None* for a single simulation
+    :param collision: collision operator "bgk", "trt" or "mrt"
+    :return: Simulation instance
+    """
+    sim = Simulation()
+    sim.args = argparse.Namespace(show_obstacle=False, snapshot=None, resume=False,
+                                  profile=False, profile_memory=False)
+    simulation_parameters = {
+        "simulation name": "test",
+        "simulation id": "000",
+        "time steps": 10,
+        "step offset": 0,
+        "lattice points x": nx,
+        "lattice points y": ny,
+        "tau": tau,
+        "precision": precision,
+        "collision": collision
+    }
+    if members is not None:
+        simulation_parameters["ensemble members"] = members
+    utilities.simulation_parameters_definition(sim, simulation_parameters)
+    utilities.obstacles_definition(sim, [{
+        "type": "cylindrical obstacle",
+        "x-position": nx // 3,
+        "y-position": ny // 2,
+        "radius": 4
+    }])
+    utilities.set_boundary_conditions(sim, {
+        "N": {"type": "bounce_back"},
+        "E": {"type": "outflow"},
+        "S": {"type": "bounce_back"},
+        "W": {"type": "zou-he", "v_x": v_x, "v_y": 0}
+    })
+    return sim
 
 
 class test_Simulation(unittest.TestCase):
@@ -21,6 +73,15 @@ class test_Simulation(unittest.TestCase):
         """
         self.nx, self.ny = 500, 500
         self.test_sim = Simulation()
+        self.test_sim.shape = (self.nx, self.ny)
+        utilities.allocate_lattice(self.test_sim)
+        self.test_sim.boundarys = {
+            "N": "periodic",
+            "E": "periodic",
+            "S": "periodic",
+            "W": "periodic"
+        }
+        utilities.compile_stream_plan(self.test_sim)
         self.test_sim.f_in = -np.random.uniform(1, 0, (9, self.nx, self.ny))
         self.test_sim.rho = -np.random.uniform(-1, 0, (self.nx, self.ny))
         self.test_sim.vel = np.random.normal(0, 0.02, (2, self.nx, self.ny))
@@ -60,7 +121,7 @@ class test_Simulation(unittest.TestCase):
 
         Calculate control-value for distribution function :math:`f_i`
         with "streamed" a.k.a. shifted values in an easy to understand way,
-        to make sure NumPy *roll* methods are used correctly.
+        to make sure the shifted slices are used correctly.
         """
 
         # control calculation
@@ -82,11 +143,45 @@ class test_Simulation(unittest.TestCase):
                     control_f_in[i, x_next, y_next] = f_out[i, xi, yi]
 
         # do calculation in dummy Object
-        self.test_sim.f_out = self.test_sim.f_in
+        self.test_sim.f_out = self.test_sim.f_in.copy()
         self.test_sim.stream_step()
 
         # test
-        self.assertTrue(np.alltrue(control_f_in == self.test_sim.f_in))
+        self.assertTrue(np.all(control_f_in == self.test_sim.f_in))
+
+    def test_stream_step_non_periodic(self):
+        """
+        Unittest for stream_step method at non-periodic borders
+
+        Without periodic borders nothing may wrap around:
+        incoming components at the borders have to keep their old values,
+        everything else is shifted like in the periodic case.
+        """
+
+        # control calculation with periodic streaming
+        f_out = self.test_sim.f_in.copy()
+        self.test_sim.f_out = f_out
+        self.test_sim.stream_step()
+        control_f_in = self.test_sim.f_in.copy()
+
+        # do calculation in dummy Object
+        self.test_sim.boundarys = {"N": "outflow", "E": "outflow", "S": "zou-he", "W": "zou-he"}
+        utilities.compile_stream_plan(self.test_sim)
+        old_f_in = self.test_sim.f_in.copy()
+        self.test_sim.stream_step()
+
+        # test
+        for i, (e_x, e_y) in enumerate(self.test_sim.e):
+            x_border = {1: 0, -1: -1}.get(e_x)
+            y_border = {1: 0, -1: -1}.get(e_y)
+            incoming = np.full(shape=(self.nx, self.ny), fill_value=False)
+            if x_border is not None:
+                incoming[x_border, :] = True
+            if y_border is not None:
+                incoming[:, y_border] = True
+            f_in = self.test_sim.f_in[i]
+            self.assertTrue(np.all(f_in[incoming] == old_f_in[i][incoming]))
+            self.assertTrue(np.all(f_in[~incoming] == control_f_in[i][~incoming]))
 
     def test_calc_equilibrium(self):
         """
@@ -121,5 +216,287 @@ class test_Simulation(unittest.TestCase):
         self.assertTrue(np.allclose(control_f_eq, self.test_sim.f_eq))
 
 
+class test_Simulation_step(unittest.TestCase):
+    """
+    Unittestclass for complete simulation steps
+    """
+
+    def setUp(self):
+        """
+        Create a small channel flow
+        """
+        self.nx, self.ny = 60, 40
+        self.test_sim = channel_simulation(self.nx, self.ny)
+        self.test_sim.prepare_simulation()
+
+    def test_bounce_back(self):
+        """
+        Unittest for bounce_back method
+
+        Apply bounce back on every obstacle gridpoint in an easy to understand way
+        and make sure the fluid receives the same values after streaming,
+        although only the links from obstacle to fluid are corrected.
+        """
+
+        self.test_sim.f_in[:] = np.random.uniform(0, 1, (9, self.nx, self.ny))
+        self.test_sim.f_out[:] = np.random.uniform(0, 1, (9, self.nx, self.ny))
+        fluid = ~self.test_sim.obstacle
+
+        # control calculation
+        control_f_out = self.test_sim.f_out.copy()
+        for i, j in enumerate(self.test_sim.e_inverse):
+            control_f_out[i, self.test_sim.obstacle] = self.test_sim.f_in[j, self.test_sim.obstacle]
+
+        # do calculation in dummy Object
+        self.test_sim.bounce_back()
+        self.test_sim.stream_step()
+        streamed_f_in = self.test_sim.f_in.copy()
+        self.test_sim.f_out[:] = control_f_out
+        self.test_sim.stream_step()
+
+        # test
+        self.assertTrue(np.all(streamed_f_in[:, fluid] == self.test_sim.f_in[:, fluid]))
+
+    def test_boundary_plan(self):
+        """
+        Unittest for the compiled corrections at zou-he and outflow borders
+
+        Correct every kind of border in an easy to understand way
+        and make sure the precompiled plan gives the same values.
+        """
+
+        sim = self.test_sim
+        utilities.set_boundary_conditions(sim, {
+            "N": {"type": "zou-he", "v_x": 0.05, "v_y": -0.01},
+            "E": {"type": "zou-he", "v_x": 0.02, "v_y": 0.01},
+            "S": {"type": "outflow"},
+            "W": {"type": "outflow"}
+        })
+        sim.f_in[:] = np.random.uniform(0, 1, (9, self.nx, self.ny))
+        sim.f_eq[:] = np.random.uniform(0, 1, (9, self.nx, self.ny))
+        e = sim.e
+
+        # control calculation
+        f_in = sim.f_in.copy()
+        rho = sim.rho.copy()
+        vel = sim.vel.copy()
+        for border, (v_x, v_y), normal in ((np.s_[:, -1], (0.05, -0.01), (0, 1)),
+                                           (np.s_[-1, :], (0.02, 0.01), (1, 0))):
+            vel[(0,) + border] = v_x
+            vel[(1,) + border] = v_y
+            tangential = [i for i in range(9) if np.dot(e[i], normal) == 0]
+            outgoing = [i for i in range(9) if np.dot(e[i], normal) > 0]
+            u_n = np.dot((v_x, v_y), normal)
+            rho[border] = (f_in[tangential][(slice(None),) + border].sum(axis=0)
+                           + 2 * f_in[outgoing][(slice(None),) + border].sum(axis=0) / (1 - u_n))
+        control_f_in = f_in.copy()
+        for border, normal in ((np.s_[:, -1], (0, 1)), (np.s_[-1, :], (1, 0))):
+            for i in range(9):
+                if np.dot(e[i], normal) < 0:
+                    j = sim.e_inverse[i]
+                    control_f_in[(i,) + border] = (sim.f_eq[(i,) + border]
+                                                   + control_f_in[(j,) + border]
+                                                   - sim.f_eq[(j,) + border])
+        for i in range(9):
+            if e[i, 1] > 0:
+                control_f_in[i, :, 0] = control_f_in[i, :, 1]
+            if e[i, 0] > 0:
+                control_f_in[i, 0, :] = control_f_in[i, 1, :]
+
+        # do calculation in dummy Object
+        sim.correct_macroscopic()
+        sim.correct_distr_func()
+        sim.correct_outflow()
+
+        # test
+        self.assertTrue(np.allclose(sim.rho, rho))
+        self.assertTrue(np.array_equal(sim.vel, vel))
+        self.assertTrue(np.array_equal(sim.f_in, control_f_in))
+
+    def test_collision_operators(self):
+        """
+        Unittest for the trt and mrt collisions
+
+        With the rates of all moments set to 1/tau both are the bgk collision;
+        with their default rates they conserve mass and momentum
+        and stay stable close to tau = 1/2, where bgk does not.
+        """
+
+        tau = 0.8
+        control = channel_simulation(self.nx, self.ny, tau=tau)
+        trt = channel_simulation(self.nx, self.ny, tau=tau, collision="trt")
+        utilities.collision_definition(trt, {"tau": tau, "collision": "trt",
+                                             "magic parameter": (tau - 0.5) ** 2})
+        mrt = channel_simulation(self.nx, self.ny, tau=tau, collision="mrt")
+        utilities.collision_definition(mrt, {"tau": tau, "collision": "mrt", "relaxation rates": {
+            "e": 1 / tau, "epsilon": 1 / tau, "q": 1 / tau
+        }})
+        for sim in (control, trt, mrt):
+            sim.prepare_simulation()
+            for _ in range(20):
+                sim.do_simulation_step()
+        self.assertTrue(np.allclose(trt.f_in, control.f_in, rtol=1e-12, atol=1e-14))
+        self.assertTrue(np.allclose(mrt.f_in, control.f_in, rtol=1e-12, atol=1e-14))
+
+        for collision in ("trt", "mrt"):
+            sim = channel_simulation(self.nx, self.ny, tau=tau, collision=collision)
+            non_equilibrium = np.random.normal(0, 1e-3, 9)
+            # remove mass and momentum, the equilibrium has the same
+            moments = np.array([np.ones(9), sim.e[:, 0], sim.e[:, 1]])
+            non_equilibrium -= np.linalg.lstsq(moments, moments @ non_equilibrium, rcond=None)[0]
+            self.assertTrue(np.allclose(moments @ sim.collision_matrix @ non_equilibrium, 0))
+
+        stable = {}
+        for collision in ("bgk", "mrt"):
+            sim = channel_simulation(self.nx, self.ny, tau=0.5005, collision=collision)
+            sim.obstacle[:] = False
+            utilities.set_boundary_conditions(sim, {
+                "N": {"type": "zou-he", "v_x": 0.1, "v_y": 0},
+                "E": {"type": "bounce_back"},
+                "S": {"type": "bounce_back"},
+                "W": {"type": "bounce_back"}
+            })
+            sim.prepare_simulation()
+            for _ in range(500):
+                sim.do_simulation_step()
+            stable[collision] = bool(np.all(np.abs(sim.vel) < 0.5))
+        self.assertEqual(stable, {"bgk": False, "mrt": True})
+
+    def test_step_allocates_no_lattice(self):
+        """
+        Unittest for the memory behaviour of do_simulation_step
+
+        After warming up, a simulation step must not allocate any array
+        as large as a single lattice plane; all buffers are reused in place.
+        """
+
+        # warm up
+        for _ in range(2):
+            self.test_sim.do_simulation_step()
+
+        # measure steady state
+        tracemalloc.start()
+        for _ in range(5):
+            self.test_sim.do_simulation_step()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # test
+        self.assertLess(peak, self.test_sim.rho.nbytes)
+        self.assertTrue(np.all(np.isfinite(self.test_sim.f_in)))
+
+    def test_single_precision(self):
+        """
+        Unittest for the float32 precision
+
+        All lattice arrays keep single precision during the simulation,
+        no step allocates a lattice plane
+        and the mass stays close to a double precision run.
+        """
+
+        sim = channel_simulation(self.nx, self.ny, precision="float32")
+        sim.prepare_simulation()
+        for _ in range(100):
+            sim.do_simulation_step()
+            self.test_sim.do_simulation_step()
+
+        # memory
+        tracemalloc.start()
+        sim.do_simulation_step()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.test_sim.do_simulation_step()
+
+        # test
+        for name in ("f_in", "f_eq", "f_out", "rho", "vel"):
+            self.assertEqual(getattr(sim, name).dtype, np.float32)
+        self.assertLess(peak, sim.rho.nbytes)
+        mass = utilities.total_mass(sim)
+        control_mass = utilities.total_mass(self.test_sim)
+        self.assertLess(abs(mass - control_mass) / control_mass, 1e-5)
+
+    def test_ensemble(self):
+        """
+        Unittest for an ensemble
+
+        Every member of an ensemble with different tau and inflow velocity
+        evolves exactly like a single simulation with its parameters.
+        """
+
+        taus = [0.8, 1.0, 0.6]
+        velocities = [0.04, 0.02, 0.04]
+        ensemble = channel_simulation(self.nx, self.ny, tau=taus, v_x=velocities, members=3)
+        ensemble.prepare_simulation()
+        for _ in range(20):
+            ensemble.do_simulation_step()
+
+        for member, (tau, v_x) in enumerate(zip(taus, velocities)):
+            sim = channel_simulation(self.nx, self.ny, tau=tau, v_x=v_x)
+            sim.prepare_simulation()
+            for _ in range(20):
+                sim.do_simulation_step()
+            self.assertTrue(np.array_equal(sim.f_in, ensemble.f_in[..., member]))
+            self.assertTrue(np.array_equal(sim.vel, ensemble.vel[..., member]))
+
+
+class test_obstacles(unittest.TestCase):
+    """
+    Unittestclass for the obstacle definition
+    """
+
+    def setUp(self):
+        """
+        Create a mockup Simulation and random obstacles
+        """
+        self.sim = Simulation()
+        self.sim.shape = (120, 80)
+        self.sim.args = argparse.Namespace(show_obstacle=False)
+        rng = np.random.default_rng(1)
+        self.x = rng.uniform(-10, 130, 50)
+        self.y = rng.uniform(-10, 90, 50)
+        self.radius = rng.uniform(0, 15, 50)
+
+    def test_cylinders(self):
+        """
+        Unittest for cylinder_function
+
+        Cylinders rasterized in their bounding boxes are the same as on the whole grid,
+        also when they are given as arrays or reach over the border.
+        """
+
+        x, y = np.indices(self.sim.shape)
+        control = np.full(self.sim.shape, False)
+        for center_x, center_y, radius in zip(self.x, self.y, self.radius):
+            control |= (center_x - x) ** 2 + (center_y - y) ** 2 < radius ** 2
+            cylinder = utilities.cylinder_function(self.sim, {
+                "x-position": center_x, "y-position": center_y, "radius": radius
+            })
+            self.assertTrue(np.array_equal(
+                cylinder, (center_x - x) ** 2 + (center_y - y) ** 2 < radius ** 2
+            ))
+
+        utilities.obstacles_definition(self.sim, [{
+            "type": "cylindrical obstacle",
+            "x-position": list(self.x), "y-position": list(self.y), "radius": list(self.radius)
+        }])
+        self.assertTrue(np.array_equal(self.sim.obstacle, control))
+
+    def test_rectangles(self):
+        """
+        Unittest for recktangle_function
+
+        Corners are included, rectangles can be given as lists of corners and are clipped.
+        """
+
+        control = np.full(self.sim.shape, False)
+        control[10:21, 5:8] = True
+        control[100:, 70:] = True
+        utilities.obstacles_definition(self.sim, [{
+            "type": "recktangle obstacle",
+            "bottom_left": [[10, 5], [100, 70]], "top_right": [[20, 7], [150, 100]]
+        }])
+        self.assertTrue(np.array_equal(self.sim.obstacle, control))
+
+
 if __name__ == '__main__':
     unittest.main()
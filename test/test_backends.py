@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the compute backends
+"""
+import unittest
+import numpy as np
+from src.d2q9_simulation import Simulation
+from src import backends
+from src import utilities
+from test.test_Simulation import channel_simulation
+
+
+class test_backends(unittest.TestCase):
+    """
+    Unittestclass for the backend registry and the equivalence of all backends
+    """
+
+    def test_get_backend(self):
+        """
+        Unittest for get_backend
+
+        Every registered backend can be created by name;
+        unavailable backends fall back to the NumPy reference.
+        """
+
+        for name, backend_class in backends.BACKENDS.items():
+            backend = backends.get_backend(name)
+            if backend_class.available():
+                self.assertIsInstance(backend, backend_class)
+            else:
+                self.assertIsInstance(backend, backends.NumpyBackend)
+
+    def test_default_step(self):
+        """
+        Unittest for Backend.step
+
+        A backend without its own kernels performs the NumPy steps of the Simulation.
+        """
+
+        control = channel_simulation(40, 20)
+        control.prepare_simulation()
+        sim = channel_simulation(40, 20)
+        sim.prepare_simulation()
+        backend = backends.Backend()
+        backend.prepare(sim)
+        for _ in range(5):
+            control.do_simulation_step()
+            backend.step(sim)
+        backend.finish(sim)
+        self.assertTrue(np.array_equal(sim.f_in, control.f_in))
+
+    def assert_equivalent(self, make_simulation, steps):
+        """
+        Perform steps with every available backend and compare with the NumPy backend.
+
+        :param make_simulation: function returning a prepared Simulation
+        :param steps: number of iteration steps
+        """
+
+        results = {}
+        for name, backend_class in backends.BACKENDS.items():
+            if not backend_class.available():
+                continue
+            sim = make_simulation()
+            if sim.collision_matrix is not None and not backend_class.matrix_collision:
+                continue
+            backend = backend_class()
+            backend.prepare(sim)
+            for _ in range(steps):
+                backend.step(sim)
+            backend.finish(sim)
+            fluid = ~sim.obstacle
+            results[name] = (sim.f_in[:, fluid], sim.rho[fluid], sim.vel[:, fluid])
+
+        reference = results.pop("numpy")
+        for name, result in results.items():
+            for control, value in zip(reference, result):
+                self.assertTrue(np.allclose(control, value, rtol=1e-12, atol=1e-14), name)
+
+    def assert_identical_with_threads(self, make_simulation, steps):
+        """
+        Perform steps with several threads and make sure the result is bit-identical to serial.
+
+        :param make_simulation: function returning a prepared Simulation
+        :param steps: number of iteration steps
+        """
+
+        control = make_simulation()
+        for _ in range(steps):
+            control.do_simulation_step()
+
+        for threads in (2, 3):
+            sim = make_simulation()
+            backend = backends.get_backend("numpy", threads)
+            self.assertIsInstance(backend, backends.ThreadedBackend)
+            backend.prepare(sim)
+            for _ in range(steps):
+                backend.step(sim)
+            backend.finish(sim)
+
+            self.assertTrue(np.array_equal(control.f_in, sim.f_in))
+            self.assertTrue(np.array_equal(control.rho, sim.rho))
+            self.assertTrue(np.array_equal(control.vel, sim.vel))
+
+    def test_periodic_equivalence(self):
+        """
+        Backends agree on the random, periodic testdata of the Simulation unittests
+        """
+
+        nx, ny = 500, 500
+        f_in = -np.random.uniform(1, 0, (9, nx, ny))
+
+        def make_simulation():
+            sim = Simulation()
+            sim.shape = (nx, ny)
+            sim.tau = 0.8
+            utilities.allocate_lattice(sim)
+            sim.obstacle = np.full(shape=sim.shape, fill_value=False)
+            sim.boundarys = {"N": "periodic", "E": "periodic", "S": "periodic", "W": "periodic"}
+            utilities.compile_stream_plan(sim)
+            utilities.compile_bounce_back_links(sim)
+            utilities.compile_boundary_plan(sim)
+            sim.f_in[:] = f_in
+            return sim
+
+        self.assert_equivalent(make_simulation, 1)
+        self.assert_identical_with_threads(make_simulation, 1)
+
+    def test_channel_equivalence(self):
+        """
+        Backends agree on a channel with obstacle, bounce back, outflow and zou-he borders
+        """
+
+        def make_simulation():
+            sim = channel_simulation(60, 40)
+            sim.prepare_simulation()
+            return sim
+
+        self.assert_equivalent(make_simulation, 50)
+        self.assert_identical_with_threads(make_simulation, 50)
+
+    def test_mrt_equivalence(self):
+        """
+        Backends with the mrt collision agree with the NumPy backend, also with threads
+        """
+
+        def make_simulation():
+            sim = channel_simulation(60, 40, collision="mrt")
+            sim.prepare_simulation()
+            return sim
+
+        self.assert_equivalent(make_simulation, 50)
+        self.assert_identical_with_threads(make_simulation, 50)
+
+    def test_porous_equivalence(self):
+        """
+        Backends agree on a mostly solid geometry; the sparse backend only stores a part of it
+        """
+
+        x, y = np.indices((60, 40))
+        obstacle = (x % 12 > 2) & (y % 10 > 2)
+
+        def make_simulation():
+            sim = channel_simulation(60, 40)
+            sim.obstacle |= obstacle
+            utilities.compile_stream_plan(sim)
+            utilities.compile_bounce_back_links(sim)
+            sim.prepare_simulation()
+            return sim
+
+        self.assert_equivalent(make_simulation, 20)
+
+        sim = make_simulation()
+        backend = backends.get_backend("sparse")
+        backend.prepare(sim)
+        self.assertLess(backend.packed.f_in.size, 0.8 * sim.f_in.size)
+
+    @unittest.skipUnless(backends.AABackend.available(), "numba is not installed")
+    def test_aa_synchronize(self):
+        """
+        The AA pattern keeps a single distribution function
+        and restores the canonical layout after an odd number of steps
+        """
+
+        control = channel_simulation(60, 40)
+        control.prepare_simulation()
+        for _ in range(7):
+            control.do_simulation_step()
+
+        sim = channel_simulation(60, 40)
+        sim.prepare_simulation()
+        backend = backends.get_backend("aa")
+        backend.prepare(sim)
+        self.assertIsNone(sim.f_eq)
+        self.assertIsNone(sim.f_out)
+        for step in range(1, 8):
+            backend.step(sim)
+            if step == 3:
+                backend.synchronize(sim)
+        backend.finish(sim)
+
+        fluid = ~sim.obstacle
+        self.assertTrue(np.allclose(control.f_in[:, fluid], sim.f_in[:, fluid], rtol=1e-12))
+
+
+if __name__ == '__main__':
+    unittest.main()
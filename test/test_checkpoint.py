@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for checkpoints and graceful stops
+"""
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+from unittest import mock
+import h5py
+import numpy as np
+from src import backends, checkpoint, utilities, writer
+from test.test_Simulation import channel_simulation
+
+
+class test_checkpoint(unittest.TestCase):
+    """
+    Unittestclass for the checkpoint module
+    """
+
+    def setUp(self):
+        """
+        Create a temporary output directory
+        """
+        self.output = tempfile.mkdtemp() + os.sep
+
+    def tearDown(self):
+        """
+        Remove the temporary output directory
+        """
+        shutil.rmtree(self.output)
+
+    def channel(self, name, resume=False, stop_at=None, checkpoints=True):
+        """
+        Create a channel flow of 10 steps with raw output at every step
+        and checkpoints at every 4th step.
+
+        :param name: name of the output directory
+        :param resume: whether to resume from the newest checkpoint
+        :param stop_at: number of steps after which the process sends SIGTERM to itself
+        :param checkpoints: whether the output has checkpoints
+        :return: Simulation instance, ready to run
+        """
+
+        sim = channel_simulation(60, 40)
+        sim.args.output = self.output + name + os.sep
+        sim.args.resume = resume
+        sim.args.processes = 1
+        sim.args.output_queue = 0
+        sim.args.no_progessbar = True
+        sim.args.performance_feedback = False
+        output_parameters = {
+            "raw data output configuration": {
+                "file name": "raw", "output frequency": 1, "layout": "chunked"
+            },
+            "checkpoint": {"output frequency": 4, "keep": 2}
+        }
+        if not checkpoints:
+            del output_parameters["checkpoint"]
+        utilities.initialize_output(sim, output_parameters)
+        sim.backend = backends.get_backend("numpy")
+
+        if stop_at is not None:
+            steps = []
+
+            def step(sim):
+                backends.NumpyBackend.step(sim.backend, sim)
+                steps.append(None)
+                if len(steps) == stop_at:
+                    os.kill(os.getpid(), signal.SIGTERM)
+            sim.backend.step = step
+        return sim
+
+    def test_rotation(self):
+        """
+        Only the newest checkpoints are kept and no temporary files are left
+        """
+
+        sim = self.channel("run")
+        sim.timesteps = 17
+        sim.run_simulation()
+        directory = checkpoint.checkpoint_directory(sim)
+        self.assertEqual(sorted(os.listdir(directory)), [
+            "checkpoint_00012.json", "checkpoint_00012.npy",
+            "checkpoint_00016.json", "checkpoint_00016.npy"
+        ])
+        self.assertEqual(checkpoint.latest_checkpoint(directory),
+                         directory + "checkpoint_00016.npy")
+
+    def test_stop_and_resume(self):
+        """
+        SIGTERM stops after the current step with a final checkpoint;
+        resuming from an older checkpoint rewrites the raw output after it
+        and ends with the same state as an uninterrupted simulation
+        """
+
+        control = self.channel("control")
+        control.run_simulation()
+
+        sim = self.channel("run", stop_at=7)
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        sim.run_simulation()
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous_handler)
+        directory = checkpoint.checkpoint_directory(sim)
+        self.assertEqual(checkpoint.list_checkpoints(directory), [
+            (4, directory + "checkpoint_00004.npy"), (7, directory + "checkpoint_00007.npy")
+        ])
+
+        # the final checkpoint got lost: continue from step 4
+        os.remove(directory + "checkpoint_00007.json")
+        sim = self.channel("run", resume=True)
+        sim.run_simulation()
+        self.assertEqual(sim.step_offset, 4)
+        self.assertEqual(sim.timesteps, 6)
+        self.assertTrue(np.array_equal(sim.f_in, control.f_in))
+
+        with h5py.File(self.output + "control/raw.hdf5", "r") as control_file, \
+                h5py.File(self.output + "run/raw.hdf5", "r") as resumed_file:
+            group = "raw data output configuration"
+            steps, frames = utilities.raw_output_frames(resumed_file[group], "velocity")
+            control_steps, control_frames = utilities.raw_output_frames(
+                control_file[group], "velocity"
+            )
+            self.assertEqual(steps, list(range(1, 11)))
+            self.assertEqual(steps, control_steps)
+            self.assertTrue(np.array_equal(frames[()], control_frames[()]))
+
+    def test_stop_without_checkpoints(self):
+        """
+        A stopped simulation without checkpoint output writes one final checkpoint
+        and can be resumed from it
+        """
+
+        control = self.channel("control", checkpoints=False)
+        control.run_simulation()
+
+        sim = self.channel("run", stop_at=7, checkpoints=False)
+        sim.run_simulation()
+        directory = checkpoint.checkpoint_directory(sim)
+        self.assertEqual(checkpoint.list_checkpoints(directory),
+                         [(7, directory + "checkpoint_00007.npy")])
+
+        sim = self.channel("run", resume=True, checkpoints=False)
+        sim.run_simulation()
+        self.assertEqual(sim.step_offset, 7)
+        self.assertEqual(sim.timesteps, 3)
+        self.assertTrue(np.array_equal(sim.f_in, control.f_in))
+        self.assertFalse(os.path.exists(checkpoint.checkpoint_directory(control)))
+
+    def test_stop_parallel(self):
+        """
+        SIGTERM stops a simulation with several processes at the next synchronized step
+        with a complete final checkpoint and flushed raw output
+        """
+
+        control = self.channel("control")
+        control.timesteps = 7
+        control.run_simulation()
+
+        sim = self.channel("run")
+        sim.args.processes = 2
+        submit = writer.OutputWriter.submit
+
+        def submit_and_stop(output_writer, step, final=False):
+            submit(output_writer, step, final)
+            if step == 7:
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        with mock.patch.object(writer.OutputWriter, "submit", submit_and_stop):
+            sim.run_simulation()
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous_handler)
+        self.assertEqual(sim.timesteps, 7)
+
+        directory = checkpoint.checkpoint_directory(sim)
+        self.assertEqual(checkpoint.latest_checkpoint(directory),
+                         directory + "checkpoint_00007.npy")
+        self.assertTrue(np.allclose(np.load(directory + "checkpoint_00007.npy"), control.f_in,
+                                    rtol=1e-12, atol=1e-14))
+        with h5py.File(self.output + "run/raw.hdf5", "r") as h5_file:
+            steps, _ = utilities.raw_output_frames(
+                h5_file["raw data output configuration"], "velocity"
+            )
+            self.assertEqual(steps, list(range(1, 8)))
+
+    def test_invalid_checkpoint(self):
+        """
+        A truncated checkpoint is skipped when resuming
+        """
+
+        sim = self.channel("run")
+        sim.run_simulation()
+        directory = checkpoint.checkpoint_directory(sim)
+        with open(directory + "checkpoint_00008.npy", "r+b") as checkpoint_file:
+            checkpoint_file.truncate(1000)
+        self.assertEqual(checkpoint.latest_checkpoint(directory),
+                         directory + "checkpoint_00004.npy")
+
+
+if __name__ == '__main__':
+    unittest.main()
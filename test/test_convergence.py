@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the steady-state convergence detection
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from src import backends, convergence, parallel, utilities
+from test.test_Simulation import channel_simulation
+
+
+def cavity_simulation(output, threshold=1e-5, frequency=50):
+    """
+    Create a lid-driven cavity, which gets steady, with raw output and snapshots.
+
+    :param output: path of the output directory
+    :param threshold: convergence threshold
+    :param frequency: number of steps between two convergence checks
+    :return: Simulation instance, ready to run
+    """
+
+    sim = channel_simulation(30, 30)
+    sim.obstacle[:] = False
+    utilities.set_boundary_conditions(sim, {
+        "N": {"type": "zou-he", "v_x": 0.05, "v_y": 0},
+        "E": {"type": "bounce_back"},
+        "S": {"type": "bounce_back"},
+        "W": {"type": "bounce_back"}
+    })
+    utilities.convergence_definition(sim, {
+        "convergence": {"threshold": threshold, "check frequency": frequency}
+    })
+    sim.timesteps = 20000
+    sim.args.output = output
+    sim.args.processes = 1
+    sim.args.output_queue = 2
+    sim.args.no_progessbar = True
+    sim.args.performance_feedback = False
+    utilities.initialize_output(sim, {
+        "raw data output configuration": {
+            "file name": "raw", "output frequency": 1000, "layout": "chunked"
+        },
+        "snapshot": {"output frequency": 1000}
+    })
+    sim.backend = backends.get_backend("numpy")
+    return sim
+
+
+class test_convergence(unittest.TestCase):
+    """
+    Unittestclass for the convergence module
+    """
+
+    def setUp(self):
+        """
+        Create a temporary output directory
+        """
+        self.output = tempfile.mkdtemp() + os.sep
+
+    def tearDown(self):
+        """
+        Remove the temporary output directory
+        """
+        shutil.rmtree(self.output)
+
+    def test_residual(self):
+        """
+        Unittest for ConvergenceMonitor.check
+
+        The first check only stores the velocity, a relative change of 1e-3
+        gives a residual of 1e-3 and an unchanged velocity converges.
+        Steps without a check are skipped.
+        """
+
+        sim = channel_simulation(20, 10)
+        utilities.convergence_definition(sim, {"convergence": {"threshold": 1e-6}})
+        sim.vel[:] = np.random.uniform(-0.1, 0.1, sim.vel.shape)
+        monitor = convergence.ConvergenceMonitor(sim)
+
+        self.assertFalse(monitor.check(100))
+        self.assertEqual(monitor.residuals, [])
+        sim.vel *= 1.001
+        self.assertFalse(monitor.check(150))
+        self.assertFalse(monitor.check(200))
+        self.assertAlmostEqual(float(monitor.residuals[0]), 1e-3 / 1.001)
+        self.assertTrue(monitor.check(300))
+        self.assertEqual(monitor.steps, [200, 300])
+        self.assertEqual(monitor.converged_step, 300)
+
+    def test_ensemble(self):
+        """
+        Unittest for the residual of an ensemble
+
+        Every member gets its own residual, the ensemble converges when all members have.
+        """
+
+        sim = channel_simulation(20, 10, tau=[0.6, 0.8], members=2)
+        utilities.convergence_definition(sim, {"convergence": {"threshold": 1e-6}})
+        sim.vel[:] = np.random.uniform(-0.1, 0.1, sim.vel.shape)
+        monitor = convergence.ConvergenceMonitor(sim)
+        monitor.check(100)
+        sim.vel[..., 1] *= 1.001
+        self.assertFalse(monitor.check(200))
+        self.assertEqual(monitor.residuals[0].shape, (2,))
+        self.assertEqual(monitor.residuals[0][0], 0)
+        self.assertTrue(monitor.check(300))
+
+    def test_early_termination(self):
+        """
+        Unittest for a converging simulation
+
+        The simulation stops at the first check below the threshold,
+        writes raw output and a snapshot of this step and the history of the residuals.
+        """
+
+        sim = cavity_simulation(self.output)
+        sim.run_simulation()
+
+        self.assertLess(sim.timesteps, 20000)
+        self.assertEqual(sim.timesteps % 50, 0)
+        self.assertTrue(os.path.exists(self.output + "snapshots" + os.sep
+                                       + "snap_%05i.npy" % sim.timesteps))
+        with h5py.File(self.output + "raw.hdf5", "r") as h5_file:
+            group = h5_file["raw data output configuration"]
+            self.assertEqual(group["steps"][-1], sim.timesteps)
+            history = h5_file["convergence"]
+            self.assertEqual(history.attrs["converged step"], sim.timesteps)
+            self.assertEqual(list(history["steps"]), list(range(100, sim.timesteps + 1, 50)))
+            self.assertLess(history["residual"][-1], 1e-5)
+            self.assertTrue(np.all(history["residual"][:-1] >= 1e-5))
+
+    def test_parallel(self):
+        """
+        Unittest for a converging simulation with several processes
+
+        The workers stop at the same step and in the same state as a single process.
+        """
+
+        control = cavity_simulation(self.output + "serial" + os.sep, threshold=1e-3)
+        control.run_simulation()
+        sim = cavity_simulation(self.output + "parallel" + os.sep, threshold=1e-3)
+        sim.prepare_simulation()
+        parallel.run_parallel(sim, 2, monitor=convergence.ConvergenceMonitor(sim))
+        utilities.close_output(sim)
+
+        self.assertEqual(sim.timesteps, control.timesteps)
+        self.assertTrue(np.allclose(sim.f_in, control.f_in, rtol=1e-12, atol=1e-14))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for hdf5_to_mpeg
+"""
+import contextlib
+import io
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+import h5py
+import numpy as np
+from src import hdf5_to_mpeg
+
+#: stored steps, in lexical order 10 < 100 < 20
+STEPS = [10, 20, 30, 100, 150]
+
+
+def write_raw_output(path, layout, steps=STEPS, shape=(6, 4)):
+    """
+    Write a raw data output file, every frame is filled with its step.
+
+    :param path: path of the hdf5 file
+    :param layout: "datasets" or "chunked"
+    :param steps: stored simulation steps
+    :param shape: lattice points x and y
+    """
+
+    with h5py.File(path, "w") as h5_file:
+        group = h5_file.create_group("raw data output configuration")
+        if layout == "chunked":
+            group.create_dataset("steps", data=np.array(steps, dtype=np.int64))
+            group.create_dataset("density", data=np.array(
+                [np.full(shape, step, dtype=np.float64) for step in steps]
+            ).reshape((len(steps),) + shape))
+            group.create_dataset("velocity", data=np.array(
+                [np.full((2,) + shape, step, dtype=np.float64) for step in steps]
+            ).reshape((len(steps), 2) + shape))
+            return
+        density = group.create_group("density")
+        velocity = group.create_group("velocity")
+        for step in steps:
+            density.create_dataset("%i" % step, data=np.full(shape, step, dtype=np.float64))
+            velocity.create_dataset("%i" % step, data=np.full((2,) + shape, step, dtype=np.float64))
+
+
+def run_main(*arguments):
+    """
+    Run hdf5_to_mpeg with commandline arguments.
+
+    :param arguments: commandline arguments
+    :return: exit code of SystemExit, *None* without, and the printed output
+    """
+
+    output = io.StringIO()
+    code = None
+    with mock.patch.object(sys, "argv", ["hdf5_to_mpeg"] + list(arguments)), \
+            contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            hdf5_to_mpeg.main()
+        except SystemExit as exit_request:
+            code = exit_request.code
+    return code, output.getvalue()
+
+
+def fake_ffmpeg(directory, script):
+    """
+    Write an executable *ffmpeg* python script into a directory.
+
+    :param directory: directory to put in front of PATH
+    :param script: python code of the script, the arguments of ffmpeg are in sys.argv
+    """
+
+    path = os.path.join(directory, "ffmpeg")
+    with open(path, "w") as script_file:
+        script_file.write("#!%s\nimport sys\n%s\n" % (sys.executable, script))
+    os.chmod(path, 0o755)
+
+
+def render_step(step, shape=(6, 4)):
+    """
+    Render a frame filled with its step, later steps are rendered faster.
+
+    :param step: simulation step of the frame
+    :param shape: lattice points x and y
+    :return: raw RGB bytes of the frame
+    """
+
+    time.sleep(0.001 * (10 - step % 10))
+    return np.full(shape + (3,), step, dtype=np.uint8).tobytes()
+
+
+class test_hdf5_to_mpeg(unittest.TestCase):
+    """
+    Unittestclass for the frame selection of hdf5_to_mpeg
+    """
+
+    def setUp(self):
+        """
+        Create raw data output files of both layouts in a temporary directory
+        """
+        self.directory = tempfile.mkdtemp() + os.sep
+        self.paths = {}
+        for layout in ("datasets", "chunked"):
+            self.paths[layout] = self.directory + layout + ".hdf5"
+            write_raw_output(self.paths[layout], layout)
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        """
+        Close the input of read_frame and remove the temporary directory
+        """
+        os.chdir(self.cwd)
+        if "file" in hdf5_to_mpeg.source:
+            hdf5_to_mpeg.source["file"].close()
+            hdf5_to_mpeg.source.clear()
+        shutil.rmtree(self.directory)
+
+    def test_select_steps(self):
+        """
+        Unittest for select_steps
+
+        Start is inclusive, stop exclusive, the stride counts stored frames
+        and the steps are in numeric order in both layouts.
+        """
+
+        for path in self.paths.values():
+            with h5py.File(path, "r") as h5_file:
+                group = h5_file["raw data output configuration"]
+                for field in ("density", "velocity"):
+                    self.assertEqual(hdf5_to_mpeg.select_steps(group, field), STEPS)
+                    self.assertEqual(hdf5_to_mpeg.select_steps(group, field, 20, 150),
+                                     [20, 30, 100])
+                    self.assertEqual(hdf5_to_mpeg.select_steps(group, field, 15, 101),
+                                     [20, 30, 100])
+                    self.assertEqual(hdf5_to_mpeg.select_steps(group, field, stride=2),
+                                     [10, 30, 150])
+                    self.assertEqual(hdf5_to_mpeg.select_steps(group, field, 20, stride=3),
+                                     [20, 150])
+                    self.assertEqual(hdf5_to_mpeg.select_steps(group, field, 200), [])
+
+    def test_read_frame(self):
+        """
+        Unittest for open_input and read_frame
+
+        Both layouts give the same frames.
+        """
+
+        frames = {}
+        for layout, path in self.paths.items():
+            hdf5_to_mpeg.open_input(path)
+            frames[layout] = [(hdf5_to_mpeg.read_frame("density", step),
+                               hdf5_to_mpeg.read_frame("velocity", step)) for step in STEPS]
+            hdf5_to_mpeg.source["file"].close()
+
+        for step, datasets, chunked in zip(STEPS, frames["datasets"], frames["chunked"]):
+            self.assertEqual(datasets[0].shape, (6, 4))
+            self.assertEqual(datasets[1].shape, (2, 6, 4))
+            self.assertTrue(np.all(datasets[0] == step))
+            self.assertTrue(np.array_equal(datasets[0], chunked[0]))
+            self.assertTrue(np.array_equal(datasets[1], chunked[1]))
+
+    def test_empty_selection(self):
+        """
+        Unittest for the error of an empty selection
+
+        A selection without frames and a file without stored frames are reported.
+        """
+
+        for path in self.paths.values():
+            code, output = run_main("-i", path, "--start", "200")
+            self.assertIsNone(code)
+            self.assertIn("ERROR: no frames were selected.", output)
+
+        for layout in ("datasets", "chunked"):
+            path = self.directory + "empty_" + layout + ".hdf5"
+            write_raw_output(path, layout, steps=[])
+            code, output = run_main("-i", path, "--pipe")
+            self.assertIn("ERROR: no frames were selected.", output)
+
+    def test_stride(self):
+        """
+        Unittest for the validation of --stride
+
+        Strides below 1 are rejected.
+        """
+
+        for stride in ("0", "-1"):
+            code, output = run_main("-i", self.paths["datasets"], "--stride", stride)
+            self.assertEqual(code, 2)
+            self.assertIn("is not a positive number", output)
+
+
+class test_encode_video(unittest.TestCase):
+    """
+    Unittestclass for piping frames to ffmpeg
+    """
+
+    def setUp(self):
+        """
+        Put a fake ffmpeg in front of PATH and start a thread pool
+        """
+        self.directory = tempfile.mkdtemp() + os.sep
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = self.directory + os.pathsep + self.path
+        self.pool = ThreadPool(4)
+
+    def tearDown(self):
+        """
+        Restore PATH and remove the temporary directory
+        """
+        self.pool.terminate()
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.directory)
+
+    def test_frame_order(self):
+        """
+        Unittest for encode_video
+
+        ffmpeg gets every frame as raw RGB of the lattice size in the order of the steps,
+        also if frames finish out of order, with one frame ahead and with more ahead than frames.
+        """
+
+        # stores stdin in the video file, the last argument
+        fake_ffmpeg(self.directory, "open(sys.argv[-1], 'wb').write(sys.stdin.buffer.read())")
+        steps = list(range(20))
+        expected = b"".join(render_step(step) for step in steps)
+        for ahead in (1, 3, len(steps) + 5):
+            filename = self.directory + "clip_%i.mp4" % ahead
+            hdf5_to_mpeg.encode_video(self.pool, render_step, steps, (6, 4), filename, ahead)
+            with open(filename, "rb") as video:
+                written = video.read()
+            self.assertEqual(len(written), len(steps) * 6 * 4 * 3)
+            self.assertEqual(written, expected)
+
+    def test_broken_pipe(self):
+        """
+        Unittest for an ffmpeg that stops early
+
+        The error is reported instead of raised.
+        """
+
+        fake_ffmpeg(self.directory, "sys.exit(1)")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            hdf5_to_mpeg.encode_video(self.pool, lambda step: bytes(2**18), range(8),
+                                      (256, 341), self.directory + "clip.mp4", 2)
+        self.assertIn("ERROR: ffmpeg stopped before", output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
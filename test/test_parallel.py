@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the parallel simulation with several processes
+"""
+import unittest
+import numpy as np
+from src import parallel
+from src import utilities
+from test.test_Simulation import channel_simulation
+
+
+class test_parallel(unittest.TestCase):
+    """
+    Unittestclass for run_parallel
+    """
+
+    def simulation(self, boundary_conditions=None, members=None):
+        """
+        Create a channel flow without output
+
+        :param boundary_conditions: optionally replace the boundary conditions
+        :param members: number of ensemble members with different tau, *None* for a single run
+        :return: prepared Simulation instance
+        """
+
+        if members is None:
+            sim = channel_simulation(60, 40)
+        else:
+            sim = channel_simulation(
+                60, 40, tau=list(np.linspace(0.6, 1, members)), members=members
+            )
+        if boundary_conditions is not None:
+            sim.boundarys = boundary_conditions
+            sim.obstacle[:] = False
+            sim.obstacle[20:25, 10:30] = True
+            utilities.compile_stream_plan(sim)
+            utilities.compile_bounce_back_links(sim)
+            utilities.compile_boundary_plan(sim)
+        sim.args.no_progessbar = True
+        sim.timesteps = 30
+        sim.snapshot = sim.raw_output = sim.picture_output = sim.checkpoint = False
+        sim.prepare_simulation()
+        return sim
+
+    def assert_same_as_serial(self, processes, boundary_conditions=None, members=None):
+        """
+        Run serial and parallel and compare the final state.
+
+        :param processes: number of worker processes
+        :param boundary_conditions: optionally replace the boundary conditions
+        :param members: number of ensemble members, *None* for a single run
+        """
+
+        control = self.simulation(boundary_conditions, members)
+        for _ in range(control.timesteps):
+            control.do_simulation_step()
+
+        sim = self.simulation(boundary_conditions, members)
+        parallel.run_parallel(sim, processes)
+
+        fluid = ~control.obstacle
+        self.assertTrue(np.allclose(control.f_in[:, fluid], sim.f_in[:, fluid]))
+        self.assertTrue(np.allclose(control.rho[fluid], sim.rho[fluid]))
+        self.assertTrue(np.allclose(control.vel[:, fluid], sim.vel[:, fluid]))
+
+    def test_decompose(self):
+        """
+        Unittest for decompose: slabs cover the x axis without gaps
+        """
+
+        slabs = parallel.decompose(61, 4, periodic_x=False)
+        self.assertEqual(slabs[0][0], 0)
+        self.assertEqual(slabs[-1][1], 61)
+        for (_, x_stop, _, _), (x_start, _, _, _) in zip(slabs[:-1], slabs[1:]):
+            self.assertEqual(x_stop, x_start)
+        self.assertEqual(slabs[0][2], 0)
+        self.assertEqual(slabs[-1][3], 0)
+
+    def test_channel(self):
+        """
+        Parallel run with zou-he inflow, outflow and bounce back matches the serial run
+        """
+
+        self.assert_same_as_serial(3)
+
+    def test_periodic(self):
+        """
+        Parallel run with periodic borders matches the serial run
+        """
+
+        periodic = {"N": "periodic", "E": "periodic", "S": "periodic", "W": "periodic"}
+        self.assert_same_as_serial(2, periodic)
+        self.assert_same_as_serial(1, periodic)
+
+    def test_ensemble(self):
+        """
+        Parallel run of an ensemble matches the serial run
+        """
+
+        self.assert_same_as_serial(2, members=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
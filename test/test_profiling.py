@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the profiling of the simulation loop
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from src import backends, profiling, utilities
+from test.test_Simulation import channel_simulation
+
+
+class test_profiling(unittest.TestCase):
+    """
+    Unittestclass for the profiling module
+    """
+
+    def setUp(self):
+        """
+        Create a temporary output directory
+        """
+        self.output = tempfile.mkdtemp() + os.sep
+
+    def tearDown(self):
+        """
+        Remove the temporary output directory
+        """
+        shutil.rmtree(self.output)
+
+    def channel(self, profile):
+        """
+        Create a channel flow of 10 steps with raw output at every 5th step.
+
+        :param profile: whether to profile the simulation loop with memory peaks
+        :return: Simulation instance, ready to run
+        """
+
+        sim = channel_simulation(60, 40)
+        sim.args.output = self.output
+        sim.args.processes = 1
+        sim.args.output_queue = 0
+        sim.args.no_progessbar = True
+        sim.args.performance_feedback = False
+        sim.args.profile = profile
+        sim.args.profile_memory = profile
+        utilities.initialize_output(sim, {
+            "raw data output configuration": {"file name": "raw", "output frequency": 5}
+        })
+        sim.backend = backends.get_backend("numpy")
+        return sim
+
+    def test_profile(self):
+        """
+        Every phase is counted once per step, hooks are called
+        and the original methods are restored
+        """
+
+        calls = []
+        hook = profiling.register_hook(lambda name, seconds, peak: calls.append(name))
+        try:
+            sim = self.channel(True)
+            sim.run_simulation()
+        finally:
+            profiling.unregister_hook(hook)
+
+        self.assertEqual(calls.count("step"), 10)
+        self.assertEqual(calls.count("store_output"), 10)
+        self.assertEqual(calls.count("synchronize"), 2)
+        self.assertFalse(set(profiling.PHASES + ["step", "synchronize"])
+                         & (set(vars(sim)) | set(vars(sim.backend))))
+
+        with open(self.output + "profile.json") as profile_file:
+            rows = {row["name"]: row for row in json.load(profile_file)["phases"]}
+        self.assertEqual(set(rows), set(profiling.PHASES + ["step", "synchronize", "store_output"]))
+        for phase in profiling.PHASES:
+            self.assertEqual(rows[phase]["calls"], 10)
+            self.assertEqual(rows[phase]["depth"], 1)
+            self.assertGreaterEqual(rows["step"]["total [s]"], rows[phase]["total [s]"])
+            self.assertGreaterEqual(rows["step"]["peak [bytes]"], rows[phase]["peak [bytes]"])
+        self.assertEqual(rows["step"]["depth"], 0)
+        # the collision allocates no temporary lattice arrays
+        self.assertLess(rows["collision_step"]["peak [bytes]"], sim.f_in.nbytes)
+
+        with open(self.output + "profile.csv", newline="") as profile_file:
+            self.assertEqual([row["name"] for row in csv.DictReader(profile_file)], list(rows))
+
+    def test_disabled(self):
+        """
+        Without profiling no methods are replaced and nothing is written
+        """
+
+        sim = self.channel(False)
+        sim.run_simulation()
+        self.assertNotIn("profile.json", os.listdir(self.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
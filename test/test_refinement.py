@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the local grid refinement
+"""
+import unittest
+import numpy as np
+from src import backends
+from src import refinement
+from src import utilities
+from test.test_Simulation import channel_simulation
+
+#: obstacle of channel_simulation(60, 30)
+CYLINDER = [{"type": "cylindrical obstacle", "x-position": 20, "y-position": 15, "radius": 4}]
+
+
+def refined_simulation(sim, refinement_parameters, obstacle_parameters):
+    """
+    Add refinement blocks to a Simulation and prepare the refined backend.
+
+    :param sim: Simulation instance
+    :param refinement_parameters: list of blocks like in an inputfile
+    :param obstacle_parameters: obstacle parameters like in an inputfile
+    :return: prepared backend
+    """
+
+    refinement.refinement_definition(sim, refinement_parameters, obstacle_parameters)
+    backend = refinement.RefinedBackend(backends.NumpyBackend())
+    backend.prepare(sim)
+    return backend
+
+
+class test_refinement(unittest.TestCase):
+    """
+    Unittestclass for refinement blocks
+    """
+
+    def test_block_lattice(self):
+        """
+        Unittest for the lattice of a block
+
+        Every gridpoint of the parent in the block is a gridpoint of the block,
+        the relaxation parameter keeps the viscosity and nested blocks halve the spacing again.
+        """
+
+        sim = channel_simulation(60, 30)
+        refinement.refinement_definition(sim, [{
+            "x-range": [10, 30], "y-range": [5, 25],
+            "refinement": [{"x-range": [10, 30], "y-range": [10, 30]}]
+        }], CYLINDER)
+        block = sim.refinement_blocks[0]
+        child = block.children[0]
+
+        self.assertEqual(block.sim.shape, (41, 41))
+        self.assertEqual(block.sim.tau, 2 * sim.tau - 0.5)
+        self.assertEqual(child.sim.tau, 2 * block.sim.tau - 0.5)
+        self.assertEqual(child.sim.scale, 4)
+        self.assertEqual(child.sim.position, (15, 10))
+        # the obstacle of the block agrees with the simulation on the common gridpoints
+        self.assertTrue(np.array_equal(block.sim.obstacle[::2, ::2], sim.obstacle[10:31, 5:26]))
+        # the whole ring and the restricted gridpoints are fluid
+        self.assertFalse(np.any(block.sim.obstacle.flat[block.ring]))
+        self.assertFalse(np.any(block.sim.obstacle.flat[block.inner]))
+        self.assertFalse(np.any(sim.obstacle.flat[block.inner_targets]))
+
+    def test_uniform_flow(self):
+        """
+        Unittest for the coupling
+
+        A uniform flow in equilibrium stays unchanged in the simulation and in the blocks.
+        """
+
+        sim = channel_simulation(40, 30)
+        sim.obstacle[:] = False
+        sim.boundarys = dict.fromkeys("NESW", "periodic")
+        utilities.compile_stream_plan(sim)
+        utilities.compile_bounce_back_links(sim)
+        utilities.compile_boundary_plan(sim)
+        sim.rho[:] = 1
+        sim.vel[0] = 0.05
+        sim.vel[1] = -0.02
+        sim.calc_equilibrium()
+        sim.f_in[:] = sim.f_eq
+        control = sim.f_in.copy()
+
+        backend = refined_simulation(sim, [{
+            "x-range": [5, 20], "y-range": [8, 22],
+            "refinement": [{"x-range": [4, 12], "y-range": [4, 12]}]
+        }], [])
+        for _ in range(5):
+            backend.step(sim)
+        backend.finish(sim)
+
+        self.assertTrue(np.allclose(sim.f_in, control, rtol=1e-12, atol=1e-14))
+        for block in (sim.refinement_blocks[0], sim.refinement_blocks[0].children[0]):
+            self.assertTrue(np.allclose(block.sim.vel[0], 0.05, rtol=1e-12))
+            self.assertTrue(np.allclose(block.sim.vel[1], -0.02, rtol=1e-12))
+
+    def test_channel(self):
+        """
+        Unittest for a refined channel flow around a cylinder
+
+        The refined simulation stays stable and close to the unrefined one,
+        the flow inside the block is resolved on the block.
+        """
+
+        control = channel_simulation(60, 30)
+        control.prepare_simulation()
+        sim = channel_simulation(60, 30)
+        sim.prepare_simulation()
+        backend = refined_simulation(sim, [{"x-range": [10, 35], "y-range": [5, 25]}], CYLINDER)
+        for _ in range(300):
+            control.do_simulation_step()
+            backend.step(sim)
+        backend.finish(sim)
+
+        block = sim.refinement_blocks[0]
+        self.assertTrue(np.all(np.isfinite(sim.f_in)))
+        self.assertTrue(np.all(np.isfinite(block.sim.f_in)))
+        fluid = ~sim.obstacle
+        self.assertLess(np.abs(sim.vel[:, fluid] - control.vel[:, fluid]).max(), 0.01)
+        # the common gridpoints of block and simulation agree
+        fluid = ~block.sim.obstacle[::2, ::2]
+        self.assertLess(np.abs(
+            block.sim.vel[:, ::2, ::2][:, fluid] - sim.vel[:, 10:36, 5:26][:, fluid]
+        ).max(), 0.005)
+
+    def test_uncovered_rectangles(self):
+        """
+        Unittest for uncovered_rectangles
+
+        The rectangles cover every gridpoint outside of the holes exactly once,
+        also with overlapping holes and holes on the border.
+        """
+
+        shape = (30, 20)
+        for holes in ([], [(5, 10, 4, 16)], [(5, 10, 4, 16), (20, 25, 2, 6), (20, 25, 10, 18)],
+                      [(5, 15, 4, 12), (10, 20, 8, 16)], [(0, 30, 0, 5), (3, 8, 15, 20)]):
+            count = np.zeros(shape, dtype=int)
+            for x_start, x_stop, y_start, y_stop in refinement.uncovered_rectangles(shape, holes):
+                count[x_start:x_stop, y_start:y_stop] += 1
+            control = np.ones(shape, dtype=int)
+            for x_start, x_stop, y_start, y_stop in holes:
+                control[x_start:x_stop, y_start:y_stop] = 0
+            self.assertTrue(np.array_equal(count, control))
+
+    def test_masked_step(self):
+        """
+        Unittest for leaving the inside of the blocks out of the steps of their parents
+
+        On the fluid gridpoints outside of the holes the simulation and the blocks
+        are bit-identical to a run that computes the whole lattices, also with threads.
+        """
+
+        def run(backend, masked):
+            sim = channel_simulation(60, 30)
+            sim.prepare_simulation()
+            refinement.refinement_definition(sim, [{
+                "x-range": [10, 35], "y-range": [5, 25],
+                "refinement": [{"x-range": [12, 30], "y-range": [8, 32]}]
+            }], CYLINDER)
+            if not masked:
+                for block in (sim.refinement_blocks[0], sim.refinement_blocks[0].children[0]):
+                    block.hole = None
+            backend = refinement.RefinedBackend(backend)
+            backend.prepare(sim)
+            for _ in range(30):
+                backend.step(sim)
+            backend.finish(sim)
+            return sim
+
+        def outside(sim, blocks):
+            # fluid gridpoints of a lattice outside of the holes of its blocks
+            points = ~sim.obstacle
+            for block in blocks:
+                points[block.hole[0]:block.hole[1], block.hole[2]:block.hole[3]] = False
+            return points
+
+        control = run(backends.NumpyBackend(), False)
+        for backend in (backends.NumpyBackend(), backends.ThreadedBackend(3)):
+            sim = run(backend, True)
+            block = sim.refinement_blocks[0]
+            child = block.children[0]
+            # both holes cover at least half of the height of their parent, so they are left out
+            self.assertEqual(len(refinement.lattice_pieces(sim, [block])[2]), 1)
+            self.assertEqual(len(block.holes), 1)
+            for masked, unmasked, blocks in (
+                    (sim, control, [block]),
+                    (block.sim, control.refinement_blocks[0].sim, [child]),
+                    (child.sim, control.refinement_blocks[0].children[0].sim, [])):
+                points = outside(masked, blocks)
+                self.assertTrue(np.array_equal(masked.f_in[:, points], unmasked.f_in[:, points]))
+                self.assertTrue(np.array_equal(masked.vel[:, points], unmasked.vel[:, points]))
+            self.assertTrue(np.array_equal(
+                utilities.component_rows(sim.f_in)[:, block.inner_targets],
+                utilities.component_rows(control.f_in)[:, block.inner_targets]
+            ))
+            # after the run density and velocity are also set inside the holes
+            self.assertTrue(np.all(np.isfinite(sim.vel)))
+            self.assertTrue(np.allclose(sim.rho[~sim.obstacle], 1, atol=0.1))
+
+    def test_rescale(self):
+        """
+        Unittest for rescale
+
+        Rescaling keeps the density and the velocity and scales the non-equilibrium part.
+        """
+
+        sim = channel_simulation(60, 30)
+        sim.prepare_simulation()
+        for _ in range(50):
+            sim.do_simulation_step()
+        fluid = np.flatnonzero(~sim.obstacle)
+        packed = refinement.packed_simulation(sim, len(fluid))
+        packed.f_in[:, :, 0] = utilities.component_rows(sim.f_in)[:, fluid]
+        refinement.rescale(packed, 0.5)
+        rescaled = refinement.packed_simulation(sim, len(fluid))
+        rescaled.f_in[:] = packed.f_in
+        rescaled.calc_macroscopic()
+
+        self.assertTrue(np.allclose(rescaled.rho, packed.rho, rtol=1e-12))
+        self.assertTrue(np.allclose(rescaled.vel, packed.vel, atol=1e-14))
+        self.assertTrue(np.allclose(
+            packed.f_in - packed.f_eq,
+            (utilities.component_rows(sim.f_in)[:, fluid] - packed.f_eq[:, :, 0])[:, :, None] / 2,
+            atol=1e-14
+        ))
+
+    def test_invalid_block(self):
+        """
+        Unittest for the validation of the blocks
+
+        Blocks outside of their parent or on its border are rejected.
+        """
+
+        for block_parameters in ({"x-range": [0, 20], "y-range": [5, 25]},
+                                 {"x-range": [10, 59], "y-range": [5, 25]},
+                                 {"x-range": [10, 12], "y-range": [5, 25]}):
+            sim = channel_simulation(60, 30)
+            with self.assertRaises(SystemExit):
+                refinement.refinement_definition(sim, [block_parameters], CYLINDER)
+
+
+if __name__ == '__main__':
+    unittest.main()
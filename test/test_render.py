@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the lightweight picture renderer
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import matplotlib.colors as colors
+import matplotlib.image as img
+import matplotlib.pyplot as plt
+from src import render, utilities
+from test.test_Simulation import channel_simulation
+
+
+class test_render(unittest.TestCase):
+    """
+    Unittestclass for the render module
+    """
+
+    def setUp(self):
+        """
+        Create a temporary output directory
+        and a field with values below, inside and above the limits
+        """
+        self.output = tempfile.mkdtemp() + os.sep
+        self.values = np.linspace(-0.001, 0.005, 60 * 40).reshape(60, 40)
+
+    def tearDown(self):
+        """
+        Remove the temporary output directory
+        """
+        shutil.rmtree(self.output)
+
+    def test_colors(self):
+        """
+        Colors and orientation are the same as those of imshow(values.T, origin='lower')
+        """
+
+        image = render.render_frame(self.values, 0, 0.004, render.lookup_table())
+        cmap = plt.get_cmap()
+        control = cmap(colors.Normalize(0, 0.004)(self.values.T[::-1]), bytes=True)[..., :3]
+        self.assertEqual(image.shape, (40, 60, 3))
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertTrue(np.array_equal(image, control))
+
+    def test_non_finite(self):
+        """
+        NaN and -inf get the first color, inf the last one
+        """
+
+        table = render.lookup_table()
+        self.values[10, :] = np.nan
+        self.values[20, :] = -np.inf
+        self.values[30, :] = np.inf
+        image = render.render_frame(self.values, 0, 0.004, table)
+        self.assertTrue(np.all(image[:, 10] == table[0]))
+        self.assertTrue(np.all(image[:, 20] == table[0]))
+        self.assertTrue(np.all(image[:, 30] == table[-1]))
+        finite = np.isfinite(self.values.T[::-1])
+        control = render.render_frame(np.where(np.isfinite(self.values), self.values, 0),
+                                      0, 0.004, table)
+        self.assertTrue(np.array_equal(image[finite], control[finite]))
+
+    def test_png(self):
+        """
+        Written PNG files decode to the rendered image
+        """
+
+        image = render.render_frame(self.values, 0, 0.004, render.lookup_table("magma"))
+        render.write_png(self.output + "frame.png", image)
+        decoded = img.imread(self.output + "frame.png")
+        self.assertTrue(np.array_equal((decoded[..., :3] * 255).round().astype(np.uint8), image))
+
+    def test_picture_output(self):
+        """
+        The fast renderer writes png and raw pictures at the output steps
+        """
+
+        for file_type in ("png", "rgb"):
+            sim = channel_simulation(60, 40)
+            sim.args.output = self.output + file_type + os.sep
+            utilities.initialize_output(sim, {"picture output configuration": {
+                "file name": "velocity", "file type": file_type,
+                "output frequency": 2, "renderer": "fast"
+            }})
+            sim.step_offset = 0
+            sim.prepare_simulation()
+            for step in range(1, 5):
+                sim.do_simulation_step()
+                utilities.store_output(sim, step)
+            self.assertEqual(sorted(os.listdir(sim.args.output)),
+                             ["velocity00002." + file_type, "velocity00004." + file_type])
+        raw = np.fromfile(self.output + "rgb/velocity00004.rgb", dtype=np.uint8).reshape(40, 60, 3)
+        png = img.imread(self.output + "png/velocity00004.png")[..., :3]
+        self.assertTrue(np.array_equal((png * 255).round().astype(np.uint8), raw))
+
+
+if __name__ == '__main__':
+    unittest.main()
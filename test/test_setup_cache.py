@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the setup cache
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+import matplotlib.image as img
+import numpy as np
+from src.d2q9_simulation import Simulation
+from src import setup_cache, utilities
+
+#: boundary conditions of a channel
+CHANNEL = {
+    "N": {"type": "bounce_back"},
+    "E": {"type": "outflow"},
+    "S": {"type": "bounce_back"},
+    "W": {"type": "zou-he", "v_x": 0.04, "v_y": 0}
+}
+
+
+def cached_simulation(cache, obstacle_parameters, boundary_conditions=CHANNEL, tau=0.8,
+                      show_obstacle=False):
+    """
+    Set up a Simulation of 60x40 gridpoints with the setup cache.
+
+    :param cache: SetupCache instance, *None* to set everything up
+    :param obstacle_parameters: obstacle parameters like in an inputfile
+    :param boundary_conditions: boundary conditions like in an inputfile
+    :param tau: relaxation parameter
+    :param show_obstacle: value of the *-\\-show_obstacle* argument
+    :return: Simulation instance
+    """
+
+    sim = Simulation()
+    sim.args = argparse.Namespace(show_obstacle=show_obstacle, snapshot=None, resume=False)
+    utilities.simulation_parameters_definition(sim, {
+        "simulation name": "test",
+        "simulation id": "000",
+        "time steps": 10,
+        "step offset": 0,
+        "lattice points x": 60,
+        "lattice points y": 40,
+        "tau": tau
+    })
+    setup_cache.geometry_definition(sim, obstacle_parameters, boundary_conditions, cache)
+    return sim
+
+
+class test_setup_cache(unittest.TestCase):
+    """
+    Unittestclass for the setup_cache module
+    """
+
+    def setUp(self):
+        """
+        Create a temporary cache directory and obstacles
+        """
+        self.directory = tempfile.mkdtemp() + os.sep
+        self.cache = setup_cache.SetupCache(self.directory + "cache", 2**20)
+        self.cylinders = [{"type": "cylindrical obstacle",
+                           "x-position": [15, 30, 45], "y-position": [20, 10, 25], "radius": 5}]
+
+    def tearDown(self):
+        """
+        Remove the temporary cache directory
+        """
+        shutil.rmtree(self.directory)
+
+    def test_cached_geometry(self):
+        """
+        Unittest for geometry_definition
+
+        A simulation set up from the cache is the same as one set up without,
+        parameters that do not change the geometry use the same entry.
+        """
+
+        control = cached_simulation(None, self.cylinders)
+        cached_simulation(self.cache, self.cylinders)
+        sim = cached_simulation(self.cache, self.cylinders, tau=0.6)
+        self.assertEqual(len(self.cache.entries()), 1)
+
+        self.assertTrue(np.array_equal(sim.obstacle, control.obstacle))
+        self.assertTrue(np.array_equal(sim.bounce_back_destination,
+                                       control.bounce_back_destination))
+        self.assertTrue(np.array_equal(sim.bounce_back_source, control.bounce_back_source))
+        self.assertEqual(sim.boundarys, control.boundarys)
+        self.assertEqual(len(sim.zou_he_macroscopic_plan), len(control.zou_he_macroscopic_plan))
+
+        sim = cached_simulation(self.cache, self.cylinders)
+        control.prepare_simulation()
+        sim.prepare_simulation()
+        for _ in range(10):
+            control.do_simulation_step()
+            sim.do_simulation_step()
+        self.assertTrue(np.array_equal(sim.f_in, control.f_in))
+
+        # a different geometry gets its own entry
+        cached_simulation(self.cache, [dict(self.cylinders[0], radius=6)])
+        cached_simulation(self.cache, self.cylinders, dict(CHANNEL, E={"type": "bounce_back"}))
+        self.assertEqual(len(self.cache.entries()), 3)
+
+    def test_setup_work(self):
+        """
+        Unittest for the work done by geometry_definition
+
+        A miss finds the bounce back links once and a hit not at all.
+        All paths show the same obstacle, before the walls of the borders are added.
+        """
+
+        shown = []
+
+        def show_obstacle(sim):
+            shown.append(sim.obstacle.copy())
+
+        with mock.patch.object(utilities, "bounce_back_links",
+                               wraps=utilities.bounce_back_links) as links, \
+                mock.patch.object(utilities, "show_obstacle", show_obstacle):
+            control = cached_simulation(None, self.cylinders, show_obstacle=True)
+            self.assertEqual(links.call_count, 1)
+            cached_simulation(self.cache, self.cylinders, show_obstacle=True)
+            self.assertEqual(links.call_count, 2)
+            sim = cached_simulation(self.cache, self.cylinders, show_obstacle=True)
+            self.assertEqual(links.call_count, 2)
+
+        self.assertEqual(len(shown), 3)
+        for obstacle in shown:
+            self.assertTrue(np.array_equal(obstacle, shown[0]))
+        self.assertFalse(np.any(shown[0][:, [0, -1]]))
+        self.assertTrue(np.all(sim.obstacle[:, [0, -1]]))
+        self.assertTrue(np.array_equal(sim.obstacle, control.obstacle))
+
+    def test_png_key(self):
+        """
+        Unittest for setup_key
+
+        The key depends on the content of png files, not on their name.
+        """
+
+        sim = cached_simulation(None, [])
+        path = self.directory + "obstacle.png"
+        image = np.ones(shape=(40, 60, 4))
+        img.imsave(path, image)
+        first = setup_cache.setup_key(sim, [{"type": "png import", "file name": path}], CHANNEL)
+        image[10:20, 10:20, :3] = 0
+        img.imsave(path, image)
+        second = setup_cache.setup_key(sim, [{"type": "png import", "file name": path}], CHANNEL)
+        self.assertNotEqual(first, second)
+
+        velocities = dict(CHANNEL, W={"type": "zou-he", "v_x": 0.1, "v_y": 0})
+        self.assertEqual(setup_cache.setup_key(sim, [], CHANNEL),
+                         setup_cache.setup_key(sim, [], velocities))
+
+    def test_eviction(self):
+        """
+        Unittest for SetupCache.evict
+
+        The least recently used entries are removed when the cache is full.
+        """
+
+        array = np.zeros(1000, dtype=np.float64)
+        cache = setup_cache.SetupCache(self.directory + "small", 2.5 * array.nbytes)
+        for key in ("a", "b"):
+            cache.store(key, {"array": array})
+            time.sleep(0.01)
+        self.assertIsNotNone(cache.load("a", ("array",)))
+        time.sleep(0.01)
+        cache.store("c", {"array": array})
+
+        self.assertEqual(sorted(key for _, _, key in cache.entries()), ["a", "c"])
+        self.assertIsNone(cache.load("b", ("array",)))
+        loaded = cache.load("c", ("array",))
+        self.assertTrue(np.array_equal(loaded["array"], array))
+
+        # a single entry is kept even if it is larger than the cache
+        cache.store("d", {"array": np.zeros(10000)})
+        self.assertEqual([key for _, _, key in cache.entries()], ["d"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Unittests for the background output writer
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from src import utilities
+from src.writer import OutputWriter
+from test.test_Simulation import channel_simulation
+
+
+class test_writer(unittest.TestCase):
+    """
+    Unittestclass for OutputWriter
+    """
+
+    def setUp(self):
+        """
+        Create a temporary output directory
+        """
+        self.output = tempfile.mkdtemp() + os.sep
+
+    def tearDown(self):
+        """
+        Remove the temporary output directory
+        """
+        shutil.rmtree(self.output)
+
+    def run_channel(self, frames, name, raw_parameters=None, snapshot_parameters=None):
+        """
+        Run a channel flow with raw output and snapshots at every second step.
+
+        :param frames: number of frames of the writer, 0 for synchronous output
+        :param name: file name of the raw output
+        :param raw_parameters: further parameters of the raw data output configuration
+        :param snapshot_parameters: further parameters of the snapshots
+        :return: OutputWriter after it was closed
+        """
+
+        sim = channel_simulation(60, 40)
+        sim.args.output = self.output + name + os.sep
+        raw_parameter = {"file name": name, "output frequency": 2}
+        raw_parameter.update(raw_parameters or {})
+        snapshot_parameter = {"output frequency": 2}
+        snapshot_parameter.update(snapshot_parameters or {})
+        utilities.initialize_output(sim, {
+            "raw data output configuration": raw_parameter,
+            "snapshot": snapshot_parameter
+        })
+        sim.step_offset = 0
+        sim.prepare_simulation()
+
+        output_writer = OutputWriter(sim, frames)
+        for step in range(1, 11):
+            sim.do_simulation_step()
+            output_writer.submit(step)
+        output_writer.close()
+        utilities.close_output(sim)
+        return output_writer
+
+    def test_same_output(self):
+        """
+        Output of the background writer is the same as the synchronous output,
+        although the simulation changes the arrays after every submit
+        """
+
+        self.run_channel(0, "sync")
+        self.run_channel(1, "async")
+
+        with h5py.File(self.output + "sync/sync.hdf5", "r") as sync, \
+                h5py.File(self.output + "async/async.hdf5", "r") as async_file:
+            group = "raw data output configuration/velocity"
+            self.assertEqual(sorted(sync[group]), sorted(async_file[group]))
+            for name in sync[group]:
+                self.assertTrue(np.array_equal(sync[group][name], async_file[group][name]))
+        for step in range(2, 11, 2):
+            snapshot = "snapshots/snap_%05i.npy" % step
+            self.assertTrue(np.array_equal(
+                np.load(self.output + "sync/" + snapshot),
+                np.load(self.output + "async/" + snapshot)
+            ))
+
+    def test_chunked_layout(self):
+        """
+        The chunked, compressed layout holds the same frames as one dataset per step
+        """
+
+        self.run_channel(0, "datasets")
+        self.run_channel(1, "chunked",
+                         {"layout": "chunked", "compression": "gzip", "shuffle": True})
+
+        with h5py.File(self.output + "datasets/datasets.hdf5", "r") as datasets, \
+                h5py.File(self.output + "chunked/chunked.hdf5", "r") as chunked:
+            group = "raw data output configuration"
+            self.assertEqual(chunked[group]["velocity"].shape, (5, 2, 60, 40))
+            self.assertEqual(chunked[group]["velocity"].chunks, (1, 2, 60, 40))
+            for field in ("velocity", "density"):
+                control_steps, control_frames = utilities.raw_output_frames(datasets[group], field)
+                steps, frames = utilities.raw_output_frames(chunked[group], field)
+                self.assertEqual(control_steps, [2, 4, 6, 8, 10])
+                self.assertEqual(steps, control_steps)
+                for n in range(len(steps)):
+                    self.assertTrue(np.array_equal(control_frames[n][()], frames[n]))
+
+    def test_snapshot_restart(self):
+        """
+        A restart from a memory-mapped snapshot takes its step and continues bit-identically
+        """
+
+        self.run_channel(0, "run")
+        with open(self.output + "run/snapshots/snap_00004.json") as metadata_file:
+            metadata = json.load(metadata_file)
+        self.assertEqual(metadata["step"], 4)
+        self.assertEqual(metadata["precision"], "float64")
+
+        sim = channel_simulation(60, 40)
+        self.assertEqual(metadata["geometry"], utilities.geometry_hash(sim))
+        sim.args.snapshot = self.output + "run/snapshots/snap_00004.npy"
+        sim.prepare_simulation()
+        self.assertEqual(sim.step_offset, 4)
+        self.assertIsInstance(sim.f_in.base, np.memmap)
+        for _ in range(6):
+            sim.do_simulation_step()
+        control = np.load(self.output + "run/snapshots/snap_00010.npy")
+        self.assertTrue(np.array_equal(sim.f_in, control))
+
+    def test_compressed_snapshot(self):
+        """
+        Compressed single precision snapshots restore the distribution function
+        within float32 accuracy
+        """
+
+        self.run_channel(0, "control")
+        self.run_channel(0, "small",
+                         snapshot_parameters={"compressed": True, "precision": "float32"})
+        self.assertFalse(os.path.exists(self.output + "small/snapshots/snap_00004.npy"))
+
+        sim = channel_simulation(60, 40)
+        sim.args.snapshot = self.output + "small/snapshots/snap_00004.npz"
+        sim.prepare_simulation()
+        self.assertEqual(sim.step_offset, 4)
+        self.assertEqual(sim.f_in.dtype, np.float64)
+        control = np.load(self.output + "control/snapshots/snap_00004.npy")
+        self.assertTrue(np.allclose(sim.f_in, control, rtol=1e-6, atol=0))
+        self.assertFalse(np.array_equal(sim.f_in, control))
+
+    def test_error(self):
+        """
+        A failing writer aborts the simulation at the next submit
+        """
+
+        sim = channel_simulation(60, 40)
+        sim.raw_output = sim.picture_output = sim.checkpoint = False
+        sim.snapshot = True
+        sim.snapshot_frequency = 1
+        sim.snapshot_compressed = False
+        sim.snapshot_precision = None
+        sim.step_offset = 0
+        sim.args.output = self.output + "missing" + os.sep
+        sim.prepare_simulation()
+
+        output_writer = OutputWriter(sim, 1)
+        with self.assertRaises(SystemExit):
+            for step in range(1, 4):
+                output_writer.submit(step)
+            output_writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()